@@ -0,0 +1,212 @@
+"""
+Command line administration of the ranalyze database
+usage:
+    python -m ranalyze archive [--batches N]
+    python -m ranalyze benchmark-expressions [--run] [--repeat N]
+    python -m ranalyze benchmark-search EXPRESSION... [--repeat N]
+    python -m ranalyze drop-partitions BEFORE [--archive]
+    python -m ranalyze dump TABLE FILE
+    python -m ranalyze index [--merge]
+    python -m ranalyze load TABLE FILE
+    python -m ranalyze migrate [--target VERSION]
+    python -m ranalyze partition [--ahead MONTHS]
+"""
+
+import argparse
+import datetime
+import time
+
+from .archive import archive_entries, entry_tables
+from .constants import PARTITION_MONTHS_AHEAD, TABLE_FIELDS
+from .database import dump_table, execute_query, load_file
+from .migrations import LATEST_VERSION, migrate
+from .partitions import drop_partitions, ensure_partitions
+from .query import SelectQuery
+from .search import (
+    build_index,
+    compile_expression,
+    expression_to_tree,
+    search,
+    tree_to_condition
+)
+from .textindex import get_index
+
+# Expressions which compile to needlessly large SQL without normalization
+PATHOLOGICAL_EXPRESSIONS = {
+    "nested": "(" * 60 + "'reddit'" + ")" * 60,
+    "duplicates": " OR ".join(["'reddit'"] * 100),
+    "contradiction": "'reddit' AND 'python' AND NOT 'reddit'",
+    "absorption": " OR ".join(["'reddit'"] + ["('reddit' AND 'w{}')".format(i)
+                                              for i in range(30)]),
+    "and-of-ors": " AND ".join(["('reddit' OR 'python' OR 'w{}')".format(i)
+                                for i in range(20)])
+}
+
+
+def archive(args):
+    moved = archive_entries(max_batches=args.batches)
+    print("moved {} entries to the archive tier".format(moved))
+
+
+def benchmark_expressions(args):
+    for name, expression in sorted(PATHOLOGICAL_EXPRESSIONS.items()):
+        started = time.monotonic()
+        raw = tree_to_condition(expression_to_tree(expression))
+        raw_time = time.monotonic() - started
+        compile_expression.cache_clear()
+        started = time.monotonic()
+        compiled = tree_to_condition(compile_expression(expression))
+        cold_time = time.monotonic() - started
+        started = time.monotonic()
+        tree_to_condition(compile_expression(expression))
+        cached_time = time.monotonic() - started
+        print("{:<14} raw {:>6} chars {:>4} params {:>8.2f} ms  "
+              "compiled {:>6} chars {:>4} params {:>8.2f} ms cold "
+              "{:>8.2f} ms cached".format(
+                  name, len(raw.sql), len(raw.params), raw_time * 1000,
+                  len(compiled.sql), len(compiled.params), cold_time * 1000,
+                  cached_time * 1000))
+        if not args.run:
+            continue
+        counts = {}
+        for label, condition in (("raw", raw), ("compiled", compiled)):
+            query = SelectQuery(table=entry_tables(), columns="COUNT(*)",
+                                where=condition)
+            started = time.monotonic()
+            for _ in range(args.repeat):
+                result = execute_query(query, transpose=False)
+            elapsed = (time.monotonic() - started) / args.repeat
+            counts[label] = result[0]["COUNT(*)"]
+            print("{:<14} {:<8} {:>10} matches {:>10.1f} ms".format(
+                name, label, counts[label], elapsed * 1000))
+        if counts["raw"] != counts["compiled"]:
+            print("counts differ for", name)
+
+
+def benchmark_search(args):
+    for expression in args.expressions:
+        results = {}
+        for name, fulltext, index in (("LIKE", False, False),
+                                      ("FULLTEXT", True, False),
+                                      ("INDEX", True, True)):
+            started = time.monotonic()
+            for _ in range(args.repeat):
+                count = search(expression=expression, limit=1,
+                               include_count=True, fulltext=fulltext,
+                               index=index, cached=False)[1]
+            elapsed = (time.monotonic() - started) / args.repeat
+            results[name] = count
+            print("{:<8} {:>10} matches {:>10.1f} ms  {}".format(
+                name, count, elapsed * 1000, expression))
+        if len(set(results.values())) > 1:
+            print("counts differ for", expression)
+
+
+def drop(args):
+    dropped = drop_partitions(args.before, archive=args.archive)
+    print("dropped partitions", dropped)
+
+
+def dump(args):
+    count = dump_table(args.table, args.file)
+    print("dumped {} rows from {} to {}".format(count, args.table, args.file))
+
+
+def index(args):
+    if args.merge:
+        merged = 0
+        while get_index().merge():
+            merged += 1
+        print("merged {} runs of index segments".format(merged))
+    else:
+        count = build_index()
+        print("indexed {} entries".format(count))
+    print(get_index().stats())
+
+
+def load(args):
+    count = load_file(args.file, args.table)
+    print("loaded {} into {} ({} rows affected)".format(args.file, args.table,
+                                                        count))
+
+
+def migrate_schema(args):
+    applied = migrate(args.target)
+    print("applied migrations", applied)
+
+
+def partition(args):
+    created = ensure_partitions(args.ahead)
+    print("created partitions", created)
+
+
+def _date(text):
+    try:
+        return datetime.datetime.strptime(text, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected a YYYY-MM-DD date, got {!r}".format(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="ranalyze")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    for name, action, help_text in (
+            ("dump", dump, "write a table to a tab separated file"),
+            ("load", load, "bulk load a tab separated file into a table")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("table", choices=sorted(TABLE_FIELDS))
+        command.add_argument("file")
+        command.set_defaults(action=action)
+
+    command = commands.add_parser("archive",
+                                  help="move old entries to the archive tier")
+    command.add_argument("--batches", type=int, default=None)
+    command.set_defaults(action=archive)
+
+    command = commands.add_parser(
+        "benchmark-expressions",
+        help="compare raw and normalized SQL of pathological expressions")
+    command.add_argument("--run", action="store_true")
+    command.add_argument("--repeat", type=int, default=3)
+    command.set_defaults(action=benchmark_expressions)
+
+    command = commands.add_parser(
+        "benchmark-search",
+        help="time search expressions with LIKE, FULLTEXT and the text index")
+    command.add_argument("expressions", nargs="+")
+    command.add_argument("--repeat", type=int, default=3)
+    command.set_defaults(action=benchmark_search)
+
+    command = commands.add_parser(
+        "drop-partitions",
+        help="drop the entries partitions of months before a date")
+    command.add_argument("before", type=_date)
+    command.add_argument("--archive", action="store_true",
+                         help="move the entries to the archive tier first")
+    command.set_defaults(action=drop)
+
+    command = commands.add_parser("index",
+                                  help="rebuild the text index of entries")
+    command.add_argument("--merge", action="store_true",
+                         help="only merge the index's small segments")
+    command.set_defaults(action=index)
+
+    command = commands.add_parser("migrate",
+                                  help="upgrade the database schema")
+    command.add_argument("--target", type=int, default=LATEST_VERSION)
+    command.set_defaults(action=migrate_schema)
+
+    command = commands.add_parser("partition",
+                                  help="create upcoming entries partitions")
+    command.add_argument("--ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    command.set_defaults(action=partition)
+
+    args = parser.parse_args()
+    args.action(args)
+
+
+if __name__ == '__main__':
+    main()
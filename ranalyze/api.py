@@ -8,22 +8,67 @@ to run:
 """
 import flask
 from os import environ, mkdir, path, remove, walk
+import random
 import re
 import scss
 import os
+import threading
 
 from csv import DictWriter
+from functools import wraps
 from io import StringIO
 from itertools import chain
 from jsmin import jsmin
 from tempfile import NamedTemporaryFile
-from .constants import CONFIG_TABLE, ENTRY_FIELDS, ENTRY_TABLE, IMPORT_TABLE, SUBREDDIT_TABLE
-from .database import add_update_object, execute_query
+from .cache import result_cache
+from .constants import (
+    CONFIG_TABLE,
+    ENTRY_FIELDS,
+    ENTRY_TABLE,
+    HEAVY_REQUEST_LIMIT,
+    HEAVY_REQUEST_QUEUE_TIMEOUT,
+    IMPORT_TABLE,
+    OVERVIEW_DEADLINE,
+    SAMPLE_SEED_BITS,
+    SEARCH_DEADLINE,
+    SUBREDDIT_TABLE,
+    THREAD_BREADTH,
+    THREAD_DEPTH
+)
+from .database import (
+    QueryTimeoutError,
+    UnknownColumnError,
+    add_update_object,
+    deadline,
+    execute_query,
+    get_backend,
+    get_entry,
+    pool_stats,
+    read_your_writes
+)
 from .frequency import BLACKLIST, overview
 from .imprt import schedule_for_import
+from .instrumentation import top_templates
 from .models import ConfigEntryFactory, SubredditFactory
-from .query import Condition, DeleteQuery, SelectQuery, UpdateQuery
+from .percolator import (
+    add_standing_query,
+    new_hits,
+    remove_standing_query,
+    standing_queries
+)
+from .query import Condition, DeleteQuery, SelectQuery, UpdateQuery, cache_info
+from .search import (
+    COUNT_CAPPED,
+    COUNT_MODES,
+    HISTOGRAM_INTERVALS,
+    ExpressionError,
+    InvalidCursorError,
+    histogram,
+    page_cursor
+)
 from .search import search as search_db
+from .textindex import get_index
+from .threads import get_thread
 from .utils import iso_to_date, timestamp_to_str
 
 asset_dir = path.join(path.dirname(path.abspath(__file__)), 'assets')
@@ -40,6 +85,83 @@ class CustomFlask(flask.Flask):
 
 app = CustomFlask(__name__, template_folder=template_dir)
 
+# Slots for expensive requests; cheap endpoints are never queued behind them
+heavy_request_slots = threading.BoundedSemaphore(HEAVY_REQUEST_LIMIT)
+
+
+def heavy_request(milliseconds):
+    """
+    Decorator for endpoints running potentially expensive queries. Each
+    statement the endpoint runs is given a deadline of `milliseconds`, and
+    at most HEAVY_REQUEST_LIMIT such requests run at once; further requests
+    wait up to HEAVY_REQUEST_QUEUE_TIMEOUT seconds and are then rejected
+    with a 503. Streamed responses keep their slot until they are closed,
+    and run their queries under a deadline of their own as they stream.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            timeout = HEAVY_REQUEST_QUEUE_TIMEOUT
+            if not heavy_request_slots.acquire(timeout=timeout):
+                return error_response(503, "The server is busy with other "
+                                           "large queries, please try again "
+                                           "in a moment.")
+            try:
+                with deadline(milliseconds):
+                    response = view(*args, **kwargs)
+            except BaseException:
+                heavy_request_slots.release()
+                raise
+            if isinstance(response, flask.Response) and response.is_streamed:
+                response.response = _under_deadline(response.response,
+                                                    milliseconds)
+                response.call_on_close(heavy_request_slots.release)
+            else:
+                heavy_request_slots.release()
+            return response
+        return wrapper
+    return decorator
+
+
+def _under_deadline(iterable, milliseconds):
+    """
+    Iterate a streamed response body with the queries it runs limited by
+    a deadline, as the body is only produced after the view has returned
+    """
+
+    with deadline(milliseconds):
+        yield from iterable
+
+
+def error_response(status, message):
+    """
+    JSON error body with the given HTTP status
+    """
+    response = flask.jsonify({"error": message})
+    response.status_code = status
+    return response
+
+
+@app.errorhandler(QueryTimeoutError)
+def query_timeout(error):
+    return error_response(504, error.message + ", try narrowing the search.")
+
+
+@app.errorhandler(ExpressionError)
+def invalid_expression(error):
+    return error_response(400, error.message)
+
+
+@app.errorhandler(UnknownColumnError)
+def unknown_column(error):
+    return error_response(400, error.message)
+
+
+@app.errorhandler(InvalidCursorError)
+def invalid_cursor(error):
+    return error_response(400, error.message + ", search again from the "
+                                               "first page.")
+
 
 @app.template_global('incl')
 def incl(filename):
@@ -139,13 +261,14 @@ def config_update(_id=None):
     if 'name' not in request or 'value' not in request:
         return flask.abort(400)
     item = ConfigEntryFactory.from_dict(request)
-    insert_id = add_update_object(item, CONFIG_TABLE)
-    if _id is None:
-        _id = insert_id
-    condition = Condition("id", _id)
-    query = SelectQuery(table=CONFIG_TABLE,
-                        where=condition)
-    result = execute_query(query)[0].dict
+    with read_your_writes():
+        insert_id = add_update_object(item, CONFIG_TABLE)
+        if _id is None:
+            _id = insert_id
+        condition = Condition("id", _id)
+        query = SelectQuery(table=CONFIG_TABLE,
+                            where=condition)
+        result = execute_query(query)[0].dict
     return flask.jsonify(result)
 
 
@@ -174,82 +297,165 @@ def entry_import():
 
 
 @app.route('/entry')
+@heavy_request(SEARCH_DEADLINE)
 def entry_query():
     """
     Search wtihout expressions
     on GET: return csv of most recent simple search
     on POST: return JSON of search
+    sample=N returns N random matches instead of a page, drawn with `seed`,
+    or a new seed returned with them so they can be drawn again.
+    Pages sorted on time_submitted or up_votes come with the cursor of the
+    next page, which may be passed back instead of an offset. `count` picks
+    how the total is counted, capped by default. `fields`, a comma separated
+    list of columns, limits the columns returned, and snippets=true adds an
+    excerpt of each entry's text around the terms searched for.
     """
 
     request = flask.request.args
 
-    options = {}
+    options = _search_options(request)
 
     download = False
 
     if "download" in request:
         download = (request["download"].lower() == "true")
 
-    if "subreddit" in request:
-        options["subreddit"] = request.getlist("subreddit")
-
-    if "advanced" in request and request["advanced"].lower() == "true":
-        options["expression"] = request["query"]
-    else:
-        options["keywords"] = request["query"].split()
-
-    options["subreddit_exclude_mode"] = False
-
-    if "subredditMode" in request and request["subredditMode"] == "exclusive":
-        options["subreddit_exclude_mode"] = True
-
     if "order" in request:
         order = request["order"]
         if order[0] == "-":
             order = order[1:] + " DESC"
         options["order"] = order
 
-    # pass through arguments
+    # cursors are validated by the search itself
+
+    if "cursor" in request:
+        options["cursor"] = request["cursor"]
 
-    for key in {"limit", "offset"}:
+    # a limit of 0 would mean no limit at all
+    for key, least in (("limit", 1), ("offset", 0)):
         if key in request:
-            options[key] = request[key]
+            try:
+                options[key] = int(request[key])
+            except ValueError:
+                return flask.abort(400)
+            if options[key] < least:
+                return flask.abort(400)
+
+    # samples are reproducible from the seed returned with them
+    if "sample" in request:
+        try:
+            options["sample"] = int(request["sample"])
+        except ValueError:
+            return flask.abort(400)
+        if options["sample"] < 1:
+            return flask.abort(400)
+        options["seed"] = request.get("seed") or str(
+            random.getrandbits(SAMPLE_SEED_BITS))
+
+    if download:
+        response_options = {
+            "mimetype": 'text/csv',
+            "headers": {"Content-disposition":
+                        "attachment; filename=results.csv"}
+        }
+        return flask.Response(_csv_lines(search_db(stream=True, **options)),
+                              **response_options)
+
+    count_mode = request.get("count", COUNT_CAPPED)
+    if count_mode not in COUNT_MODES:
+        return flask.abort(400)
 
-    for date_key in {"after", "before"}:
-        if date_key in request:
-            options[date_key] = iso_to_date(request[date_key])
+    if "fields" in request:
+        options["fields"] = request["fields"].split(",")
 
-    results, count = search_db(include_count=True, **options)
+    if request.get("snippets", "").lower() == "true":
+        options["snippets"] = True
 
-    entries = [e.dict for e in results]
+    results, count = search_db(include_count=True, count=count_mode,
+                               sliced=True, **options)
 
-    if download and entries:
-        for entry in entries:
-            entry["time_submitted_formatted"] = timestamp_to_str(entry["time_submitted"])
-            entry["time_updated_formatted"] = timestamp_to_str(entry["time_updated"])
-            if "root_id" not in entry:
-                entry["root_id"] = entry["id"]
-        fieldnames = ENTRY_FIELDS | {"time_submitted_formatted", "time_updated_formatted"}
-        with StringIO() as buffer:
-            writer = DictWriter(buffer, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(entries)
-            csv = buffer.getvalue()
-            response_options = {
-                "mimetype": 'text/csv',
-                "headers": {"Content-disposition":
-                            "attachment; filename=results.csv"}
-            }
-            return flask.Response(csv, **response_options)
+    entries = [e if isinstance(e, dict) else e.dict for e in results]
 
     response = {
         "total": count,
+        "totalMode": count.mode,
+        "totalCapped": count.capped,
         "results": entries
     }
 
+    if "sample" in options:
+        response["seed"] = options["seed"]
+    elif results and len(results) == options.get("limit"):
+        cursor = page_cursor(results[-1], options.get("order"))
+        if cursor:
+            response["cursor"] = cursor
+
     return flask.jsonify(response)
 
 
+@app.route('/entry/histogram')
+@heavy_request(SEARCH_DEADLINE)
+def entry_histogram():
+    """
+    Number of entries matching a search, given as to /entry, per `interval`
+    of "day", "week" or "month" (day by default). bySubreddit=true and
+    byType=true split the counts by subreddit and into posts and comments.
+    """
+
+    request = flask.request.args
+
+    options = _search_options(request)
+
+    options["interval"] = request.get("interval", "day")
+    if options["interval"] not in HISTOGRAM_INTERVALS:
+        return flask.abort(400)
+
+    options["by_subreddit"] = request.get("bySubreddit", "").lower() == "true"
+    options["by_type"] = request.get("byType", "").lower() == "true"
+
+    return flask.jsonify({
+        "interval": options["interval"],
+        "buckets": histogram(**options)
+    })
+
+
+@app.route('/entry/<entry_id>')
+def entry_item(entry_id):
+    """
+    A single entry with its full text, from either tier
+    """
+
+    entry = get_entry(entry_id)
+    if entry is None:
+        return flask.abort(404)
+    return flask.jsonify(entry.dict)
+
+
+@app.route('/entry/<entry_id>/thread')
+@heavy_request(SEARCH_DEADLINE)
+def entry_thread(entry_id):
+    """
+    An entry with its nested replies, `depth` levels of them and at most
+    `breadth` replies to each entry. Entries whose replies were left out
+    have their number as `more`, and are loaded with their own thread.
+    """
+
+    request = flask.request.args
+    try:
+        depth = int(request.get("depth", THREAD_DEPTH))
+        breadth = int(request.get("breadth", THREAD_BREADTH))
+    except ValueError:
+        return flask.abort(400)
+    if depth < 0 or breadth < 0:
+        return flask.abort(400)
+
+    thread = get_thread(entry_id, depth=depth, breadth=breadth)
+    if thread is None:
+        return flask.abort(404)
+    return flask.jsonify(thread)
+
+
 @app.route('/entry/subreddits')
 def entry_subreddits():
 
@@ -268,31 +474,33 @@ def entry_subreddits():
 
 
 @app.route('/frequency/overview', methods=['GET'])
+@heavy_request(OVERVIEW_DEADLINE)
 def frequency_overview():
     """
     """
 
     request = flask.request.args
 
-    options = {
-        "gran": request["gran"],
-        "limit": int(request["limit"])
-    }
-    if "year" in request:
-        for key in ("year", "month", "day"):
-            if key in request:
-                options[key] = [int(v) for v in request.getlist(key)]
-
-        return flask.jsonify(overview(**options))
-
-    if "year_before" in request:
-        for key in ("year_before", "month_before", "day_before",
-                    "year_after", "month_after", "day_after"):
-            if key in request:
-                options[key] = int(request[key])
-        return flask.jsonify(overview(**options))
+    try:
+        options = {
+            "gran": request["gran"],
+            "limit": int(request["limit"])
+        }
+        if "year" in request:
+            for key in ("year", "month", "day"):
+                if key in request:
+                    options[key] = [int(v) for v in request.getlist(key)]
+        elif "year_before" in request:
+            for key in ("year_before", "month_before", "day_before",
+                        "year_after", "month_after", "day_after"):
+                if key in request:
+                    options[key] = int(request[key])
+        else:
+            return flask.abort(400)
+    except ValueError:
+        return flask.abort(400)
 
-    return flask.abort(400)
+    return flask.jsonify(overview(**options))
 
 @app.route('/subreddit', methods=["GET"])
 def subreddit_query():
@@ -350,8 +558,136 @@ def subreddit_update(name):
     request = dict(flask.request.get_json())
     request["name"] = name
     item = SubredditFactory.from_dict(request)
-    add_update_object(item, SUBREDDIT_TABLE)
-    return subreddit_item(name, True)
+    with read_your_writes():
+        add_update_object(item, SUBREDDIT_TABLE)
+        return subreddit_item(name, True)
+
+
+@app.route('/standing', methods=["GET"])
+def standing_query_list():
+    """
+    Every standing query with its number of unseen hits
+    """
+
+    return flask.jsonify(standing_queries())
+
+
+@app.route('/standing', methods=["POST"])
+def standing_query_add():
+    """
+    Save a standing query from a JSON body with its `name` and advanced
+    search `expression`
+    """
+
+    request = flask.request.get_json() or {}
+    if not request.get("name") or not request.get("expression"):
+        return flask.abort(400)
+    with read_your_writes():
+        query_id = add_standing_query(request["name"], request["expression"])
+    return flask.jsonify({"id": query_id})
+
+
+@app.route('/standing/<int:query_id>', methods=["DELETE"])
+def standing_query_remove(query_id):
+
+    remove_standing_query(query_id)
+    return flask.jsonify({})
+
+
+@app.route('/standing/<int:query_id>/hits', methods=["GET"])
+def standing_query_hits(query_id):
+    """
+    Entries a standing query matched since its hits were last fetched,
+    oldest first, up to `limit`. They are marked seen unless seen=false.
+    """
+
+    request = flask.request.args
+    try:
+        limit = int(request["limit"]) if "limit" in request else None
+    except ValueError:
+        return flask.abort(400)
+    mark_seen = request.get("seen", "true").lower() != "false"
+    with read_your_writes():
+        hits = new_hits(query_id, limit=limit, mark_seen=mark_seen)
+    if hits is None:
+        return flask.abort(404)
+    return flask.jsonify({"results": [e.dict for e in hits]})
+
+
+@app.route('/status', methods=["GET"])
+def status():
+    """
+    Runtime statistics for this worker process
+    """
+    return flask.jsonify({
+        "backend": get_backend().NAME,
+        "pool": pool_stats(),
+        "result_cache": result_cache.stats(),
+        "sql_cache": cache_info(),
+        "text_index": get_index().stats()
+    })
+
+
+@app.route('/status/queries', methods=["GET"])
+def query_status():
+    """
+    Statement templates of this worker process with the most total
+    execution time, `limit` (default 10) of them
+    """
+    try:
+        limit = int(flask.request.args.get("limit", 10))
+    except ValueError:
+        return flask.abort(400)
+    return flask.jsonify(top_templates(limit))
+
+
+def _search_options(request):
+    """
+    Options of search and histogram common to their endpoints, from the
+    request arguments
+    """
+
+    options = {}
+
+    if "subreddit" in request:
+        options["subreddit"] = request.getlist("subreddit")
+
+    if "advanced" in request and request["advanced"].lower() == "true":
+        options["expression"] = request["query"]
+    else:
+        options["keywords"] = request["query"].split()
+
+    options["subreddit_exclude_mode"] = False
+
+    if "subredditMode" in request and request["subredditMode"] == "exclusive":
+        options["subreddit_exclude_mode"] = True
+
+    for date_key in {"after", "before"}:
+        if date_key in request:
+            options[date_key] = iso_to_date(request[date_key])
+
+    return options
+
+
+def _csv_lines(results):
+    """
+    Lazily render search results as CSV, one line at a time
+    """
+    fieldnames = ENTRY_FIELDS | {"time_submitted_formatted", "time_updated_formatted"}
+    with StringIO() as buffer:
+        writer = DictWriter(buffer, fieldnames=fieldnames)
+        writer.writeheader()
+        for result in results:
+            entry = result.dict
+            entry["time_submitted_formatted"] = timestamp_to_str(entry["time_submitted"])
+            entry["time_updated_formatted"] = timestamp_to_str(entry["time_updated"])
+            if "root_id" not in entry:
+                entry["root_id"] = entry["id"]
+            writer.writerow(entry)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
 
 
 def env_shiv():
@@ -363,12 +699,18 @@ def env_shiv():
     except FileExistsError:
         pass
 
+    environ["OPENSHIFT_DATA_DIR"] = "/tmp/ranalyze"
+
+    # local SQLite installs need no MySQL server
+    if "MYSQL_DB_HOST" not in environ:
+        return
+
     environ.update({
-        "OPENSHIFT_DATA_DIR": "/tmp/ranalyze",
         "OPENSHIFT_MYSQL_DB_HOST": environ["MYSQL_DB_HOST"],
         "OPENSHIFT_MYSQL_DB_USERNAME": environ["MYSQL_DB_USER"],
         "OPENSHIFT_MYSQL_DB_PASSWORD": environ["MYSQL_DB_PASSWORD"],
-        "OPENSHIFT_MYSQL_DB_PORT": environ["MYSQL_DB_PORT"]
+        "OPENSHIFT_MYSQL_DB_PORT": environ["MYSQL_DB_PORT"],
+        "OPENSHIFT_MYSQL_DB_REPLICAS": environ.get("MYSQL_DB_REPLICAS", "")
     })
 
 
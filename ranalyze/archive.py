@@ -0,0 +1,101 @@
+"""
+Hot/cold tiering of entries. Entries older than ARCHIVE_AGE_DAYS are moved
+from the entries table into an archive table whose title and text are
+compressed with MySQL's COMPRESS(). The archive is read through a view which
+decompresses them, so searches can cover both tiers with the same
+conditions.
+"""
+
+import datetime
+
+from .constants import (
+    ARCHIVE_AGE_DAYS,
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_TABLE,
+    ARCHIVE_VIEW,
+    COMPRESSED_FIELDS,
+    ENTRY_COLUMNS,
+    ENTRY_TABLE
+)
+from .database import execute_transaction, version_bump_query
+from .query import PLACEHOLDER, DeleteQuery, RawQuery, dialect, time_range
+from .utils import date_to_timestamp
+
+_COPY_FORMAT = ("INSERT INTO {archive} ({columns}) "
+                "SELECT {values} FROM {source} {clauses} {upsert}")
+
+_MOVE_CLAUSES = ("WHERE time_submitted < {0} ORDER BY time_submitted, id "
+                 "LIMIT {0}".format(PLACEHOLDER))
+
+
+def archive_cutoff():
+    """
+    Unix timestamp before which entries belong in the archive tier
+    """
+
+    cutoff = (datetime.datetime.utcnow()
+              - datetime.timedelta(days=ARCHIVE_AGE_DAYS))
+    return date_to_timestamp(cutoff)
+
+
+def archive_entries(batch_size=ARCHIVE_BATCH_SIZE, max_batches=None):
+    """
+    Incrementally move entries older than the archive cutoff into the
+    archive tier, oldest first, `batch_size` entries per transaction, until
+    none are left or `max_batches` batches have been moved.
+    :return: number of entries moved
+    """
+
+    move_sql = copy_sql(ENTRY_TABLE, _MOVE_CLAUSES)
+
+    cutoff = archive_cutoff()
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        # both statements read the same oldest rows in the same order, and
+        # the insert's locking read keeps them unchanged until the delete;
+        # results cached before the move no longer say which tier holds them
+        queries = (RawQuery(move_sql, (cutoff, batch_size)),
+                   DeleteQuery(ENTRY_TABLE,
+                               time_range("time_submitted", before=cutoff),
+                               order="time_submitted, id",
+                               limit=batch_size),
+                   version_bump_query(ENTRY_TABLE))
+        batch = execute_transaction(queries)[1]
+        moved += batch
+        batches += 1
+        if batch < batch_size:
+            break
+    return moved
+
+
+def copy_sql(source, clauses=""):
+    """
+    Statement copying the entries selected from `source` into the archive
+    tier, compressing their text
+    :param source: table, or table partition, to copy from
+    :param clauses: WHERE/ORDER/LIMIT clauses restricting the copied rows
+    """
+
+    values = ", ".join(["COMPRESS({})".format(c)
+                        if c in COMPRESSED_FIELDS else c
+                        for c in ENTRY_COLUMNS])
+    return _COPY_FORMAT.format(
+        archive=ARCHIVE_TABLE,
+        columns=", ".join(ENTRY_COLUMNS),
+        values=values,
+        source=source,
+        clauses=clauses,
+        upsert=dialect().upsert_clause(ENTRY_COLUMNS))
+
+
+def entry_tables(after=None):
+    """
+    Table, or tuple of tables, holding entries submitted at or after the
+    `after` timestamp: only the hot entries table when every such entry is
+    too recent to have been archived, otherwise both tiers.
+    """
+
+    if after is not None and after >= archive_cutoff():
+        return ENTRY_TABLE
+    return ENTRY_TABLE, ARCHIVE_VIEW
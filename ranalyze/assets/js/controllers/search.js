@@ -9,7 +9,8 @@
             subreddit: [],
             subredditMode: 'inclusive'
         },
-        searchPromise, falseTableTrigger = false;
+        searchPromise, falseTableTrigger = false,
+        RESULT_FIELDS = 'id,permalink,root_id,subreddit,time_submitted,title';
 
         angular.extend(ctrl, {
             search: {
@@ -28,16 +29,36 @@
                         falseTableTrigger = ctrl.results.table.page !== 1;
                         ctrl.results.table.page = 1;
                     }
+                    var table = ctrl.results.table,
+                        pageKey = [table.order, table.limit].join(),
+                        page = table.page;
+                    if (preservePage !== true || pageKey !== ctrl.results.pageKey) {
+                        ctrl.results.cursors = {};
+                        ctrl.results.pageKey = pageKey;
+                    }
+                    // full text is only fetched when an entry is expanded
                     var params = angular.extend({
-                        limit: ctrl.results.table.limit,
-                        order: ctrl.results.table.order,
-                        offset: (ctrl.results.table.page - 1) * ctrl.results.table.limit
+                        fields: RESULT_FIELDS,
+                        limit: table.limit,
+                        order: table.order,
+                        snippets: true
                     }, ctrl.search.form);
+                    // pages following one already fetched seek past it
+                    if (ctrl.results.cursors[page]) {
+                        params.cursor = ctrl.results.cursors[page];
+                    }
+                    else {
+                        params.offset = (page - 1) * table.limit;
+                    }
                     var _execute = function() {
                         searchPromise = models.Entry.search(params)
                             .then(function success(data) {
                                 ctrl.results.count = data.total;
+                                ctrl.results.countCapped = data.totalCapped;
                                 ctrl.results.entries = data.results;
+                                if (data.cursor) {
+                                    ctrl.results.cursors[page + 1] = data.cursor;
+                                }
                                 if (ctrl.results.count === 0) {
                                     $scope.$emit('ranalyze.error', {
                                         title: "No Results",
@@ -57,9 +78,10 @@
                                 else {
                                     ctrl.results.highlight = query.split(" ");
                                 }
-                            }, function failure() {
+                            }, function failure(response) {
                                 $scope.$emit('ranalyze.error', {
-                                    textContent: "Something went wrong while trying to search."
+                                    textContent: (response.data && response.data.error) ||
+                                        "Something went wrong while trying to search."
                                 });
                             });
                     };
@@ -75,7 +97,19 @@
             },
             results: {
                 count: 0,
+                countCapped: false,
+                cursors: {},
                 entries: [],
+                expand: function(entry){
+                    models.Entry.fetch(entry.id).then(function success(data){
+                        entry.text_content = data.text_content;
+                        entry.expanded = true;
+                    }, function failure(){
+                        $scope.$emit('ranalyze.error', {
+                            textContent: "Couldn't get the full text of this entry."
+                        });
+                    });
+                },
                 highlight: [],
                 table: {
                     limit: 10,
@@ -0,0 +1,27 @@
+(function(app){
+"use strict";
+
+    /**
+     *  Directive to display a search snippet as returned by the server,
+     *  whose text is already escaped and whose matches are wrapped in
+     *  mark elements.
+     */
+    var ngSnippetDirective = function(){
+        return {
+            scope: {
+                snippet: '&ngSnippet'
+            },
+            link: function(scope, element) {
+
+                scope.$watch('snippet()', function(snippet){
+                    element.html(snippet || "");
+                });
+
+            },
+            restrict: 'A'
+        }
+    };
+
+    app.directive('ngSnippet', ngSnippetDirective);
+
+})(app);
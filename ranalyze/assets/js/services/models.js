@@ -217,6 +217,9 @@
                     });
                     return Entry.$resource.import(formData).$promise;
                 },
+                fetch: function(id){
+                    return Entry.$resource.get({action: id}).$promise;
+                },
                 importing: false,
                 searchSubreddits: function(name){
                     return Entry.$resource.query({
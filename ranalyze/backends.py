@@ -0,0 +1,562 @@
+"""
+Storage backends.
+
+A backend opens connections to one kind of database and covers the few
+places where its driver, SQL dialect and schema differ from the others;
+everything in database.py above it is written once, against DB-API
+connections and cursors. MySQLBackend talks to the configured MySQL server,
+SQLiteBackend keeps the whole database in a local file (or in memory) for
+small single-node installs and test runs.
+"""
+
+import abc
+import os
+import re
+import sqlite3
+import time
+
+try:
+    import MySQLdb
+    import MySQLdb.cursors
+except ImportError:
+    # installs using only the SQLite backend need not have mysqlclient
+    MySQLdb = None
+
+from functools import lru_cache
+from .constants import (
+    ARCHIVE_TABLE,
+    ARCHIVE_VIEW,
+    CHAR_SET,
+    COMPRESSED_FIELDS,
+    CONFIG_TABLE,
+    DATA_VERSION_TABLE,
+    ENTRY_COLUMNS,
+    ENTRY_TABLE,
+    FREQUENCY_TABLE,
+    FULLTEXT_TABLE,
+    IMPORT_TABLE,
+    POOL_TIMEOUT,
+    SCHEMA_TABLE,
+    SQL_CACHE_SIZE,
+    SQLITE_PROGRESS_STEPS,
+    STANDING_HIT_TABLE,
+    STANDING_QUERY_TABLE,
+    STREAM_WRITE_TIMEOUT,
+    SUBREDDIT_TABLE,
+    VERSIONED_TABLES
+)
+from .query import MYSQL, SQLITE
+from .utils import compress, uncompress
+
+_SELECT_PATTERN = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+
+# MySQLdb style placeholders and escaped percent signs
+_PYFORMAT_PATTERN = re.compile(r"%([s%])")
+
+
+class Backend(object, metaclass=abc.ABCMeta):
+    """
+    Base class for all storage backends
+    """
+
+    NAME = None
+
+    # query.Dialect the backend's SQL is built in
+    DIALECT = None
+
+    # Statement opening an explicit transaction
+    BEGIN = "START TRANSACTION"
+
+    # Prefix turning a statement into a description of its plan
+    EXPLAIN = "EXPLAIN"
+
+    # Whether the backend can read from replicas, bulk load files with LOAD
+    # DATA, range partition tables and apply migrations.py migrations
+    REPLICAS = False
+    LOCAL_INFILE = False
+    PARTITIONS = False
+    MIGRATIONS = False
+
+    # Whether the server runs window functions such as COUNT(*) OVER ()
+    WINDOW_FUNCTIONS = False
+
+    @abc.abstractmethod
+    def connect(self, endpoint=None, **options):
+        """
+        Open a new connection, prepared for use, to the primary database or
+        to a replica "host:port" endpoint
+        """
+        pass
+
+    @abc.abstractmethod
+    def cursor(self, connection, dictionary=False, stream=False):
+        """
+        Open a cursor returning rows as tuples, or as dictionaries keyed by
+        column name. Streaming cursors fetch rows from the server as they
+        are read instead of all at once.
+        """
+        pass
+
+    @abc.abstractmethod
+    def execute(self, cursor, sql, params=None, timeout=None):
+        """
+        Execute a statement, aborting it once `timeout` milliseconds have
+        passed.
+        :return: number of rows affected
+        """
+        pass
+
+    @abc.abstractmethod
+    def schema(self):
+        """
+        Statements (re)creating every table of a new database
+        """
+        pass
+
+    def disconnected(self, error):
+        """
+        Whether a driver error means the server could not be reached
+        """
+
+        return False
+
+    def estimate(self, plan):
+        """
+        Number of rows the optimizer expects a statement to return, from
+        the dictionary rows of its EXPLAIN, or None if the plan gives none
+        """
+
+        return None
+
+    def timed_out(self, error):
+        """
+        Whether a driver error means a statement ran past its timeout
+        """
+
+        return False
+
+
+class MySQLBackend(Backend):
+    """
+    MySQL server, configured through the OpenShift environment unless
+    connection options are given
+    """
+
+    NAME = "mysql"
+    DIALECT = MYSQL
+    REPLICAS = True
+    LOCAL_INFILE = True
+    PARTITIONS = True
+    MIGRATIONS = True
+
+    # MySQL client error codes indicating the server could not be reached
+    _DISCONNECT_ERRORS = {2002, 2003, 2006, 2013}
+
+    # MySQL error code for a statement aborted by MAX_EXECUTION_TIME
+    _TIMEOUT_ERROR = 3024
+
+    def __init__(self, **options):
+        """
+        :param options: MySQLdb.connect() arguments, read from the
+                        environment when none are given
+        """
+        if MySQLdb is None:
+            raise ImportError("The mysql backend requires mysqlclient")
+        self.options = options
+
+    def connect(self, endpoint=None, **options):
+
+        arguments = dict(self.options or _environment_options())
+        if endpoint is not None:
+            host, _, port = endpoint.partition(":")
+            arguments.update(host=host, port=int(port or 3306))
+        arguments.update(options)
+        connection = MySQLdb.connect(charset=CHAR_SET, **arguments)
+        # statements are committed as they run unless an explicit
+        # transaction is started
+        connection.autocommit(True)
+        self.WINDOW_FUNCTIONS = _window_functions(connection.get_server_info())
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SET SESSION sql_mode="
+                           "(SELECT REPLACE(@@sql_mode,'ONLY_FULL_GROUP_BY',''))")
+        finally:
+            cursor.close()
+        return connection
+
+    def cursor(self, connection, dictionary=False, stream=False):
+
+        if stream:
+            cursor = connection.cursor(MySQLdb.cursors.SSDictCursor
+                                       if dictionary
+                                       else MySQLdb.cursors.SSCursor)
+            cursor.execute("SET SESSION net_write_timeout = %s",
+                           (STREAM_WRITE_TIMEOUT,))
+            return cursor
+        return connection.cursor(MySQLdb.cursors.DictCursor if dictionary
+                                 else MySQLdb.cursors.Cursor)
+
+    def execute(self, cursor, sql, params=None, timeout=None):
+
+        # the timeout is pushed down to the server as a hint, which MySQL
+        # only honours on SELECT statements
+        if timeout is not None and _SELECT_PATTERN.match(sql):
+            hint = "SELECT /*+ MAX_EXECUTION_TIME({}) */".format(timeout)
+            sql = _SELECT_PATTERN.sub(hint, sql, count=1)
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+    def schema(self):
+        """
+        Base schema, brought up to date by migrations.migrate()
+        """
+
+        return (
+            "DROP VIEW IF EXISTS {}".format(ARCHIVE_VIEW),
+            "DROP TABLE IF EXISTS {}".format(ARCHIVE_TABLE),
+            "DROP TABLE IF EXISTS {}".format(ENTRY_TABLE),
+            "DROP TABLE IF EXISTS {}".format(FULLTEXT_TABLE),
+            "DROP TABLE IF EXISTS {}".format(FREQUENCY_TABLE),
+            "DROP TABLE IF EXISTS {}".format(CONFIG_TABLE),
+            "DROP TABLE IF EXISTS {}".format(IMPORT_TABLE),
+            "DROP TABLE IF EXISTS {}".format(DATA_VERSION_TABLE),
+            "DROP TABLE IF EXISTS {}".format(STANDING_HIT_TABLE),
+            "DROP TABLE IF EXISTS {}".format(STANDING_QUERY_TABLE),
+            "DROP TABLE IF EXISTS {}".format(SCHEMA_TABLE),
+            """
+            CREATE TABLE {} (
+            id varchar(255) PRIMARY KEY, permalink text, root_id text,
+            up_votes integer, up_ratio real, time_submitted integer,
+            time_updated integer, posted_by text, title text,
+            subreddit text, external_url text, text_content text,
+            parent_id varchar(255), gilded integer, deleted integer,
+            FOREIGN KEY(parent_id) REFERENCES entries(id)
+            )
+            DEFAULT CHARACTER SET {}
+            """.format(ENTRY_TABLE, CHAR_SET),
+            """
+            CREATE TABLE {} (
+            id integer PRIMARY KEY AUTO_INCREMENT, word varchar(255), month integer,
+            day integer, year integer, entries integer, total integer
+            )
+            DEFAULT CHARACTER SET {}
+            """.format(FREQUENCY_TABLE, CHAR_SET),
+            """
+            CREATE TABLE {} (
+            id integer PRIMARY KEY AUTO_INCREMENT, name varchar(255),
+            value varchar(255)
+            )
+            DEFAULT CHARACTER SET {}
+            """.format(CONFIG_TABLE, CHAR_SET),
+            """
+            CREATE TABLE {} (
+            permalink text)
+            DEFAULT CHARACTER SET {}
+            """.format(IMPORT_TABLE, CHAR_SET),
+            # We need a trigger to insert the integer unix timestamp
+            """
+            CREATE TABLE {} (
+            name varchar(20) PRIMARY KEY, scraping integer(1) DEFAULT 0,
+            last_scraped integer, added integer NULL
+            )
+            DEFAULT CHARACTER SET {}
+            """.format(SUBREDDIT_TABLE, CHAR_SET),
+            # Statements are sent one at a time, so the trigger body
+            # needs no client-side delimiter
+            """
+            CREATE TRIGGER tr_sub_added BEFORE INSERT ON {} FOR EACH ROW
+            BEGIN
+              if (new.added is null)
+              then
+                set new.added = unix_timestamp();
+              end if;
+            end
+            """.format(SUBREDDIT_TABLE)
+        )
+
+    def disconnected(self, error):
+
+        return (isinstance(error, MySQLdb.OperationalError)
+                and error.args[0] in self._DISCONNECT_ERRORS)
+
+    def estimate(self, plan):
+
+        # every table read (not the derived tables built from them) adds the
+        # rows it is expected to produce after filtering
+        rows = [step for step in plan
+                if step.get("table") and not step["table"].startswith("<")
+                and step.get("rows") is not None]
+        if not rows:
+            return None
+        return int(sum(step["rows"] * float(step.get("filtered") or 100) / 100
+                       for step in rows))
+
+    def timed_out(self, error):
+
+        return (isinstance(error, MySQLdb.MySQLError) and bool(error.args)
+                and error.args[0] == self._TIMEOUT_ERROR)
+
+
+class SQLiteBackend(Backend):
+    """
+    Embedded SQLite database in write-ahead logging mode, so readers never
+    block the writer. The schema matches the MySQL one after every migration
+    up to SCHEMA_VERSION, less the partitioning.
+    """
+
+    NAME = "sqlite"
+    DIALECT = SQLITE
+    BEGIN = "BEGIN IMMEDIATE"
+    EXPLAIN = "EXPLAIN QUERY PLAN"
+    WINDOW_FUNCTIONS = sqlite3.sqlite_version_info >= (3, 25, 0)
+
+    # Migration version the schema built by schema() corresponds to; SQLite
+    # searches text with LIKE, so needs no FULLTEXT table (migration 4)
+    SCHEMA_VERSION = 7
+
+    def __init__(self, path=":memory:"):
+        """
+        :param path: database file; ":memory:" keeps the database in memory,
+                     shared by every connection for as long as the backend
+                     exists
+        """
+
+        self.path = path
+        self._keep_alive = None
+        if path == ":memory:":
+            self._target = "file:ranalyze-{}?mode=memory&cache=shared".format(
+                id(self))
+            self._keep_alive = self.connect()
+        else:
+            self._target = path
+
+    def connect(self, endpoint=None, **options):
+
+        connection = sqlite3.connect(self._target,
+                                     timeout=POOL_TIMEOUT,
+                                     isolation_level=None,
+                                     check_same_thread=False,
+                                     uri=self._target.startswith("file:"),
+                                     factory=_SQLiteConnection,
+                                     **options)
+        if self.path != ":memory:":
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+        # archived text is stored in MySQL's COMPRESS() format
+        connection.create_function("COMPRESS", 1, compress)
+        connection.create_function("UNCOMPRESS", 1, uncompress)
+        return connection
+
+    def cursor(self, connection, dictionary=False, stream=False):
+
+        # sqlite3 cursors always step through results lazily
+        cursor = connection.cursor()
+        if dictionary:
+            cursor.row_factory = _dict_row
+        return cursor
+
+    def execute(self, cursor, sql, params=None, timeout=None):
+
+        # SQLite cannot time statements out itself, so a progress handler
+        # interrupts them, including any later fetches, once the timeout
+        # has passed
+        if timeout is None:
+            cursor.connection.set_progress_handler(None, 0)
+        else:
+            expires = time.monotonic() + timeout / 1000
+            cursor.connection.set_progress_handler(
+                lambda: time.monotonic() > expires, SQLITE_PROGRESS_STEPS)
+        if params is None:
+            cursor.execute(sql)
+        else:
+            cursor.execute(_qmark(sql), params)
+        return cursor.rowcount
+
+    def schema(self):
+
+        text_columns = ", ".join(["UNCOMPRESS({0}) AS {0}".format(c)
+                                  if c in COMPRESSED_FIELDS else c
+                                  for c in ENTRY_COLUMNS])
+        return (
+            "DROP VIEW IF EXISTS {}".format(ARCHIVE_VIEW),
+            "DROP TABLE IF EXISTS {}".format(ARCHIVE_TABLE),
+            "DROP TABLE IF EXISTS {}".format(ENTRY_TABLE),
+            "DROP TABLE IF EXISTS {}".format(FREQUENCY_TABLE),
+            "DROP TABLE IF EXISTS {}".format(CONFIG_TABLE),
+            "DROP TABLE IF EXISTS {}".format(IMPORT_TABLE),
+            "DROP TABLE IF EXISTS {}".format(DATA_VERSION_TABLE),
+            "DROP TABLE IF EXISTS {}".format(STANDING_HIT_TABLE),
+            "DROP TABLE IF EXISTS {}".format(STANDING_QUERY_TABLE),
+            "DROP TABLE IF EXISTS {}".format(SCHEMA_TABLE),
+            "DROP TABLE IF EXISTS {}".format(SUBREDDIT_TABLE),
+            """
+            CREATE TABLE {} (
+            id varchar(255) PRIMARY KEY, permalink text, root_id varchar(255),
+            up_votes integer, up_ratio real,
+            time_submitted integer NOT NULL DEFAULT 0,
+            time_updated integer, posted_by text, title text,
+            subreddit varchar(255), external_url text, text_content text,
+            parent_id varchar(255), gilded integer, deleted integer
+            )
+            """.format(ENTRY_TABLE),
+            "CREATE INDEX ix_entries_subreddit_time ON {} "
+            "(subreddit, time_submitted)".format(ENTRY_TABLE),
+            # id is not part of SQLite's secondary indexes by itself, and
+            # keyset pages are sorted on it after their sort column
+            "CREATE INDEX ix_entries_time ON {} (time_submitted, id)".format(
+                ENTRY_TABLE),
+            "CREATE INDEX ix_entries_votes ON {} (up_votes, id)".format(
+                ENTRY_TABLE),
+            "CREATE INDEX ix_entries_root ON {} (root_id)".format(ENTRY_TABLE),
+            "CREATE INDEX ix_entries_parent ON {} (parent_id)".format(
+                ENTRY_TABLE),
+            """
+            CREATE TABLE {} (
+            id integer PRIMARY KEY AUTOINCREMENT, word varchar(255),
+            month integer, day integer, year integer, entries integer,
+            total integer
+            )
+            """.format(FREQUENCY_TABLE),
+            "CREATE UNIQUE INDEX ux_frequency_word_day ON {} "
+            "(word, year, month, day)".format(FREQUENCY_TABLE),
+            "CREATE INDEX ix_frequency_day ON {} (year, month, day)".format(
+                FREQUENCY_TABLE),
+            """
+            CREATE TABLE {} (
+            id integer PRIMARY KEY AUTOINCREMENT, name varchar(255),
+            value varchar(255)
+            )
+            """.format(CONFIG_TABLE),
+            "CREATE INDEX ix_config_name ON {} (name)".format(CONFIG_TABLE),
+            "CREATE TABLE {} (permalink text)".format(IMPORT_TABLE),
+            "CREATE INDEX ix_import_permalink ON {} (permalink)".format(
+                IMPORT_TABLE),
+            """
+            CREATE TABLE {} (
+            name varchar(20) PRIMARY KEY, scraping integer DEFAULT 0,
+            last_scraped integer, added integer NULL
+            )
+            """.format(SUBREDDIT_TABLE),
+            """
+            CREATE TRIGGER tr_sub_added AFTER INSERT ON {0} FOR EACH ROW
+            WHEN new.added IS NULL
+            BEGIN
+              UPDATE {0} SET added = CAST(strftime('%s', 'now') AS integer)
+              WHERE name = new.name;
+            END
+            """.format(SUBREDDIT_TABLE),
+            """
+            CREATE TABLE {} (
+            id varchar(255) PRIMARY KEY, permalink text, root_id varchar(255),
+            up_votes integer, up_ratio real, time_submitted integer,
+            time_updated integer, posted_by text, title blob,
+            subreddit varchar(255), external_url text, text_content blob,
+            parent_id varchar(255), gilded integer, deleted integer
+            )
+            """.format(ARCHIVE_TABLE),
+            "CREATE INDEX ix_archive_subreddit_time ON {} "
+            "(subreddit, time_submitted)".format(ARCHIVE_TABLE),
+            "CREATE INDEX ix_archive_time ON {} (time_submitted, id)".format(
+                ARCHIVE_TABLE),
+            "CREATE INDEX ix_archive_votes ON {} (up_votes, id)".format(
+                ARCHIVE_TABLE),
+            "CREATE INDEX ix_archive_root ON {} (root_id)".format(
+                ARCHIVE_TABLE),
+            "CREATE INDEX ix_archive_parent ON {} (parent_id)".format(
+                ARCHIVE_TABLE),
+            "CREATE VIEW {} AS SELECT {} FROM {}".format(
+                ARCHIVE_VIEW, text_columns, ARCHIVE_TABLE),
+            """
+            CREATE TABLE {} (
+            name varchar(64) PRIMARY KEY, version integer NOT NULL DEFAULT 0
+            )
+            """.format(DATA_VERSION_TABLE),
+            "INSERT INTO {} (name, version) VALUES {}".format(
+                DATA_VERSION_TABLE,
+                ", ".join(["('{}', 0)".format(t)
+                           for t in sorted(VERSIONED_TABLES)])),
+            """
+            CREATE TABLE {} (
+            id integer PRIMARY KEY AUTOINCREMENT, name varchar(255) NOT NULL,
+            expression text NOT NULL, created integer,
+            last_seen_hit integer NOT NULL DEFAULT 0
+            )
+            """.format(STANDING_QUERY_TABLE),
+            """
+            CREATE TABLE {} (
+            id integer PRIMARY KEY AUTOINCREMENT, query_id integer NOT NULL,
+            entry_id varchar(255) NOT NULL, matched integer
+            )
+            """.format(STANDING_HIT_TABLE),
+            "CREATE UNIQUE INDEX ux_hits_query_entry ON {} "
+            "(query_id, entry_id)".format(STANDING_HIT_TABLE),
+            "CREATE INDEX ix_hits_query ON {} (query_id, id)".format(
+                STANDING_HIT_TABLE),
+            """
+            CREATE TABLE {} (
+            version integer PRIMARY KEY, description varchar(255),
+            applied integer
+            )
+            """.format(SCHEMA_TABLE),
+            """
+            INSERT INTO {} (version, description, applied)
+            VALUES ({}, 'Created by SQLiteBackend',
+                    CAST(strftime('%s', 'now') AS integer))
+            """.format(SCHEMA_TABLE, self.SCHEMA_VERSION)
+        )
+
+    def timed_out(self, error):
+
+        return (isinstance(error, sqlite3.OperationalError)
+                and str(error) == "interrupted")
+
+
+class _SQLiteConnection(sqlite3.Connection):
+    """
+    sqlite3 connection answering the pool's liveness checks
+    """
+
+    def ping(self):
+        self.execute("SELECT 1")
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def _environment_options():
+    """
+    Connection parameters for the MySQL server configured in the OpenShift
+    environment.
+    """
+
+    return {
+        "host": os.environ['OPENSHIFT_MYSQL_DB_HOST'],
+        "port": int(os.environ['OPENSHIFT_MYSQL_DB_PORT']),
+        "user": os.environ['OPENSHIFT_MYSQL_DB_USERNAME'],
+        "passwd": os.environ['OPENSHIFT_MYSQL_DB_PASSWORD'],
+        "db": 'ranalyze'
+    }
+
+
+def _window_functions(version):
+    """
+    Whether a MySQL server, from its version string, runs window functions:
+    MySQL 8.0 and MariaDB 10.2 onwards do
+    """
+
+    numbers = re.match(r"(\d+)\.(\d+)", version)
+    if numbers is None:
+        return False
+    release = tuple(map(int, numbers.groups()))
+    return release >= ((10, 2) if "mariadb" in version.lower() else (8, 0))
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def _qmark(sql):
+    """
+    Translate MySQLdb style placeholders into sqlite3's
+    """
+
+    return _PYFORMAT_PATTERN.sub(
+        lambda match: "?" if match.group(1) == "s" else "%", sql)
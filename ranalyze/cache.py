@@ -0,0 +1,178 @@
+"""
+In-process cache of search and overview results.
+
+Results are cached per normalized call, with least recently used eviction
+once their estimated size passes RESULT_CACHE_BYTES, and expire after
+RESULT_CACHE_TTL seconds. Each result is stored with the data version of the
+table it was read from (see database.data_version); writes through the
+database module bump that version, so a result read before a write is never
+served after it, whichever process wrote.
+"""
+
+import datetime
+import re
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+from functools import wraps
+from .constants import RESULT_CACHE_BYTES, RESULT_CACHE_TTL
+from .database import data_version
+
+# Quoted search terms, whose whitespace is part of the term
+_QUOTED_PATTERN = re.compile(r"""("[^"]*"|'[^']*')""")
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+class ResultCache(object):
+    """
+    Size-bounded LRU mapping of keys to (data version, expiry, value)
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES, ttl=RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get(self, key, version):
+        """
+        :return: (found, value) pair, a value only being found while it is
+                 fresh and was cached at `version`
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                cached_version, expires, size, value = entry
+                if cached_version == version and expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                self._discard(key)
+            self.misses += 1
+            return False, None
+
+    def put(self, key, version, value):
+        """
+        Cache a value, evicting the least recently used values until the
+        cache is within its budget. Values larger than the whole budget are
+        not cached.
+        """
+
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (version, time.monotonic() + self.ttl, size,
+                                  value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions
+            }
+
+    def _discard(self, key):
+
+        self._bytes -= self._entries.pop(key)[2]
+
+
+result_cache = ResultCache()
+
+
+def cached(table):
+    """
+    Decorator caching a function's results in result_cache, keyed by its
+    normalized arguments and invalidated by writes to `table`. Calls with
+    stream=True are never cached, and cached=False bypasses the cache.
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, cached=True, **kwargs):
+            if not cached or kwargs.get("stream"):
+                return function(*args, **kwargs)
+            key = (function.__module__, function.__name__,
+                   normalize(args), normalize(kwargs))
+            try:
+                version = data_version(table)
+            except Exception as error:
+                # the version table may not exist before migrating
+                print("Result cache disabled, no data version:", error)
+                return function(*args, **kwargs)
+            found, value = result_cache.get(key, version)
+            if found:
+                return value
+            value = function(*args, **kwargs)
+            result_cache.put(key, version, value)
+            return value
+        return wrapper
+    return decorator
+
+
+def normalize(value):
+    """
+    Hashable form of call arguments in which equivalent calls are equal:
+    None arguments are dropped, strings have their whitespace collapsed
+    outside quoted terms and lists are sorted, since they are OR-ed together
+    """
+
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize(item))
+                            for key, item in value.items()
+                            if item is not None))
+    if isinstance(value, (list, set, frozenset)):
+        return tuple(sorted((normalize(item) for item in value), key=repr))
+    if isinstance(value, tuple):
+        return tuple(normalize(item) for item in value)
+    if isinstance(value, str):
+        parts = _QUOTED_PATTERN.split(value)
+        parts[::2] = [_WHITESPACE_PATTERN.sub(" ", part)
+                      for part in parts[::2]]
+        return "".join(parts).strip()
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _size(value):
+    """
+    Rough number of bytes held by a cached value
+    """
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_size(key) + _size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_size(item) for item in value)
+    elif hasattr(value, "__slots__") and not isinstance(value, (str, bytes)):
+        size += sum(_size(getattr(value, slot, None))
+                    for slot in value.__slots__)
+    return size
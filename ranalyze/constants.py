@@ -13,22 +13,189 @@ IMPORT_CHUNK_SIZE = 100
 # Columns to consider when performing a keyword search
 KEYWORD_COLUMNS = {"text_content", "title"}
 
+# Shortest word indexed by FULLTEXT (innodb_ft_min_token_size); shorter
+# search terms are matched with LIKE
+FULLTEXT_MIN_TOKEN = 3
+
+# Words FULLTEXT does not index (InnoDB's default stopword list); search
+# terms containing them are matched with LIKE
+FULLTEXT_STOPWORDS = frozenset({
+    "a", "about", "an", "are", "as", "at", "be", "by", "com", "de", "en",
+    "for", "from", "how", "i", "in", "is", "it", "la", "of", "on", "or",
+    "that", "the", "this", "to", "was", "what", "when", "where", "who",
+    "will", "with", "und", "www"
+})
+
+# Estimated bytes of search and overview results cached per process
+RESULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# Seconds a cached result is served for, even without writes
+RESULT_CACHE_TTL = 3600
+
+# Number of matches at which a capped search count stops counting
+COUNT_CAP = 1000
+
+# Days covered by the first time slice of a sliced search; each further
+# slice of a time ordered search is twice as wide as the one before
+SEARCH_SLICE_DAYS = 31
+
+# Number of slices, run at once on pooled connections, that a sliced search
+# ordered by score is split into; at most POOL_SIZE
+SEARCH_SLICE_WORKERS = 4
+
+# Bits of the random seed drawn for /entry samples requested without one
+SAMPLE_SEED_BITS = 32
+
+# Characters of text kept either side of the matches in a search snippet
+SNIPPET_CONTEXT = 60
+
+# Most separate fragments of text in a search snippet
+SNIPPET_FRAGMENTS = 3
+
+# Levels of replies returned below an entry by /entry/<id>/thread; deeper
+# branches are loaded separately
+THREAD_DEPTH = 8
+
+# Most replies to a single entry returned by /entry/<id>/thread, best first
+THREAD_BREADTH = 100
+
+# Entries older than this many days are moved to the archive tier
+ARCHIVE_AGE_DAYS = 365
+
+# Number of entries moved to the archive tier per transaction
+ARCHIVE_BATCH_SIZE = 2000
+
+# Number of future months which always have an entries partition ready
+PARTITION_MONTHS_AHEAD = 3
+
+# Maximum number of rows written by a single bulk upsert statement
+UPSERT_CHUNK_SIZE = 500
+
+# Number of compiled SQL templates cached per query type
+SQL_CACHE_SIZE = 1024
+
+# Number of rows fetched per round trip when streaming query results
+STREAM_BATCH_SIZE = 1000
+
+# Seconds the server waits on a slow consumer of a streamed result
+STREAM_WRITE_TIMEOUT = 3600
+
+# Maximum number of pooled database connections per process
+POOL_SIZE = 8
+
+# Seconds to wait for a pooled connection before giving up
+POOL_TIMEOUT = 30
+
+# Seconds a pooled connection may sit idle before it is pinged on reuse
+POOL_PING_INTERVAL = 30
+
+# Milliseconds a single /entry search statement may run before MySQL
+# aborts it
+SEARCH_DEADLINE = 30000
+
+# Milliseconds a single /frequency/overview statement may run
+OVERVIEW_DEADLINE = 20000
+
+# Number of expensive API requests allowed to run at once per process
+HEAVY_REQUEST_LIMIT = 4
+
+# Seconds an expensive API request waits for a free slot before it is
+# rejected
+HEAVY_REQUEST_QUEUE_TIMEOUT = 5
+
+# Seconds before reads are retried on a replica which could not be reached
+REPLICA_RETRY_INTERVAL = 30
+
+# Milliseconds after which a statement is written to the slow query log
+SLOW_QUERY_THRESHOLD = 1000
+
+# File name of the slow query log within OPENSHIFT_DATA_DIR
+SLOW_QUERY_LOG = "slow_queries.log"
+
+# Upper bounds, in milliseconds, of the per-template latency histogram
+# buckets; slower statements fall into a final overflow bucket
+LATENCY_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 30000)
+
+# Storage backend used when RANALYZE_BACKEND is not set, "mysql" or "sqlite"
+DEFAULT_BACKEND = "mysql"
+
+# File name of the SQLite database within OPENSHIFT_DATA_DIR, unless
+# RANALYZE_SQLITE_PATH gives another path
+SQLITE_FILE = "ranalyze.db"
+
+# SQLite virtual machine steps between checks of a statement's deadline
+SQLITE_PROGRESS_STEPS = 10000
+
+# Directory of the text index within OPENSHIFT_DATA_DIR
+INDEX_DIR = "index"
+
+# Number of entries per text index segment written by a rebuild
+INDEX_SEGMENT_SIZE = 100000
+
+# Number of text index segments merged at once, once there are more
+INDEX_MERGE_FACTOR = 8
+
+# Most index terms a search term may be contained in before the index is
+# no longer used for it
+INDEX_MAX_TERMS = 10000
+
+# Most candidate entries a search fetches by id from the text index; broader
+# searches are run against the tables instead
+INDEX_MAX_CANDIDATES = 10000
+
 # # DATABASE INFORMATION # #
 
 # Tables #
 
+ARCHIVE_TABLE = "entries_archive"
+
+# View of the archive table with its text decompressed
+ARCHIVE_VIEW = "entries_archive_text"
+
 CONFIG_TABLE = "config"
 
+# Number of writes made to each table whose results are cached
+DATA_VERSION_TABLE = "data_version"
+
 ENTRY_TABLE = "entries"
 
+# Title and text of the entries in both tiers, with a FULLTEXT index, kept
+# in step with them by triggers
+FULLTEXT_TABLE = "entries_fulltext"
+
 FREQUENCY_TABLE = "frequency"
 
 IMPORT_TABLE = "import"
 
+# Catch-all partition of the entries table, holding every entry newer than
+# its monthly partitions
+MAX_PARTITION = "pmax"
+
+SCHEMA_TABLE = "schema_version"
+
+# Saved search expressions matched against entries as they are ingested
+STANDING_QUERY_TABLE = "standing_queries"
+
+# Entries each standing query matched, in the order they were matched
+STANDING_HIT_TABLE = "standing_query_hits"
+
 SUBREDDIT_TABLE = "subreddits"
 
+# First partition of the entries table, holding the entries of unknown
+# submission time (stored as 0), which retention never drops
+UNKNOWN_TIME_PARTITION = "p0"
+
 # Column Sets #
 
+# Entry columns in table order
+ENTRY_COLUMNS = ("id", "permalink", "root_id", "up_votes", "up_ratio",
+                 "time_submitted", "time_updated", "posted_by", "title",
+                 "subreddit", "external_url", "text_content", "parent_id",
+                 "gilded", "deleted")
+
+# Entry columns stored compressed in the archive table
+COMPRESSED_FIELDS = {"text_content", "title"}
+
 CONFIG_ENTRY_FIELDS = {"id", "name", "value"}
 
 BASE_FIELDS = {"id", "up_votes", "time_submitted", "time_updated", "posted_by",
@@ -44,3 +211,22 @@ SUBREDDIT_FIELDS = {"name", "scraping", "last_scraped"}
 
 WORD_DAY_FIELDS = {"id", "word", "day", "month", "year", "total", "entries"}
 
+# Columns written when bulk loading each table
+TABLE_FIELDS = {
+    CONFIG_TABLE: CONFIG_ENTRY_FIELDS,
+    ENTRY_TABLE: ENTRY_FIELDS,
+    FREQUENCY_TABLE: WORD_DAY_FIELDS,
+    SUBREDDIT_TABLE: SUBREDDIT_FIELDS
+}
+
+# Key column of each table written by add_update_objects and load_file
+TABLE_KEYS = {
+    CONFIG_TABLE: "id",
+    ENTRY_TABLE: "id",
+    FREQUENCY_TABLE: "id",
+    SUBREDDIT_TABLE: "name"
+}
+
+# Tables whose writes bump their data version in DATA_VERSION_TABLE
+VERSIONED_TABLES = {ENTRY_TABLE, FREQUENCY_TABLE}
+
@@ -0,0 +1,9 @@
+from ranalyze.archive import archive_entries
+
+print("archiving old entries...")
+
+moved = archive_entries()
+
+print("archived", moved, "entries")
+
+print("done archiving")
@@ -0,0 +1,9 @@
+from ranalyze.migrations import migrate
+
+print("migrating database schema...")
+
+applied = migrate()
+
+print("applied migrations", applied)
+
+print("done migrating")
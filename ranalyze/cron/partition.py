@@ -0,0 +1,9 @@
+from ranalyze.partitions import ensure_partitions
+
+print("creating entries partitions...")
+
+created = ensure_partitions()
+
+print("created partitions", created)
+
+print("done partitioning")
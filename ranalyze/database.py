@@ -2,53 +2,158 @@
 Database abstraction class for handling storing and retrieving data.
 """
 
-import MySQLdb
 import os
-
+import re
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from itertools import count
+from tempfile import NamedTemporaryFile
+
+from . import instrumentation
+from .backends import MySQLBackend, SQLiteBackend
 from .constants import (
+    ARCHIVE_TABLE,
     CHAR_SET,
-    CONFIG_TABLE,
+    COMPRESSED_FIELDS,
+    DATA_VERSION_TABLE,
+    DEFAULT_BACKEND,
     ENTRY_TABLE,
-    FREQUENCY_TABLE,
-    IMPORT_TABLE,
-    SUBREDDIT_TABLE
-)
-from .models import (
-    CommentFactory,
-    ConfigEntryFactory,
-    PostFactory,
-    SubredditFactory,
-    WordDayFactory
+    REPLICA_RETRY_INTERVAL,
+    SQLITE_FILE,
+    STREAM_BATCH_SIZE,
+    TABLE_FIELDS,
+    TABLE_KEYS,
+    UPSERT_CHUNK_SIZE,
+    VERSIONED_TABLES
 )
+from .models import row_decoder
+from .pool import ConnectionPool
+from .textindex import get_index
+from .utils import uncompress
 from .query import (
+    PLACEHOLDER,
     Condition,
     InsertQuery,
+    RawQuery,
     SelectQuery,
     UpdateQuery,
-    DeleteQuery
+    UpsertQuery,
+    DeleteQuery,
+    set_dialect
 )
 
 
+# Key of the primary (read/write) server's pool; replicas are keyed by
+# their "host:port" endpoint
+PRIMARY = "primary"
+
+# Escapes for fields of tab separated files read by LOAD DATA
+_TSV_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n",
+                              "\r": "\\r", "\0": "\\0"})
+
+_TSV_NULL = "\\N"
+
+_TSV_UNESCAPES = {"\\": "\\", "t": "\t", "n": "\n", "r": "\r", "0": "\0"}
+
+_TSV_ESCAPE_PATTERN = re.compile(r"\\(.)")
+
+# Storage backend every query runs on, see use_backend()
+_backend = None
+
+_local = threading.local()
+
+_pools = {}
+
+_pools_lock = threading.Lock()
+
+_replica_counter = count()
+
+_replica_down_until = {}
+
+
 def connect(**kwargs):
     """
-    Opens the connection to the database.
+    Opens a new connection to the database and prepares its session.
     """
 
-    if not kwargs:
-        kwargs = {
-            "host": os.environ['OPENSHIFT_MYSQL_DB_HOST'],
-            "port": int(os.environ['OPENSHIFT_MYSQL_DB_PORT']),
-            "user": os.environ['OPENSHIFT_MYSQL_DB_USERNAME'],
-            "passwd": os.environ['OPENSHIFT_MYSQL_DB_PASSWORD'],
-            "db": 'ranalyze'
-        }
+    return _backend.connect(**kwargs)
+
 
-    with MySQLdb.connect(charset=CHAR_SET, **kwargs) as database:
-        query = ("SET GLOBAL sql_mode="
-                 "(SELECT REPLACE(@@sql_mode,'ONLY_FULL_GROUP_BY',''));")
-        database.execute(query)
+def get_backend():
+    """
+    Storage backend every query currently runs on
+    :rtype: backends.Backend
+    """
 
-    return MySQLdb.connect(charset=CHAR_SET, **kwargs)
+    return _backend
+
+
+def use_backend(backend):
+    """
+    Run every following query on another storage backend, building queries
+    in its dialect. The previous backend's pooled connections are closed.
+    """
+
+    global _backend
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+        _backend = backend
+        set_dialect(backend.DIALECT)
+    for pool in pools:
+        pool.close()
+
+
+def get_pool(endpoint=PRIMARY):
+    """
+    Return the process-wide connection pool for the primary server, or for
+    a replica endpoint, creating it on first use.
+    :rtype: ConnectionPool
+    """
+
+    pool = _pools.get(endpoint)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(endpoint)
+            if pool is None:
+                pool = ConnectionPool(partial(
+                    _backend.connect,
+                    None if endpoint == PRIMARY else endpoint))
+                _pools[endpoint] = pool
+    return pool
+
+
+def pool_stats():
+    """
+    Return usage statistics for every connection pool, keyed by endpoint.
+    """
+
+    with _pools_lock:
+        pools = dict(_pools)
+    stats = {endpoint: pool.stats for endpoint, pool in pools.items()}
+    for endpoint, down_until in _replica_down_until.items():
+        if endpoint in stats:
+            stats[endpoint]["down"] = down_until > time.monotonic()
+    return stats
+
+
+@contextmanager
+def read_your_writes():
+    """
+    Route every query made by the current thread inside the block to the
+    primary, so reads observe writes which replicas may not have applied
+    yet.
+    """
+
+    _local.primary_reads = getattr(_local, "primary_reads", 0) + 1
+    try:
+        yield
+    finally:
+        _local.primary_reads -= 1
 
 
 def add_update_object(obj, table):
@@ -57,109 +162,224 @@ def add_update_object(obj, table):
     :param table:
     """
 
-    if object_exists(obj, table):
-        return _update_object(obj, table)
-    else:
-        return _add_object(obj, table)
+    with read_your_writes():
+        if object_exists(obj, table):
+            result = _update_object(obj, table)
+        else:
+            result = _add_object(obj, table)
+    bump_data_version(table)
+    return result
+
+
+def add_update_objects(objs, table):
+    """
+    Add or update many objects at once. Objects are grouped by model and
+    written UPSERT_CHUNK_SIZE rows per statement, all in a single
+    transaction, together with the table's data version. Entries are added
+    to the text index as the transaction runs, and published in it once it
+    is committed.
+    :return: number of rows affected
+    """
+
+    groups = {}
+    for obj in objs:
+        groups.setdefault(type(obj), []).append(obj)
+
+    queries = []
+    for model, group in groups.items():
+        for start in range(0, len(group), UPSERT_CHUNK_SIZE):
+            rows = [obj.dict for obj in group[start:start + UPSERT_CHUNK_SIZE]]
+            queries.append(UpsertQuery(table=table, rows=rows, key=model.KEY))
+
+    versioned = bool(queries) and table in VERSIONED_TABLES
+    if versioned:
+        queries.append(version_bump_query(table))
+
+    documents = []
+    if table == ENTRY_TABLE:
+        documents = [(obj.id, obj.dict.get("title"), obj.text_content)
+                     for group in groups.values() for obj in group]
+    with get_index().adding(documents):
+        counts = execute_transaction(queries)
+    return sum(counts[:-1] if versioned else counts)
+
+
+def bulk_load(objs, table):
+    """
+    Add or update a large number of objects far faster than row by row
+    inserts. Objects are streamed into a temporary tab separated file which
+    is then loaded with load_file.
+    :return: number of rows affected by the merge
+    """
+
+    columns = sorted(TABLE_FIELDS[table])
+    with NamedTemporaryFile("w", encoding=CHAR_SET, newline="\n",
+                            suffix=".tsv", delete=False) as file:
+        path = file.name
+        _write_tsv(file, columns,
+                   ([getattr(obj, c, None) for c in columns] for obj in objs))
+    try:
+        return load_file(path, table)
+    finally:
+        os.remove(path)
+
+
+def bump_data_version(table):
+    """
+    Record that a table's data changed, so that results cached from it are
+    no longer served. Only VERSIONED_TABLES have a data version.
+    """
+
+    if table in VERSIONED_TABLES:
+        execute_query(version_bump_query(table), commit=True)
+
+
+def version_bump_query(table):
+    """
+    Query bumping a table's data version, for transactions writing to it
+    """
+
+    return RawQuery("UPDATE {} SET version = version + 1 WHERE name = {}"
+                    .format(DATA_VERSION_TABLE, PLACEHOLDER), (table,))
 
 
 def create_db():
     """
-    Create a new, pre-formatted database
-    """
-
-    connection = MySQLdb.connect(host=os.environ['OPENSHIFT_MYSQL_DB_HOST'],
-                                 port=int(os.environ['OPENSHIFT_MYSQL_DB_PORT']),
-                                 user=os.environ['OPENSHIFT_MYSQL_DB_USERNAME'],
-                                 passwd=os.environ['OPENSHIFT_MYSQL_DB_PASSWORD'],
-                                 db='ranalyze')
-
-    cursor = connection.cursor()
-
-    queries = ("DROP TABLE IF EXISTS {}".format(ENTRY_TABLE),
-               "DROP TABLE IF EXISTS {}".format(FREQUENCY_TABLE),
-               "DROP TABLE IF EXISTS {}".format(CONFIG_TABLE),
-               "DROP TABLE IF EXISTS {}".format(IMPORT_TABLE),
-               """
-               CREATE TABLE {} (
-               id varchar(255) PRIMARY KEY, permalink text, root_id text,
-               up_votes integer, up_ratio real, time_submitted integer,
-               time_updated integer, posted_by text, title text,
-               subreddit text, external_url text, text_content text,
-               parent_id varchar(255), gilded integer, deleted integer,
-               FOREIGN KEY(parent_id) REFERENCES entries(id)
-               )
-               DEFAULT CHARACTER SET {}
-               """.format(ENTRY_TABLE, CHAR_SET),
-               """
-               CREATE TABLE {} (
-               id integer PRIMARY KEY AUTO_INCREMENT, word varchar(255), month integer,
-               day integer, year integer, entries integer, total integer
-               )
-               DEFAULT CHARACTER SET {}
-               """.format(FREQUENCY_TABLE, CHAR_SET),
-               """
-               CREATE TABLE {} (
-               id integer PRIMARY KEY AUTO_INCREMENT, name varchar(255),
-               value varchar(255)
-               )
-               DEFAULT CHARACTER SET {}
-               """.format(CONFIG_TABLE, CHAR_SET),
-               """
-               CREATE TABLE {} (
-               permalink text)
-               DEFAULT CHARACTER SET {}
-               """.format(IMPORT_TABLE, CHAR_SET),
-               # We need a trigger to insert the integer unix timestamp
-               """
-               CREATE TABLE {} (
-               name varchar(20) PRIMARY KEY, scraping integer(1) DEFAULT 0,
-               last_scraped integer, added integer NULL
-               )
-               DEFAULT CHARACTER SET {};
-               delimiter $$
-               CREATE TRIGGER tr_sub_added BEFORE INSERT ON {} FOR EACH ROW
-               BEGIN
-                 if (new.added is null)
-                 then
-                   set new.added = unix_timestamp();
-                 end if;
-               end $$
-               delimiter ;
-               """.format(SUBREDDIT_TABLE, CHAR_SET, SUBREDDIT_TABLE)
-               )
-
-    for query in queries:
-        cursor.execute(query)
-
-    connection.commit()
-    connection.close()
+    Create a new, pre-formatted database. On MySQL this is the base schema
+    version; run migrations.migrate() afterwards to bring it up to date.
+    """
+
+    with get_pool().connection() as connection:
+        cursor = connection.cursor()
+        try:
+            for statement in _backend.schema():
+                _backend.execute(cursor, statement)
+            connection.commit()
+        finally:
+            cursor.close()
+
+
+def data_version(table):
+    """
+    Number of writes made to a table through this module, which changes
+    whenever its data does
+    """
+
+    query = SelectQuery(table=DATA_VERSION_TABLE, columns="version",
+                        where=Condition("name", table))
+    rows = execute_query(query, transpose=False)
+    return rows[0]["version"] if rows else 0
+
+
+@contextmanager
+def deadline(milliseconds):
+    """
+    Limit every SELECT run by the current thread inside the block to the
+    time left until the deadline, raising QueryTimeoutError once it passes.
+    The database itself aborts the statement (MAX_EXECUTION_TIME on MySQL).
+    Nested deadlines keep the earliest one.
+    """
+
+    previous = getattr(_local, "deadline", None)
+    expires = time.monotonic() + milliseconds / 1000
+    _local.deadline = min(expires, previous) if previous else expires
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def dump_table(table, path):
+    """
+    Write every row of a table to a tab separated file, readable by
+    load_file, streaming rows so memory use stays flat.
+    :return: number of rows written
+    """
+
+    columns = sorted(TABLE_FIELDS[table])
+    query = SelectQuery(table=table, columns=columns)
+    rows = ([row[c] for c in columns]
+            for row in iter_query(query, transpose=False))
+    with open(path, "w", encoding=CHAR_SET, newline="\n") as file:
+        return _write_tsv(file, columns, rows)
 
 
 def execute_query(query, commit=False, transpose=True, only_id=False):
     """
     Executes a given Query, optionally committing changes. Results are
-    transposed by default.
+    transposed by default. Read-only SelectQuerys are sent to a replica when
+    any are configured, falling back to the primary if none can be reached.
+    Latency and row counts are recorded by the instrumentation module.
     """
-    connection = connect()
-    try:
-        cursor = connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute(query.sql, query.params)
-        if commit:
+
+    read_only = isinstance(query, SelectQuery) and not commit
+    for endpoint in _endpoints(read_only):
+        try:
+            return _execute(get_pool(endpoint), query, commit, only_id,
+                            transpose)
+        except Exception as error:
+            if endpoint == PRIMARY or not _backend.disconnected(error):
+                raise
+            _mark_down(endpoint)
+
+
+def execute_parallel(queries, workers):
+    """
+    Executes several read Queries at once, each on its own pooled connection
+    and with up to `workers` running at a time. Every query runs under the
+    calling thread's deadline and read preference.
+    :return: list of the transposed results of each query, in order
+    """
+
+    expires = getattr(_local, "deadline", None)
+    primary_reads = getattr(_local, "primary_reads", 0)
+
+    def run(query):
+        _local.deadline = expires
+        _local.primary_reads = primary_reads
+        try:
+            return execute_query(query)
+        finally:
+            _local.deadline = None
+            _local.primary_reads = 0
+
+    if not queries:
+        return []
+    with ThreadPoolExecutor(max_workers=min(workers, len(queries))) as pool:
+        return list(pool.map(run, queries))
+
+
+def execute_transaction(queries):
+    """
+    Executes several write Queries in one transaction, committing only if
+    all of them succeed.
+    :return: list of the number of rows affected by each query
+    """
+
+    if not queries:
+        return []
+    with get_pool().connection() as connection:
+        cursor = connection.cursor()
+        try:
+            _backend.execute(cursor, _backend.BEGIN)
+            affected = []
+            for query in queries:
+                started = time.monotonic()
+                affected.append(_backend.execute(cursor, query.sql,
+                                                 query.params))
+                _observe(connection, query, time.monotonic() - started,
+                         affected[-1])
             connection.commit()
-        if only_id:
-            return cursor.lastrowid
-        results = cursor.fetchall()
-        if transpose:
-            results = [_row_to_object(o) for o in results]
-        return results
-    finally:
-        connection.close()
+        finally:
+            cursor.close()
+    return affected
 
 
 def get_entry(entry_id):
     """
-    Retrieve an item from the database where column=value.
+    Retrieve an item from the database where column=value. Entries not
+    found in the entries table are looked up in the archive tier, and their
+    text decompressed.
     """
 
     query = SelectQuery(table=ENTRY_TABLE,
@@ -167,6 +387,14 @@ def get_entry(entry_id):
     result = execute_query(query)
     if len(result) > 0:
         return result[0]
+    query = SelectQuery(table=ARCHIVE_TABLE,
+                        where=Condition("id", entry_id))
+    result = execute_query(query)
+    if len(result) > 0:
+        entry = result[0]
+        for field in COMPRESSED_FIELDS & entry.keys():
+            entry[field] = uncompress(entry[field])
+        return entry
     return None
 
 
@@ -190,11 +418,162 @@ def get_latest_post(subreddit):
     return get_entry(latest_id)
 
 
+def iter_query(query, batch_size=STREAM_BATCH_SIZE, transpose=True):
+    """
+    Lazily executes a given Query through an unbuffered server-side cursor,
+    yielding one result at a time so memory use does not grow with the size
+    of the result set. Results are transposed by default.
+
+    A pooled connection is held until the generator is exhausted; if it is
+    abandoned early the connection is discarded rather than draining the
+    remaining rows.
+    """
+
+    for endpoint in _endpoints(isinstance(query, SelectQuery)):
+        pool = get_pool(endpoint)
+        try:
+            connection = pool.acquire()
+            break
+        except Exception as error:
+            if endpoint == PRIMARY or not _backend.disconnected(error):
+                raise
+            _mark_down(endpoint)
+    exhausted = False
+    try:
+        cursor = _backend.cursor(connection, dictionary=not transpose,
+                                 stream=True)
+        # only time spent in the database counts towards the statement's
+        # latency, not time spent by the consumer between batches
+        started = time.monotonic()
+        with _timeouts():
+            _backend.execute(cursor, query.sql, query.params, _remaining())
+        elapsed = time.monotonic() - started
+        if transpose:
+            decode = row_decoder([column[0] for column in cursor.description])
+        count = 0
+        while True:
+            started = time.monotonic()
+            with _timeouts():
+                rows = cursor.fetchmany(batch_size)
+            elapsed += time.monotonic() - started
+            if not rows:
+                break
+            count += len(rows)
+            for row in rows:
+                yield decode(row) if transpose else row
+        cursor.close()
+        exhausted = True
+        _observe(connection, query, elapsed, count)
+    finally:
+        pool.release(connection, discard=not exhausted)
+
+
+def load_file(path, table):
+    """
+    Bulk load a tab separated file, as written by dump_table, into a table.
+    The first line names the columns. Rows are loaded with LOAD DATA LOCAL
+    INFILE into a temporary staging table, then merged into the target in
+    one statement, updating rows whose key already exists. Backends without
+    LOAD DATA upsert the rows in chunks within a single transaction instead.
+    Loading entries leaves the text index incomplete until it is rebuilt.
+    :return: number of rows affected by the merge
+    """
+
+    with open(path, encoding=CHAR_SET) as file:
+        columns = file.readline().rstrip("\n").split("\t")
+    unknown = set(columns) - TABLE_FIELDS[table]
+    if unknown:
+        raise UnknownColumnError(unknown.pop(), table)
+
+    if table == ENTRY_TABLE:
+        get_index().invalidate()
+
+    if _backend.LOCAL_INFILE:
+        affected = _load_infile(path, table, columns)
+    else:
+        affected = _upsert_file(path, table, columns)
+    bump_data_version(table)
+    return affected
+
+
+def _load_infile(path, table, columns):
+    """
+    Load a tab separated file into a staging table with LOAD DATA LOCAL
+    INFILE, then merge it into the target.
+    :return: number of rows affected by the merge
+    """
+
+    staging = "{}_staging".format(table)
+    column_list = ", ".join(columns)
+    updates = ", ".join(["{0}=VALUES({0})".format(c) for c in columns])
+    statements = (
+        # the staging copy has the table's column types but no keys, so
+        # duplicates in the file are resolved by the merge
+        "CREATE TEMPORARY TABLE {} SELECT {} FROM {} LIMIT 0".format(
+            staging, column_list, table),
+        "LOAD DATA LOCAL INFILE %s INTO TABLE {} CHARACTER SET {} "
+        "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+        "LINES TERMINATED BY '\\n' IGNORE 1 LINES ({})".format(
+            staging, CHAR_SET, column_list),
+        "INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} "
+        "ON DUPLICATE KEY UPDATE {updates}".format(table=table,
+                                                    columns=column_list,
+                                                    staging=staging,
+                                                    updates=updates)
+    )
+
+    # LOCAL INFILE is only enabled on this dedicated connection, never on
+    # pooled ones
+    connection = connect(local_infile=1)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(statements[0])
+        cursor.execute(statements[1], (path,))
+        affected = cursor.execute(statements[2])
+        connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+    return affected
+
+
+def _upsert_file(path, table, columns):
+    """
+    Upsert the rows of a tab separated file through pooled connections,
+    UPSERT_CHUNK_SIZE rows per statement.
+    :return: number of rows affected
+    """
+
+    affected = 0
+    with open(path, encoding=CHAR_SET, newline="\n") as file, \
+            get_pool().connection() as connection:
+        file.readline()
+        cursor = connection.cursor()
+        try:
+            _backend.execute(cursor, _backend.BEGIN)
+            rows = []
+            for line in file:
+                rows.append(dict(zip(columns, _read_tsv_line(line))))
+                if len(rows) == UPSERT_CHUNK_SIZE:
+                    query = UpsertQuery(table, rows, TABLE_KEYS[table])
+                    affected += _backend.execute(cursor, query.sql,
+                                                 query.params)
+                    rows = []
+            if rows:
+                query = UpsertQuery(table, rows, TABLE_KEYS[table])
+                affected += _backend.execute(cursor, query.sql, query.params)
+            connection.commit()
+        finally:
+            cursor.close()
+    return affected
+
+
 def remove_object_by_id(_id, table):
     cond = Condition('id', _id)
     query = DeleteQuery(table=table,
                         where=cond)
     execute_query(query, commit=True)
+    bump_data_version(table)
 
 
 def _add_object(obj, table):
@@ -228,26 +607,193 @@ def object_exists(obj, table):
     return result['COUNT(*)'] == 1
 
 
-def _row_to_object(row):
+def _configured_backend():
+    """
+    Backend named by RANALYZE_BACKEND. The SQLite database lives at
+    RANALYZE_SQLITE_PATH, or in OPENSHIFT_DATA_DIR.
     """
 
-    :param row:
-    :return:
-    :rtype: ModelObject
+    name = os.environ.get("RANALYZE_BACKEND", DEFAULT_BACKEND)
+    if name == SQLiteBackend.NAME:
+        path = os.environ.get("RANALYZE_SQLITE_PATH") or os.path.join(
+            os.environ.get("OPENSHIFT_DATA_DIR", "."), SQLITE_FILE)
+        return SQLiteBackend(path)
+    if name != MySQLBackend.NAME:
+        raise DatabaseError("Unknown database backend `{}`".format(name))
+    return MySQLBackend()
+
+
+def _remaining():
+    """
+    Milliseconds left until the current thread's deadline, None without one.
     """
-    if row is None:
+
+    expires = getattr(_local, "deadline", None)
+    if expires is None:
         return None
-    elif "word" in row.keys():
-        factory = WordDayFactory
-    elif "value" in row.keys():
-        factory = ConfigEntryFactory
-    elif "scraping" in row.keys():
-        factory = SubredditFactory
-    elif row["permalink"] is None:
-        factory = CommentFactory
-    else:
-        factory = PostFactory
-    return factory.from_row(row)
+    remaining = int((expires - time.monotonic()) * 1000)
+    if remaining <= 0:
+        raise QueryTimeoutError()
+    return remaining
+
+
+def _endpoints(read_only):
+    """
+    Endpoints to try, in order, for a query. Reads rotate across the
+    replicas not currently marked down and always end with the primary.
+    """
+
+    if (not read_only or getattr(_local, "primary_reads", 0)
+            or not _backend.REPLICAS):
+        return [PRIMARY]
+    now = time.monotonic()
+    replicas = [endpoint for endpoint in _replica_endpoints()
+                if _replica_down_until.get(endpoint, 0) <= now]
+    if replicas:
+        start = next(_replica_counter) % len(replicas)
+        replicas = replicas[start:] + replicas[:start]
+    return replicas + [PRIMARY]
+
+
+def _execute(pool, query, commit, only_id, transpose):
+    """
+    Run a query on a connection from the given pool, returning the last
+    inserted id, model objects decoded from the rows, or the raw rows as
+    dictionaries.
+    """
+
+    with pool.connection() as connection:
+        cursor = _backend.cursor(connection, dictionary=not transpose)
+        try:
+            started = time.monotonic()
+            with _timeouts():
+                affected = _backend.execute(cursor, query.sql, query.params,
+                                            _remaining())
+            if commit:
+                connection.commit()
+            if only_id:
+                _observe(connection, query, time.monotonic() - started,
+                         affected)
+                return cursor.lastrowid
+            rows = cursor.fetchall()
+            description = cursor.description
+            _observe(connection, query, time.monotonic() - started,
+                     affected if description is None else len(rows))
+        finally:
+            cursor.close()
+    if not transpose:
+        return rows
+    if description is None:
+        return []
+    decode = row_decoder([column[0] for column in description])
+    return [decode(row) for row in rows]
+
+
+def estimate_rows(query):
+    """
+    The backend's estimate of how many rows a query returns, from its plan,
+    or None if the backend cannot tell
+    """
+
+    plan = execute_query(RawQuery("{} {}".format(_backend.EXPLAIN, query.sql),
+                                  query.params), transpose=False)
+    return _backend.estimate(plan)
+
+
+def _explain(connection, query):
+    """
+    The backend's plan for a query, as a list of rows
+    """
+
+    cursor = _backend.cursor(connection, dictionary=True)
+    try:
+        _backend.execute(cursor, "{} {}".format(_backend.EXPLAIN, query.sql),
+                         query.params)
+        return list(cursor.fetchall())
+    except Exception as error:
+        return "No plan: {}".format(error)
+    finally:
+        cursor.close()
+
+
+def _mark_down(endpoint):
+    """
+    Stop routing reads to an unreachable replica for a while.
+    """
+
+    print("Replica {} unreachable, retrying in {}s".format(
+        endpoint, REPLICA_RETRY_INTERVAL))
+    _replica_down_until[endpoint] = time.monotonic() + REPLICA_RETRY_INTERVAL
+    get_pool(endpoint).close()
+
+
+def _observe(connection, query, seconds, rows):
+    """
+    Record a finished statement, and log it with its plan if it was slow.
+    """
+
+    instrumentation.record(query.sql, seconds, rows)
+    if instrumentation.is_slow(seconds):
+        instrumentation.log_slow(query.sql, query.params, seconds, rows,
+                                 _explain(connection, query))
+
+
+def _replica_endpoints():
+    """
+    Replica endpoints configured as a comma separated list of host:port
+    pairs in OPENSHIFT_MYSQL_DB_REPLICAS.
+    """
+
+    endpoints = os.environ.get('OPENSHIFT_MYSQL_DB_REPLICAS', "")
+    return [e.strip() for e in endpoints.split(",") if e.strip()]
+
+
+@contextmanager
+def _timeouts():
+    """
+    Translate statements aborted by the backend for running past their
+    deadline into QueryTimeoutErrors.
+    """
+
+    try:
+        yield
+    except Exception as error:
+        if _backend.timed_out(error):
+            raise QueryTimeoutError() from error
+        raise
+
+
+def _write_tsv(file, columns, rows):
+    """
+    Write a header of column names followed by rows of values to a tab
+    separated file, escaped for LOAD DATA.
+    :return: number of rows written
+    """
+
+    file.write("\t".join(columns) + "\n")
+    written = 0
+    for row in rows:
+        file.write("\t".join([_tsv_field(value) for value in row]) + "\n")
+        written += 1
+    return written
+
+
+def _read_tsv_line(line):
+    """
+    Values of one line of a tab separated file written by _write_tsv
+    """
+
+    return [None if field == _TSV_NULL else _TSV_ESCAPE_PATTERN.sub(
+        lambda match: _TSV_UNESCAPES.get(match.group(1), match.group(1)),
+        field) for field in line.rstrip("\n").split("\t")]
+
+
+def _tsv_field(value):
+    if value is None:
+        return _TSV_NULL
+    if isinstance(value, bool):
+        value = int(value)
+    return str(value).translate(_TSV_ESCAPES)
 
 
 def _update_object(obj, table):
@@ -290,3 +836,17 @@ class UnknownColumnError(DatabaseError):
 
     def __init__(self, column, table):
         super().__init__(self._FORMAT.format(column=column, table=table))
+
+
+class QueryTimeoutError(DatabaseError):
+    """
+    Exceptions raised when a statement exceeds its deadline
+    """
+
+    _MESSAGE = "The query took too long and was cancelled"
+
+    def __init__(self):
+        super().__init__(self._MESSAGE)
+
+
+use_backend(_configured_backend())
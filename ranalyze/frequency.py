@@ -6,8 +6,14 @@ import re
 
 from datetime import datetime
 from types import SimpleNamespace
+from .cache import cached
 from .constants import ENTRY_TABLE, FREQUENCY_TABLE
-from .database import add_update_object, execute_query, object_exists
+from .database import (
+    add_update_objects,
+    execute_query,
+    object_exists,
+    read_your_writes
+)
 from .models import WordDay
 from .query import Condition, SelectQuery
 
@@ -107,36 +113,45 @@ def digest_entry(entry):
     :return:
     """
 
-    if not object_exists(entry, ENTRY_TABLE):
-        date = datetime.fromtimestamp(entry.time_submitted)
-        words = [word.lower() for word in
-                 WORD_PATTERN.findall(entry.text_content)
-                 if word.lower() not in BLACKLIST]
-        for word in set(words):
-            if len(word) < 2:
-                continue
-            num_occurrences = words.count(word)
+    # counts are read-modify-write, so they must not be read from a replica
+    with read_your_writes():
+        if not object_exists(entry, ENTRY_TABLE):
+            date = datetime.fromtimestamp(entry.time_submitted)
+            words = [word.lower() for word in
+                     WORD_PATTERN.findall(entry.text_content)
+                     if word.lower() not in BLACKLIST]
+            counts = {word: words.count(word) for word in set(words)
+                      if len(word) >= 2}
+            if not counts:
+                return
             condition = Condition("month", date.month)
             condition &= Condition("day", date.day)
             condition &= Condition("year", date.year)
-            condition &= Condition("word", word)
+            word_condition = Condition()
+            for word in counts:
+                word_condition |= Condition("word", word)
             select_query = SelectQuery(table=FREQUENCY_TABLE,
-                                       where=condition)
-            results = execute_query(select_query)
-            if results:
-                word_day = results[0]
-                word_day.entries += 1
-                word_day.total += num_occurrences
-            else:
-                word_day = WordDay(day=date.day,
-                                   month=date.month,
-                                   year=date.year,
-                                   word=word,
-                                   entries=1,
-                                   total=num_occurrences)
-            add_update_object(word_day, FREQUENCY_TABLE)
+                                       where=condition & word_condition)
+            existing = {word_day.word: word_day
+                        for word_day in execute_query(select_query)}
+            word_days = []
+            for word, num_occurrences in counts.items():
+                if word in existing:
+                    word_day = existing[word]
+                    word_day.entries += 1
+                    word_day.total += num_occurrences
+                else:
+                    word_day = WordDay(day=date.day,
+                                       month=date.month,
+                                       year=date.year,
+                                       word=word,
+                                       entries=1,
+                                       total=num_occurrences)
+                word_days.append(word_day)
+            add_update_objects(word_days, FREQUENCY_TABLE)
 
 
+@cached(FREQUENCY_TABLE)
 def overview(gran, limit, day=None, month=None, year=None,
              day_before=None, month_before=None, year_before=None,
              day_after=None, month_after=None, year_after=None):
@@ -167,10 +182,11 @@ def overview(gran, limit, day=None, month=None, year=None,
                             group=gran+", word")
         return execute_query(query, transpose=False)
     else: # assuming everything else is here, otherwise will error
-        # constructs date from day,month,year columns
-        existing_date = "cast(rtrim(year *10000+ month *100+ day) as datetime)"
-        before_date = "{}-{}-{}".format(year_before, month_before, day_before)
-        after_date = "{}-{}-{}".format(year_after, month_after, day_after)
+        # compares dates as yyyymmdd integers built from the day, month and
+        # year columns, which every backend can evaluate
+        existing_date = "(year * 10000 + month * 100 + day)"
+        before_date = year_before * 10000 + month_before * 100 + day_before
+        after_date = year_after * 10000 + month_after * 100 + day_after
         date_condition = Condition()
         date_condition &= Condition(existing_date, "<=", before_date)
         date_condition &= Condition(existing_date, ">=", after_date)
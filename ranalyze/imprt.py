@@ -5,7 +5,8 @@ Tool to import a set of permalinks from a csv into the database
 import csv
 
 from .constants import ENTRY_TABLE, IMPORT_CHUNK_SIZE, IMPORT_TABLE
-from .database import add_update_object, execute_query
+from .database import add_update_objects, execute_query
+from .percolator import percolate
 from .scrape import fetch_post
 from .query import Condition, SelectQuery, DeleteQuery, InsertQuery
 
@@ -18,8 +19,9 @@ def import_file(fname):
         csvreader = csv.reader(importcsv)
         for row in csvreader:
             for cell in row:
-                for entry in fetch_post(cell):
-                    add_update_object(entry, ENTRY_TABLE)
+                entries = list(fetch_post(cell))
+                add_update_objects(entries, ENTRY_TABLE)
+                percolate(entries)
 
                     
 def schedule_for_import(fname):
@@ -55,11 +57,12 @@ def import_from_table():
         data = execute_query(dataQuery, transpose=False)
         for row in data:
             if row["permalink"]:
-                for entry in fetch_post(row["permalink"]):
-                    try:
-                        add_update_object(entry, ENTRY_TABLE)
-                    except:
-                        print("error on entry: ".format(entry))
+                try:
+                    entries = list(fetch_post(row["permalink"]))
+                    add_update_objects(entries, ENTRY_TABLE)
+                    percolate(entries)
+                except:
+                    print("error on permalink: {}".format(row["permalink"]))
             deleteQuery = DeleteQuery(IMPORT_TABLE, where=Condition("permalink", row["permalink"]))
             execute_query(deleteQuery, commit=True)
         count -= IMPORT_CHUNK_SIZE
@@ -0,0 +1,137 @@
+"""
+Per-statement query instrumentation.
+
+Every statement run through the database module is recorded against its SQL
+template (the query's SQL with placeholders in place of values), so that
+latency and row counts are aggregated per query shape. Statements slower
+than SLOW_QUERY_THRESHOLD are also written, with their plan, to the slow
+query log in OPENSHIFT_DATA_DIR.
+"""
+
+import bisect
+import datetime
+import json
+import os
+import re
+import threading
+
+from .constants import (
+    LATENCY_BUCKETS,
+    SLOW_QUERY_LOG,
+    SLOW_QUERY_THRESHOLD
+)
+
+_lock = threading.Lock()
+
+_log_lock = threading.Lock()
+
+_templates = {}
+
+# Runs of placeholders, as in IN lists and multi-row VALUES, whose length
+# varies from one execution of a statement to the next
+_PLACEHOLDER_RUN = re.compile(r"%s(?:, %s)+")
+
+_ROW_RUN = re.compile(r"(\([^()]*\))(?:, \1)+")
+
+
+def is_slow(seconds):
+    """
+    Whether a statement taking `seconds` belongs in the slow query log
+    """
+
+    return seconds * 1000 >= SLOW_QUERY_THRESHOLD
+
+
+def log_slow(sql, params, seconds, rows, plan):
+    """
+    Append a slow statement, its parameters and its plan to the slow query
+    log, one JSON document per line.
+    """
+
+    record = {
+        "time": datetime.datetime.utcnow().isoformat(),
+        "milliseconds": round(seconds * 1000, 3),
+        "rows": rows,
+        "sql": normalize(sql),
+        "params": [repr(param) for param in params or ()],
+        "plan": plan
+    }
+    line = json.dumps(record, default=str)
+    with _log_lock:
+        with open(slow_log_path(), "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+def normalize(sql):
+    """
+    Statement template with its whitespace collapsed and repeated
+    placeholders and rows folded, so that templates differing only in
+    layout or in the number of values are aggregated together
+    """
+
+    template = _PLACEHOLDER_RUN.sub("%s, ...", " ".join(sql.split()))
+    return _ROW_RUN.sub(r"\1, ...", template)
+
+
+def record(sql, seconds, rows):
+    """
+    Add one execution of a statement to its template's statistics.
+    :param rows: rows returned, or affected for writes
+    """
+
+    template = normalize(sql)
+    bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds * 1000)
+    with _lock:
+        stats = _templates.get(template)
+        if stats is None:
+            stats = _templates[template] = {
+                "count": 0,
+                "total": 0.0,
+                "max": 0.0,
+                "rows": 0,
+                "histogram": [0] * (len(LATENCY_BUCKETS) + 1)
+            }
+        stats["count"] += 1
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+        stats["rows"] += max(rows, 0)
+        stats["histogram"][bucket] += 1
+
+
+def reset():
+    """
+    Forget every recorded statement
+    """
+
+    with _lock:
+        _templates.clear()
+
+
+def slow_log_path():
+
+    return os.path.join(os.environ.get("OPENSHIFT_DATA_DIR", "."),
+                        SLOW_QUERY_LOG)
+
+
+def top_templates(limit=10):
+    """
+    Statistics of the `limit` templates with the most total execution time,
+    slowest first. Histogram buckets are labelled with their upper bound in
+    milliseconds.
+    """
+
+    with _lock:
+        templates = [(template, dict(stats, histogram=list(stats["histogram"])))
+                     for template, stats in _templates.items()]
+    templates.sort(key=lambda item: item[1]["total"], reverse=True)
+    labels = ["<={}".format(bound) for bound in LATENCY_BUCKETS]
+    labels.append(">{}".format(LATENCY_BUCKETS[-1]))
+    return [{
+        "sql": template,
+        "count": stats["count"],
+        "total_ms": round(stats["total"] * 1000, 3),
+        "mean_ms": round(stats["total"] * 1000 / stats["count"], 3),
+        "max_ms": round(stats["max"] * 1000, 3),
+        "rows": stats["rows"],
+        "histogram": dict(zip(labels, stats["histogram"]))
+    } for template, stats in templates[:limit]]
@@ -0,0 +1,342 @@
+"""
+Versioned schema migrations, applied in place to an existing database.
+
+Each migration is a (version, description, statements) triple. Migrations
+are applied in order, and each applied version is recorded in the schema
+version table, so `migrate` only ever runs what a database is missing.
+MySQL cannot roll back DDL, so every statement should change a single table
+in one ALTER; when a failed migration is retried, statements whose change is
+already present are skipped.
+"""
+
+from datetime import datetime
+from .constants import (
+    ARCHIVE_TABLE,
+    ARCHIVE_VIEW,
+    CHAR_SET,
+    COMPRESSED_FIELDS,
+    CONFIG_TABLE,
+    DATA_VERSION_TABLE,
+    ENTRY_COLUMNS,
+    ENTRY_TABLE,
+    FREQUENCY_TABLE,
+    FULLTEXT_TABLE,
+    IMPORT_TABLE,
+    MAX_PARTITION,
+    SCHEMA_TABLE,
+    STANDING_HIT_TABLE,
+    STANDING_QUERY_TABLE,
+    VERSIONED_TABLES
+)
+from .database import get_backend, get_pool
+from .utils import date_to_timestamp
+
+# Name of the advisory lock held while migrating, so that concurrent
+# deployments do not apply the same migration twice
+LOCK_NAME = "ranalyze_migrate"
+
+LOCK_TIMEOUT = 60
+
+# MySQL error codes meaning a statement's change already exists (table,
+# column, key or trigger already present, or already dropped)
+_ALREADY_APPLIED = {1050, 1060, 1061, 1091, 1359}
+
+# Trigger copying an entry's text into the FULLTEXT table as it is written
+_FULLTEXT_UPSERT_TRIGGER = """
+CREATE TRIGGER {{name}} AFTER {{event}} ON {{table}} FOR EACH ROW
+INSERT INTO {fulltext} (id, time_submitted, title, text_content)
+VALUES (new.id, new.time_submitted, {{title}}, {{text_content}})
+ON DUPLICATE KEY UPDATE time_submitted = VALUES(time_submitted),
+title = VALUES(title), text_content = VALUES(text_content)
+""".format(fulltext=FULLTEXT_TABLE)
+
+# Trigger removing an entry's text once it is deleted from both tiers
+_FULLTEXT_DELETE_TRIGGER = """
+CREATE TRIGGER {{name}} AFTER DELETE ON {{table}} FOR EACH ROW
+DELETE FROM {fulltext} WHERE id = old.id
+AND NOT EXISTS (SELECT 1 FROM {{other}} WHERE id = old.id)
+""".format(fulltext=FULLTEXT_TABLE)
+
+_FULLTEXT_COPY = """
+INSERT INTO {0} (id, time_submitted, title, text_content)
+SELECT id, time_submitted, title, text_content FROM {1}
+ON DUPLICATE KEY UPDATE time_submitted = VALUES(time_submitted),
+title = VALUES(title), text_content = VALUES(text_content)
+"""
+
+MIGRATIONS = (
+    (1, "Index entries and frequency for the queries the code issues", (
+        # duplicate word-days are merged into the lowest id before the
+        # unique key is added
+        """
+        UPDATE {table} f JOIN (
+            SELECT MIN(id) AS id, SUM(entries) AS entries, SUM(total) AS total
+            FROM {table} GROUP BY word, year, month, day HAVING COUNT(*) > 1
+        ) d ON f.id = d.id
+        SET f.entries = d.entries, f.total = d.total
+        """.format(table=FREQUENCY_TABLE),
+        """
+        DELETE f FROM {table} f JOIN (
+            SELECT MIN(id) AS id, word, year, month, day
+            FROM {table} GROUP BY word, year, month, day HAVING COUNT(*) > 1
+        ) d ON f.word = d.word AND f.year = d.year AND f.month = d.month
+            AND f.day = d.day AND f.id <> d.id
+        """.format(table=FREQUENCY_TABLE),
+        # word lookups in digest_entry and date filtered overviews
+        """
+        ALTER TABLE {}
+        ADD UNIQUE KEY ux_frequency_word_day (word, year, month, day),
+        ADD INDEX ix_frequency_day (year, month, day)
+        """.format(FREQUENCY_TABLE),
+        # subreddit and root_id are compared for equality, so they become
+        # indexable varchars; searches, update_posts and get_latest_post
+        # filter on subreddit and/or time_submitted
+        """
+        ALTER TABLE {}
+        MODIFY subreddit varchar(255),
+        MODIFY root_id varchar(255),
+        ADD INDEX ix_entries_subreddit_time (subreddit, time_submitted),
+        ADD INDEX ix_entries_time (time_submitted),
+        ADD INDEX ix_entries_root (root_id)
+        """.format(ENTRY_TABLE),
+        """
+        ALTER TABLE {}
+        ADD INDEX ix_config_name (name)
+        """.format(CONFIG_TABLE),
+        """
+        ALTER TABLE {}
+        ADD INDEX ix_import_permalink (permalink(255))
+        """.format(IMPORT_TABLE)
+    )),
+    (2, "Add the compressed archive tier for old entries", (
+        # same columns as entries, with title and text_content holding
+        # COMPRESS()ed text
+        """
+        CREATE TABLE {} (
+        id varchar(255) PRIMARY KEY, permalink text, root_id varchar(255),
+        up_votes integer, up_ratio real, time_submitted integer,
+        time_updated integer, posted_by text, title blob,
+        subreddit varchar(255), external_url text, text_content mediumblob,
+        parent_id varchar(255), gilded integer, deleted integer,
+        INDEX ix_archive_subreddit_time (subreddit, time_submitted),
+        INDEX ix_archive_time (time_submitted),
+        INDEX ix_archive_root (root_id),
+        INDEX ix_archive_parent (parent_id)
+        )
+        DEFAULT CHARACTER SET {}
+        """.format(ARCHIVE_TABLE, CHAR_SET),
+        # columns in the same order as entries, so both tiers can be queried
+        # as one UNION
+        """
+        CREATE OR REPLACE VIEW {} AS SELECT {} FROM {}
+        """.format(ARCHIVE_VIEW,
+                   ", ".join(["CONVERT(UNCOMPRESS({0}) USING {1}) AS {0}"
+                              .format(c, CHAR_SET)
+                              if c in COMPRESSED_FIELDS else c
+                              for c in ENTRY_COLUMNS]),
+                   ARCHIVE_TABLE)
+    )),
+    (3, "Range partition entries on time_submitted", (
+        # partitioned tables cannot have foreign keys, and every unique key
+        # must include the partitioning column
+        """
+        ALTER TABLE {}
+        DROP FOREIGN KEY {}_ibfk_1
+        """.format(ENTRY_TABLE, ENTRY_TABLE),
+        """
+        UPDATE {} SET time_submitted = 0 WHERE time_submitted IS NULL
+        """.format(ENTRY_TABLE),
+        """
+        ALTER TABLE {}
+        MODIFY time_submitted integer NOT NULL DEFAULT 0,
+        DROP PRIMARY KEY,
+        ADD PRIMARY KEY (id, time_submitted)
+        """.format(ENTRY_TABLE),
+        # everything starts in the catch-all partition; monthly partitions
+        # are split out of it by partitions.ensure_partitions()
+        """
+        ALTER TABLE {}
+        PARTITION BY RANGE (time_submitted) (
+        PARTITION {} VALUES LESS THAN MAXVALUE
+        )
+        """.format(ENTRY_TABLE, MAX_PARTITION)
+    )),
+    (4, "Add a FULLTEXT index over the text of both entry tiers", (
+        # partitioned InnoDB tables cannot have FULLTEXT indexes, so the
+        # text is copied to its own table
+        """
+        CREATE TABLE {} (
+        id varchar(255) PRIMARY KEY, time_submitted integer, title text,
+        text_content mediumtext, INDEX ix_fulltext_time (time_submitted)
+        )
+        DEFAULT CHARACTER SET {}
+        """.format(FULLTEXT_TABLE, CHAR_SET),
+        # triggers come before the copy, so that no entry written while it
+        # runs is missed; an entry leaves the table once it is in neither
+        # tier
+        _FULLTEXT_UPSERT_TRIGGER.format(name="tr_entries_fulltext_insert",
+                                        event="INSERT", table=ENTRY_TABLE,
+                                        title="new.title",
+                                        text_content="new.text_content"),
+        _FULLTEXT_UPSERT_TRIGGER.format(name="tr_entries_fulltext_update",
+                                        event="UPDATE", table=ENTRY_TABLE,
+                                        title="new.title",
+                                        text_content="new.text_content"),
+        _FULLTEXT_DELETE_TRIGGER.format(name="tr_entries_fulltext_delete",
+                                        table=ENTRY_TABLE,
+                                        other=ARCHIVE_TABLE),
+        _FULLTEXT_UPSERT_TRIGGER.format(
+            name="tr_archive_fulltext_insert", event="INSERT",
+            table=ARCHIVE_TABLE,
+            title="CONVERT(UNCOMPRESS(new.title) USING {})".format(CHAR_SET),
+            text_content="CONVERT(UNCOMPRESS(new.text_content) USING {})"
+                         .format(CHAR_SET)),
+        _FULLTEXT_UPSERT_TRIGGER.format(
+            name="tr_archive_fulltext_update", event="UPDATE",
+            table=ARCHIVE_TABLE,
+            title="CONVERT(UNCOMPRESS(new.title) USING {})".format(CHAR_SET),
+            text_content="CONVERT(UNCOMPRESS(new.text_content) USING {})"
+                         .format(CHAR_SET)),
+        _FULLTEXT_DELETE_TRIGGER.format(name="tr_archive_fulltext_delete",
+                                        table=ARCHIVE_TABLE,
+                                        other=ENTRY_TABLE),
+        _FULLTEXT_COPY.format(FULLTEXT_TABLE, ENTRY_TABLE),
+        _FULLTEXT_COPY.format(FULLTEXT_TABLE, ARCHIVE_VIEW),
+        # the index is built once, after the copy
+        """
+        ALTER TABLE {}
+        ADD FULLTEXT INDEX ft_entries_text (title, text_content)
+        """.format(FULLTEXT_TABLE)
+    )),
+    (5, "Index both entry tiers for keyset pagination by score", (
+        # pages sorted on time_submitted already seek on ix_*_time, whose
+        # entries end with the primary key
+        """
+        ALTER TABLE {}
+        ADD INDEX ix_entries_votes (up_votes, id)
+        """.format(ENTRY_TABLE),
+        """
+        ALTER TABLE {}
+        ADD INDEX ix_archive_votes (up_votes, id)
+        """.format(ARCHIVE_TABLE)
+    )),
+    (6, "Track data versions of the tables whose results are cached", (
+        """
+        CREATE TABLE {} (
+        name varchar(64) PRIMARY KEY, version bigint NOT NULL DEFAULT 0
+        )
+        DEFAULT CHARACTER SET {}
+        """.format(DATA_VERSION_TABLE, CHAR_SET),
+        """
+        INSERT IGNORE INTO {} (name, version) VALUES {}
+        """.format(DATA_VERSION_TABLE,
+                   ", ".join(["('{}', 0)".format(t)
+                              for t in sorted(VERSIONED_TABLES)]))
+    )),
+    (7, "Store standing queries and the entries they match on ingest", (
+        """
+        CREATE TABLE {} (
+        id integer PRIMARY KEY AUTO_INCREMENT, name varchar(255) NOT NULL,
+        expression text NOT NULL, created integer,
+        last_seen_hit bigint NOT NULL DEFAULT 0
+        )
+        DEFAULT CHARACTER SET {}
+        """.format(STANDING_QUERY_TABLE, CHAR_SET),
+        # hit ids only grow, so the hits new since a visit are a range of
+        # ix_hits_query
+        """
+        CREATE TABLE {} (
+        id bigint PRIMARY KEY AUTO_INCREMENT, query_id integer NOT NULL,
+        entry_id varchar(255) NOT NULL, matched integer,
+        UNIQUE KEY ux_hits_query_entry (query_id, entry_id),
+        KEY ix_hits_query (query_id, id)
+        )
+        DEFAULT CHARACTER SET {}
+        """.format(STANDING_HIT_TABLE, CHAR_SET)
+    )),
+)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(cursor):
+    """
+    Highest migration version recorded in the database, 0 if none. The
+    schema version table is created if it does not exist yet.
+    """
+
+    cursor.execute("""
+                   CREATE TABLE IF NOT EXISTS {} (
+                   version integer PRIMARY KEY, description varchar(255),
+                   applied integer
+                   )
+                   DEFAULT CHARACTER SET {}
+                   """.format(SCHEMA_TABLE, CHAR_SET))
+    cursor.execute("SELECT MAX(version) FROM {}".format(SCHEMA_TABLE))
+    return cursor.fetchone()[0] or 0
+
+
+def migrate(target=LATEST_VERSION):
+    """
+    Apply every migration newer than the database's recorded version, up to
+    and including `target`.
+    :return: list of the versions applied
+    """
+
+    backend = get_backend()
+    if not backend.MIGRATIONS:
+        # such backends create databases at their latest schema directly
+        with get_pool().connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT MAX(version) FROM {}".format(
+                    SCHEMA_TABLE))
+                version = cursor.fetchone()[0] or 0
+            finally:
+                cursor.close()
+        if version < target:
+            raise MigrationError(
+                "{} databases cannot be migrated from version {}, recreate "
+                "them with create_db".format(backend.NAME, version))
+        return []
+
+    applied = []
+    with get_pool().connection() as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+            if not cursor.fetchone()[0]:
+                raise MigrationError("Another migration is already running")
+            try:
+                version = current_version(cursor)
+                for number, description, statements in MIGRATIONS:
+                    if number <= version or number > target:
+                        continue
+                    print("Applying migration {}: {}".format(number,
+                                                             description))
+                    for statement in statements:
+                        try:
+                            cursor.execute(statement)
+                        except Exception as error:
+                            if (not error.args
+                                    or error.args[0] not in _ALREADY_APPLIED):
+                                raise
+                    cursor.execute(
+                        "INSERT INTO {} (version, description, applied) "
+                        "VALUES (%s, %s, %s)".format(SCHEMA_TABLE),
+                        (number, description,
+                         date_to_timestamp(datetime.utcnow())))
+                    connection.commit()
+                    applied.append(number)
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        finally:
+            cursor.close()
+    return applied
+
+
+class MigrationError(Exception):
+    """
+    Exceptions raised when migrations cannot be applied
+    """
+    pass
@@ -7,6 +7,7 @@ ModelObjectFactory subclass
 import abc
 
 from datetime import datetime
+from operator import attrgetter, itemgetter
 from .constants import (
     COMMENT_FIELDS,
     CONFIG_ENTRY_FIELDS,
@@ -17,52 +18,44 @@ from .constants import (
 from .utils import date_to_timestamp, sanitize_string
 
 
-class ModelObject(object, metaclass=abc.ABCMeta):
+class ModelMeta(abc.ABCMeta):
+    """
+    Generates compact, slot-based storage for every model class declaring a
+    FIELDS set, so instances carry no per-instance attribute dictionary.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        fields = namespace.get("FIELDS")
+        namespace["__slots__"] = tuple(sorted(fields)) if fields else ()
+        return super().__new__(mcs, name, bases, namespace)
+
+
+class ModelObject(object, metaclass=ModelMeta):
 
     KEY = "id"
 
+    FIELDS = None
+
     def __init__(self, **kwargs):
-        object.__setattr__(self, "_attrs",
-                           {key: (kwargs[key] if key in kwargs else None)
-                            for key in self.get_fields()})
+        for key in self.__slots__:
+            object.__setattr__(self, key, kwargs.get(key))
 
-    @staticmethod
-    @abc.abstractmethod
-    def get_fields():
-        pass
+    @classmethod
+    def get_fields(cls):
+        return cls.FIELDS
 
     def keys(self):
         return self.get_fields()
 
     def __getitem__(self, item):
-        return self.__getattr__(item)
+        return getattr(self, item)
 
     def __setitem__(self, key, value):
-        self.__setattr__(key, value)
-
-    def __getattr__(self, item):
-        if item not in self.get_fields():
-            message = ("No such attribute `{attribute}` in class "
-                       "`{class_name}`").format(
-                class_name=type(self).__name__,
-                attribute=item
-            )
-            raise AttributeError(message)
-        return self._attrs[item]
-
-    def __setattr__(self, key, value):
-        if key not in self.get_fields():
-            message = ("No such attribute `{attribute}` in class "
-                       "`{class_name}`").format(
-                class_name=type(self).__name__,
-                attribute=key
-            )
-            raise AttributeError(message)
-        self._attrs[key] = value
+        setattr(self, key, value)
 
     @property
     def dict(self):
-        return self._attrs.copy()
+        return {key: getattr(self, key) for key in self.__slots__}
 
 
 class ModelFactory(object, metaclass=abc.ABCMeta):
@@ -89,9 +82,7 @@ class ModelFactory(object, metaclass=abc.ABCMeta):
 
 class WordDay(ModelObject):
 
-    @staticmethod
-    def get_fields():
-        return WORD_DAY_FIELDS
+    FIELDS = WORD_DAY_FIELDS
 
 
 class WordDayFactory(ModelFactory):
@@ -123,21 +114,23 @@ class EntryFactory(ModelFactory, metaclass=abc.ABCMeta):
         "up_votes": lambda e: e.ups
     }
 
+    # Per-factory list of (field, getter) pairs, built on first use
+    _PRAW_GETTERS = {}
+
     @classmethod
     def from_praw(cls, praw_obj):
         """
         Creates an Entry from a PrawEntry object
         """
-        attrs = {}
-        target = cls._get_target()
-        fields = target.get_fields()
-        praw_map = cls._get_praw_map()
-        for key in fields:
-            if key in praw_map:
-                attrs[key] = praw_map[key](praw_obj)
-            else:
-                attrs[key] = getattr(praw_obj, key)
-        return target(**attrs)
+        if cls not in EntryFactory._PRAW_GETTERS:
+            praw_map = cls._get_praw_map()
+            EntryFactory._PRAW_GETTERS[cls] = [
+                (key, praw_map[key] if key in praw_map else attrgetter(key))
+                for key in cls._get_target().get_fields()
+            ]
+        attrs = {key: getter(praw_obj)
+                 for key, getter in EntryFactory._PRAW_GETTERS[cls]}
+        return cls._get_target()(**attrs)
 
     @staticmethod
     @abc.abstractmethod
@@ -155,9 +148,7 @@ class Comment(Entry):
     Class for comment entries into the database
     """
 
-    @staticmethod
-    def get_fields():
-        return COMMENT_FIELDS
+    FIELDS = COMMENT_FIELDS
 
 
 class CommentFactory(EntryFactory):
@@ -187,9 +178,7 @@ class Post(Entry):
     Class for post entries into the database
     """
 
-    @staticmethod
-    def get_fields():
-        return POST_FIELDS
+    FIELDS = POST_FIELDS
 
 
 class PostFactory(EntryFactory):
@@ -217,9 +206,7 @@ class PostFactory(EntryFactory):
 
 class ConfigEntry(ModelObject):
 
-    @staticmethod
-    def get_fields():
-        return CONFIG_ENTRY_FIELDS
+    FIELDS = CONFIG_ENTRY_FIELDS
 
 
 class ConfigEntryFactory(ModelFactory):
@@ -233,9 +220,7 @@ class Subreddit(ModelObject):
 
     KEY = "name"
 
-    @staticmethod
-    def get_fields():
-        return SUBREDDIT_FIELDS
+    FIELDS = SUBREDDIT_FIELDS
 
 
 class SubredditFactory(ModelFactory):
@@ -245,6 +230,59 @@ class SubredditFactory(ModelFactory):
         return Subreddit
 
 
+def row_decoder(columns):
+    """
+    Build a function converting rows of a result set, given as tuples in
+    `columns` order, into model objects. The model is chosen once for the
+    whole result set from its columns; entries are split into posts and
+    comments on whether each row has a permalink. Result sets matching no
+    model decode to plain dictionaries.
+    """
+
+    names = set(columns)
+    if "word" in names:
+        return _slot_reader(WordDay, columns)
+    elif "value" in names:
+        return _slot_reader(ConfigEntry, columns)
+    elif "scraping" in names:
+        return _slot_reader(Subreddit, columns)
+    elif "permalink" in names:
+        read_post = _slot_reader(Post, columns)
+        read_comment = _slot_reader(Comment, columns)
+        permalink = columns.index("permalink")
+        return lambda row: (read_comment(row) if row[permalink] is None
+                            else read_post(row))
+    return lambda row: dict(zip(columns, row))
+
+
+def _slot_reader(model, columns):
+    """
+    Build a function filling a new `model` instance straight from a row
+    tuple. Fields missing from the result set are set to None.
+    """
+
+    present = [slot for slot in model.__slots__ if slot in columns]
+    missing = [slot for slot in model.__slots__ if slot not in columns]
+    indexes = [columns.index(slot) for slot in present]
+    if len(indexes) == 1:
+        index = indexes[0]
+        values = lambda row: (row[index],)
+    else:
+        values = itemgetter(*indexes)
+    new = object.__new__
+    assign = object.__setattr__
+
+    def read(row):
+        obj = new(model)
+        for slot, value in zip(present, values(row)):
+            assign(obj, slot, value)
+        for slot in missing:
+            assign(obj, slot, None)
+        return obj
+
+    return read
+
+
 class NoSuchAttributeError(AttributeError):
     """
     Errors for attempted access of non-existent attributes
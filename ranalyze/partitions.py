@@ -0,0 +1,189 @@
+"""
+Monthly range partitions of the entries table.
+
+Entries are partitioned on time_submitted, one partition per calendar month
+(UTC) named pYYYYMM, followed by a catch-all partition for anything newer.
+Entries whose submission time is unknown, stored as 0, have a partition of
+their own ahead of the months, which is never dropped.
+New months are split out of the catch-all ahead of time, so that queries
+bounded on time_submitted only read the months they cover, and old months
+can be dropped, or moved to the archive tier, without deleting row by row.
+"""
+
+import datetime
+
+from contextlib import contextmanager
+from .archive import copy_sql
+from .constants import (
+    ARCHIVE_TABLE,
+    ENTRY_TABLE,
+    FULLTEXT_TABLE,
+    MAX_PARTITION,
+    PARTITION_MONTHS_AHEAD,
+    UNKNOWN_TIME_PARTITION
+)
+from .database import bump_data_version, get_backend, get_pool
+from .utils import date_to_timestamp
+
+# Name of the advisory lock held while partitions are changed
+LOCK_NAME = "ranalyze_partitions"
+
+LOCK_TIMEOUT = 60
+
+_PARTITION_FORMAT = "p{:04d}{:02d}"
+
+
+def drop_partitions(before, archive=False):
+    """
+    Drop every monthly partition whose entries were all submitted before
+    the `before` date. Entries of unknown submission time are kept.
+    :param archive: copy the partitions' entries into the archive tier
+                    before dropping them
+    :return: list of the partitions dropped
+    """
+
+    if not get_backend().PARTITIONS:
+        raise PartitionError("The {} backend has no partitions".format(
+            get_backend().NAME))
+
+    cutoff = date_to_timestamp(before)
+    dropped = []
+    with _partition_lock() as cursor:
+        _split_unknown_time(cursor)
+        for name, bound in _partitions(cursor):
+            if (name == UNKNOWN_TIME_PARTITION or bound is None
+                    or bound > cutoff):
+                continue
+            if archive:
+                cursor.execute(copy_sql("{} PARTITION ({})".format(ENTRY_TABLE,
+                                                                   name)))
+            cursor.execute("ALTER TABLE {} DROP PARTITION {}".format(
+                ENTRY_TABLE, name))
+            # dropping a partition fires no delete triggers, and every
+            # older partition but the unknown time one is already gone
+            cursor.execute("DELETE t FROM {} t LEFT JOIN {} a ON a.id = t.id "
+                           "WHERE t.time_submitted > 0 "
+                           "AND t.time_submitted < %s AND a.id IS NULL"
+                           .format(FULLTEXT_TABLE, ARCHIVE_TABLE), (bound,))
+            dropped.append(name)
+    if dropped:
+        bump_data_version(ENTRY_TABLE)
+    return dropped
+
+
+def ensure_partitions(months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+    Split monthly partitions out of the catch-all partition, up to and
+    including `months_ahead` months after the current one. On a freshly
+    partitioned table this starts from the month of the oldest entry, and
+    the partition of unknown submission times is split out first.
+    Backends without partitions have nothing to create.
+    :return: list of the partitions created
+    """
+
+    if not get_backend().PARTITIONS:
+        return []
+
+    today = datetime.datetime.utcnow()
+    last = _add_months(today.year, today.month, months_ahead)
+    with _partition_lock() as cursor:
+        created = _split_unknown_time(cursor)
+        bounds = [bound for name, bound in _partitions(cursor)
+                  if bound is not None and name != UNKNOWN_TIME_PARTITION]
+        if bounds:
+            start = datetime.datetime.utcfromtimestamp(bounds[-1])
+        else:
+            # entries without a submission time are stored as 0, and have
+            # their own partition
+            cursor.execute("SELECT MIN(time_submitted) FROM {} "
+                           "WHERE time_submitted > 0".format(ENTRY_TABLE))
+            oldest = cursor.fetchone()[0]
+            start = (datetime.datetime.utcfromtimestamp(oldest)
+                     if oldest is not None else today)
+        months = []
+        year, month = start.year, start.month
+        while (year, month) <= last:
+            months.append((year, month))
+            year, month = _add_months(year, month, 1)
+        if not months:
+            return created
+        definitions = ["PARTITION {} VALUES LESS THAN ({})".format(
+            _PARTITION_FORMAT.format(year, month),
+            date_to_timestamp(datetime.date(*_add_months(year, month, 1), 1)))
+            for year, month in months]
+        definitions.append("PARTITION {} VALUES LESS THAN MAXVALUE".format(
+            MAX_PARTITION))
+        cursor.execute("ALTER TABLE {} REORGANIZE PARTITION {} INTO ({})"
+                       .format(ENTRY_TABLE, MAX_PARTITION,
+                               ", ".join(definitions)))
+    return created + [_PARTITION_FORMAT.format(year, month)
+                      for year, month in months]
+
+
+def _add_months(year, month, months):
+
+    month += months - 1
+    return year + month // 12, month % 12 + 1
+
+
+@contextmanager
+def _partition_lock():
+    """
+    Yield a cursor on a pooled connection while holding the partition lock
+    """
+
+    with get_pool().connection() as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+            if not cursor.fetchone()[0]:
+                raise PartitionError("Partitions are already being changed")
+            try:
+                yield cursor
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        finally:
+            cursor.close()
+
+
+def _split_unknown_time(cursor):
+    """
+    Split the partition of unknown submission times out of the first
+    partition, unless it already exists
+    :return: list of the partitions created
+    """
+
+    name, bound = _partitions(cursor)[0]
+    if name == UNKNOWN_TIME_PARTITION:
+        return []
+    cursor.execute("ALTER TABLE {} REORGANIZE PARTITION {} INTO ("
+                   "PARTITION {} VALUES LESS THAN (1), "
+                   "PARTITION {} VALUES LESS THAN ({}))".format(
+                       ENTRY_TABLE, name, UNKNOWN_TIME_PARTITION, name,
+                       "MAXVALUE" if bound is None else bound))
+    return [UNKNOWN_TIME_PARTITION]
+
+
+def _partitions(cursor):
+    """
+    (name, upper bound) of each partition of the entries table in order, the
+    bound being None for the catch-all partition
+    """
+
+    cursor.execute("SELECT PARTITION_NAME, PARTITION_DESCRIPTION "
+                   "FROM information_schema.PARTITIONS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+                   "ORDER BY PARTITION_ORDINAL_POSITION", (ENTRY_TABLE,))
+    partitions = [(name, None if bound == "MAXVALUE" else int(bound))
+                  for name, bound in cursor.fetchall()]
+    if not partitions or partitions[0][0] is None:
+        raise PartitionError("{} is not partitioned, run the migrations "
+                             "first".format(ENTRY_TABLE))
+    return partitions
+
+
+class PartitionError(Exception):
+    """
+    Exceptions raised when the entries partitions cannot be changed
+    """
+    pass
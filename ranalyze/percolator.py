@@ -0,0 +1,255 @@
+"""
+Standing queries: saved search expressions matched against entries as they
+are ingested.
+
+Each expression is compiled once (see search.compile_expression) and
+evaluated in-process against every entry scraped or imported, with the case
+and accent insensitive substring matching of a LIKE search. Matches are
+appended to the hits table, whose ids only grow, so the matches new since a
+query was last visited are a range of its (query_id, id) index rather than a
+search over every entry.
+
+So that hundreds of standing queries stay cheap per entry, every query is
+filed under anchor terms, at least one of which each entry it matches must
+contain. An entry is only evaluated against the queries filed under the
+anchors it contains, and each distinct anchor is looked for once.
+"""
+
+from datetime import datetime
+from .archive import entry_tables
+from .constants import (
+    STANDING_HIT_TABLE,
+    STANDING_QUERY_TABLE,
+    UPSERT_CHUNK_SIZE
+)
+from .database import execute_query, execute_transaction
+from .query import (
+    PLACEHOLDER,
+    Condition,
+    DeleteQuery,
+    InsertQuery,
+    RawQuery,
+    SelectQuery,
+    UpdateQuery,
+    dialect,
+    in_condition
+)
+from .search import (
+    AndNode,
+    ConstantNode,
+    NotNode,
+    OrNode,
+    TextNode,
+    compile_expression
+)
+from .textindex import fold
+from .utils import date_to_timestamp
+
+# Values of a row of the hits table: query id, entry id and match time
+_HIT_ROW = "({})".format(", ".join([PLACEHOLDER] * 3))
+
+
+class Percolator(object):
+    """
+    Matcher of entries against a set of compiled standing queries
+    """
+
+    def __init__(self, queries):
+        """
+        :param queries: iterable of (query id, normalized tree) pairs
+        """
+
+        self._anchored = {}
+        self._unanchored = []
+        for query_id, tree in queries:
+            anchors = _anchors(tree)
+            if anchors is None:
+                self._unanchored.append((query_id, tree))
+            for term in anchors or ():
+                self._anchored.setdefault(term, []).append((query_id, tree))
+
+    def match(self, entry):
+        """
+        :return: set of the ids of the queries matching an entry
+        """
+
+        text = "\0".join([fold(getattr(entry, "title", None) or ""),
+                          fold(entry.text_content or "")])
+        candidates = dict(self._unanchored)
+        for term, queries in self._anchored.items():
+            if term in text:
+                candidates.update(queries)
+        found = {}
+        return {query_id for query_id, tree in candidates.items()
+                if _matches(tree, text, found)}
+
+
+def add_standing_query(name, expression):
+    """
+    Save a search expression to be matched against every entry ingested
+    from now on.
+    :return: id of the new standing query
+    """
+
+    # malformed expressions raise ExpressionError before anything is saved
+    compile_expression(expression)
+    query = InsertQuery(STANDING_QUERY_TABLE, {
+        "name": name,
+        "expression": expression,
+        "created": date_to_timestamp(datetime.utcnow())
+    })
+    return execute_query(query, commit=True, only_id=True)
+
+
+def new_hits(query_id, limit=None, mark_seen=True):
+    """
+    Entries a standing query matched since its hits were last seen, in the
+    order they were matched, and mark them seen unless mark_seen=False.
+    :return: list of entries, None if there is no such standing query
+    """
+
+    query = SelectQuery(table=STANDING_QUERY_TABLE, columns="last_seen_hit",
+                        where=Condition("id", query_id))
+    rows = execute_query(query, transpose=False)
+    if not rows:
+        return None
+    condition = (Condition("query_id", query_id)
+                 & Condition("id", ">", rows[0]["last_seen_hit"]))
+    query = SelectQuery(table=STANDING_HIT_TABLE, columns="id, entry_id",
+                        where=condition, order="id", limit=limit)
+    hits = execute_query(query, transpose=False)
+    if not hits:
+        return []
+
+    query = SelectQuery(table=entry_tables(None),
+                        where=in_condition("id", [h["entry_id"] for h in hits]))
+    entries = {entry.id: entry for entry in execute_query(query)}
+    if mark_seen:
+        query = UpdateQuery(table=STANDING_QUERY_TABLE,
+                            values={"last_seen_hit": hits[-1]["id"]},
+                            where=Condition("id", query_id))
+        execute_query(query, commit=True)
+    # entries deleted since they were matched are left out
+    return [entries[h["entry_id"]] for h in hits if h["entry_id"] in entries]
+
+
+def percolate(entries):
+    """
+    Match newly ingested entries against every standing query, recording
+    the matches in the hits table. Entries matched before are not recorded
+    again.
+    :return: number of new hits
+    """
+
+    entries = list(entries)
+    queries = _compiled_queries() if entries else []
+    if not queries:
+        return 0
+
+    percolator = Percolator(queries)
+    hits = [(query_id, entry.id) for entry in entries
+            for query_id in sorted(percolator.match(entry))]
+
+    matched = date_to_timestamp(datetime.utcnow())
+    statements = []
+    for start in range(0, len(hits), UPSERT_CHUNK_SIZE):
+        chunk = hits[start:start + UPSERT_CHUNK_SIZE]
+        sql = "{} {} (query_id, entry_id, matched) VALUES {}".format(
+            dialect().insert_ignore, STANDING_HIT_TABLE,
+            ", ".join([_HIT_ROW] * len(chunk)))
+        statements.append(RawQuery(sql, [value for query_id, entry_id in chunk
+                                         for value in (query_id, entry_id,
+                                                       matched)]))
+    return sum(execute_transaction(statements))
+
+
+def remove_standing_query(query_id):
+    """
+    Delete a standing query and its hits
+    """
+
+    execute_transaction([
+        DeleteQuery(table=STANDING_HIT_TABLE,
+                    where=Condition("query_id", query_id)),
+        DeleteQuery(table=STANDING_QUERY_TABLE,
+                    where=Condition("id", query_id))
+    ])
+
+
+def standing_queries():
+    """
+    Every standing query, with its number of hits not yet seen
+    """
+
+    query = RawQuery(
+        "SELECT q.id, q.name, q.expression, q.created, "
+        "(SELECT COUNT(*) FROM {1} h WHERE h.query_id = q.id "
+        "AND h.id > q.last_seen_hit) AS new_hits "
+        "FROM {0} q ORDER BY q.id".format(STANDING_QUERY_TABLE,
+                                          STANDING_HIT_TABLE))
+    return execute_query(query, transpose=False)
+
+
+def _anchors(node):
+    """
+    Set of folded terms of which every entry matching a normalized tree
+    contains at least one, or None if matching entries need not contain
+    any term
+    """
+
+    if isinstance(node, TextNode):
+        return {fold(node.data)}
+    elif isinstance(node, ConstantNode):
+        return None if node.data else set()
+    elif isinstance(node, AndNode):
+        anchors = [a for a in map(_anchors, node.children) if a is not None]
+        if not anchors:
+            return None
+        # the fewest, longest terms rule out the most entries
+        return min(anchors, key=lambda a: (len(a), -min(map(len, a),
+                                                        default=0)))
+    elif isinstance(node, OrNode):
+        anchors = set()
+        for child in node.children:
+            child_anchors = _anchors(child)
+            if child_anchors is None:
+                return None
+            anchors |= child_anchors
+        return anchors
+    return None
+
+
+def _compiled_queries():
+    """
+    (id, normalized tree) of every standing query
+    """
+
+    query = SelectQuery(table=STANDING_QUERY_TABLE, columns="id, expression")
+    compiled = []
+    for row in execute_query(query, transpose=False):
+        try:
+            compiled.append((row["id"], compile_expression(row["expression"])))
+        except Exception as error:
+            print("Skipping standing query {}: {}".format(row["id"], error))
+    return compiled
+
+
+def _matches(node, text, found):
+    """
+    Whether folded entry text matches a normalized tree, memoizing the
+    terms looked for in `found`
+    """
+
+    if isinstance(node, TextNode):
+        if node.data not in found:
+            found[node.data] = fold(node.data) in text
+        return found[node.data]
+    elif isinstance(node, ConstantNode):
+        return node.data
+    elif isinstance(node, NotNode):
+        return not _matches(node.left_child, text, found)
+    elif isinstance(node, AndNode):
+        return all(_matches(child, text, found) for child in node.children)
+    elif isinstance(node, OrNode):
+        return any(_matches(child, text, found) for child in node.children)
+    raise RuntimeError("Unrecognized node type `{}`".format(node.__class__))
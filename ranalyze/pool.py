@@ -0,0 +1,178 @@
+"""
+Thread-safe pool of reusable database connections.
+"""
+
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+from .constants import POOL_PING_INTERVAL, POOL_SIZE, POOL_TIMEOUT
+
+
+class ConnectionPool(object):
+    """
+    A bounded pool of database connections. Connections are created lazily by
+    calling `connect`, handed out by `acquire` and returned with `release`.
+    Idle connections are pinged before reuse once they have been idle for
+    longer than `ping_interval` seconds, and replaced if they have gone stale.
+    """
+
+    def __init__(self, connect, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 ping_interval=POOL_PING_INTERVAL):
+        """
+        :param connect: callable returning a new, fully prepared connection
+        :param size: maximum number of connections open at once
+        :param timeout: seconds to wait for a free connection before failing
+        :param ping_interval: idle seconds after which a connection is
+         health-checked before being reused
+        """
+
+        self._connect = connect
+        self._condition = threading.Condition()
+        self._idle = deque()  # (connection, time last released) pairs
+        self._in_use = 0
+        self._closed = False
+        self._counters = {
+            "created": 0,
+            "reused": 0,
+            "discarded": 0,
+            "waits": 0,
+            "timeouts": 0
+        }
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+
+    def acquire(self):
+        """
+        Check a connection out of the pool, opening a new one if none are
+        idle and the pool is not full. Blocks for up to `timeout` seconds
+        when every connection is in use.
+        """
+
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            while not self._idle and self._in_use >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise PoolTimeoutError(self.size, self.timeout)
+                self._counters["waits"] += 1
+                self._condition.wait(remaining)
+            entry = self._idle.pop() if self._idle else None
+            self._in_use += 1
+
+        try:
+            if entry is None:
+                return self._create()
+            connection, released = entry
+            if time.monotonic() - released > self.ping_interval:
+                return self._check(connection)
+            self._count("reused")
+            return connection
+        except BaseException:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, connection, discard=False):
+        """
+        Return a connection to the pool. Discarded connections, and any
+        connection released once the pool is closed, are closed instead of
+        being kept for reuse.
+        """
+
+        with self._condition:
+            self._in_use -= 1
+            discard = discard or self._closed
+            if not discard:
+                self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+        if discard:
+            self._close(connection)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager checking a connection out for the duration of the
+        block. If the block raises, any open transaction is rolled back; a
+        connection which cannot even be rolled back is discarded.
+        """
+
+        connection = self.acquire()
+        try:
+            yield connection
+        except BaseException:
+            try:
+                connection.rollback()
+            except Exception:
+                self.release(connection, discard=True)
+            else:
+                self.release(connection)
+            raise
+        self.release(connection)
+
+    def close(self):
+        """
+        Close every idle connection. Connections currently checked out are
+        closed as they are released.
+        """
+
+        with self._condition:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        for connection, _ in idle:
+            self._close(connection)
+
+    @property
+    def stats(self):
+        """
+        Snapshot of the pool's size, occupancy and lifetime counters
+        """
+
+        with self._condition:
+            stats = dict(self._counters)
+            stats.update(size=self.size,
+                         in_use=self._in_use,
+                         idle=len(self._idle))
+        return stats
+
+    def _check(self, connection):
+        try:
+            connection.ping()
+        except Exception:
+            self._close(connection)
+            return self._create()
+        self._count("reused")
+        return connection
+
+    def _close(self, connection):
+        self._count("discarded")
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _count(self, counter):
+        with self._condition:
+            self._counters[counter] += 1
+
+    def _create(self):
+        connection = self._connect()
+        self._count("created")
+        return connection
+
+
+class PoolTimeoutError(Exception):
+    """
+    Raised when no connection becomes available within the pool timeout
+    """
+
+    _FORMAT = "All {size} connections in use after waiting {timeout}s"
+
+    def __init__(self, size, timeout):
+        super().__init__(self._FORMAT.format(size=size, timeout=timeout))
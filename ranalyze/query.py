@@ -1,15 +1,110 @@
 """
 SQL Query Builder
+
+Conditions and queries carry their own positional parameters, so nothing is
+shared between queries. The SQL text of each query depends only on its
+shape (table, columns, condition structure) and the active dialect, and is
+compiled once per shape and cached; repeated builds only bind new values.
+
+Placeholders are always written MySQLdb style (%s, with a literal % written
+as %%); backends using another parameter style translate them.
 """
 
 import abc
 
+from functools import lru_cache
 
-class Condition:
+from .constants import FULLTEXT_TABLE, SQL_CACHE_SIZE
 
-    _param_counter = 0
+PLACEHOLDER = "%s"
 
-    params = {}
+
+class Dialect(object):
+    """
+    The parts of the generated SQL which differ between database engines
+    """
+
+    def __init__(self, name, upsert, upsert_value, limited_delete, month,
+                 insert_ignore, fulltext=None):
+        """
+        :param name: engine name
+        :param upsert: clause turning an insert into an upsert, formatted
+                       with the comma separated column updates
+        :param upsert_value: update of one column to its inserted value
+        :param limited_delete: DELETE statement restricted to the first
+                               rows in some order
+        :param month: expression of the UTC month, as YYYY-MM, of a unix
+                      timestamp column
+        :param insert_ignore: start of an INSERT statement skipping rows
+                              whose key already exists
+        :param fulltext: condition matching entries against one boolean
+                         mode FULLTEXT expression parameter, None if the
+                         engine has no FULLTEXT search
+        """
+        self.name = name
+        self.upsert = upsert
+        self.upsert_value = upsert_value
+        self.limited_delete = limited_delete
+        self.month = month
+        self.insert_ignore = insert_ignore
+        self.fulltext = fulltext
+
+    def upsert_clause(self, columns):
+        """
+        Clause updating `columns` to their inserted values when an inserted
+        row collides with an existing key
+        """
+
+        return self.upsert.format(", ".join([self.upsert_value.format(c)
+                                             for c in columns]))
+
+
+MYSQL = Dialect("mysql",
+                upsert="ON DUPLICATE KEY UPDATE {}",
+                upsert_value="{0}=VALUES({0})",
+                limited_delete=("DELETE FROM {table} WHERE {where} "
+                                "ORDER BY {order} LIMIT {limit}"),
+                # DATE_ADD on a date, unlike FROM_UNIXTIME, ignores the
+                # session time zone
+                month=("DATE_FORMAT(DATE_ADD('1970-01-01', INTERVAL {} "
+                       "SECOND), '%%Y-%%m')"),
+                insert_ignore="INSERT IGNORE INTO",
+                fulltext=("id IN (SELECT id FROM {} WHERE MATCH(title, "
+                          "text_content) AGAINST ({} IN BOOLEAN MODE))"
+                          .format(FULLTEXT_TABLE, PLACEHOLDER)))
+
+# SQLite can only order and limit a DELETE through a subquery, and resolves
+# conflicts on any unique key when no conflict target is given
+SQLITE = Dialect("sqlite",
+                 upsert="ON CONFLICT DO UPDATE SET {}",
+                 upsert_value="{0}=excluded.{0}",
+                 limited_delete=("DELETE FROM {table} WHERE rowid IN ("
+                                 "SELECT rowid FROM {table} WHERE {where} "
+                                 "ORDER BY {order} LIMIT {limit})"),
+                 month="strftime('%%Y-%%m', {}, 'unixepoch')",
+                 insert_ignore="INSERT OR IGNORE INTO")
+
+_dialect = MYSQL
+
+
+def dialect():
+    """
+    Dialect queries are currently built in
+    """
+
+    return _dialect
+
+
+def set_dialect(new_dialect):
+    """
+    Build every following query in another dialect
+    """
+
+    global _dialect
+    _dialect = new_dialect
+
+
+class Condition:
 
     def __init__(self, *args):
         """
@@ -24,6 +119,7 @@ class Condition:
         :param args:
         """
         self.sql = ""
+        self.params = []
         nargs = len(args)
         if nargs == 0:
             return
@@ -37,37 +133,17 @@ class Condition:
             if operand == "=":
                 operand = "IS"
         else:
-            if value in Condition.params.values():
-                keys = Condition.params.keys()
-                values = Condition.params.values()
-                param_id = list(keys)[list(values).index(value)]
-                param = "%({})s".format(param_id)
-            else:
-                param = "%(_c{})s".format(Condition._param_counter)
-                Condition._param_counter += 1
-                self.params[param[2:-2]] = value  # slice the colon from param
+            param = PLACEHOLDER
+            self.params = [value]
         self.sql = "{} {} {}".format(column, operand, param)
 
     def __and__(self, other):
 
-        condition = Condition()
-        # Logical XOR to check if only one condition is empty
-        if bool(self.sql) is not bool(other.sql):
-            condition.sql = self.sql if self.sql else other.sql
-        else:
-            condition.sql = "({} AND {})".format(self.sql, other.sql)
-        condition.params = dict(self.params, **other.params)
-        return condition
+        return self._combine(other, "({} AND {})")
 
     def __or__(self, other):
 
-        condition = Condition()
-        if bool(self.sql) is not bool(other.sql):
-            condition.sql = self.sql if self.sql else other.sql
-        else:
-            condition.sql = "({} OR {})".format(self.sql, other.sql)
-        condition.params = dict(self.params, **other.params)
-        return condition
+        return self._combine(other, "({} OR {})")
 
     def __invert__(self):
 
@@ -80,6 +156,21 @@ class Condition:
 
         return bool(self.sql)
 
+    def _combine(self, other, template):
+
+        condition = Condition()
+        if not self.sql and not other.sql:
+            return condition
+        # Logical XOR to check if only one condition is empty
+        if bool(self.sql) is not bool(other.sql):
+            source = self if self.sql else other
+            condition.sql = source.sql
+            condition.params = source.params
+        else:
+            condition.sql = template.format(self.sql, other.sql)
+            condition.params = self.params + other.params
+        return condition
+
 
 class Query(object, metaclass=abc.ABCMeta):
     """
@@ -99,14 +190,22 @@ class Query(object, metaclass=abc.ABCMeta):
 
 class DeleteQuery(Query):
     """
+    Delete the rows matching a condition, or with `order` and `limit` only
+    the first `limit` of them
     """
 
     FORMAT = "DELETE FROM {table} WHERE {where}"
 
-    def __init__(self, table, where):
-        self._params = where.params
-        self._sql = DeleteQuery.FORMAT.format(table=table,
-                                              where=where.sql)
+    def __init__(self, table, where, order=None, limit=None):
+        self._params = list(where.params)
+        if limit:
+            self._params.append(int(limit))
+            self._sql = _compile(_dialect.limited_delete, table=table,
+                                 where=where.sql, order=order,
+                                 limit=PLACEHOLDER)
+        else:
+            self._sql = _compile(DeleteQuery.FORMAT, table=table,
+                                 where=where.sql)
 
     @property
     def sql(self):
@@ -124,12 +223,34 @@ class InsertQuery(Query):
 
     def __init__(self, table, values):
 
-        params = {key: "_i{}".format(i) for i, key in enumerate(values.keys())}
-        self._params = {param: values[key] for key, param in params.items()}
-        values = ", ".join(["%({})s".format(v) for v in params.values()])
-        self._sql = InsertQuery.FORMAT.format(table=table,
-                                              columns=", ".join(params.keys()),
-                                              values=values)
+        columns = tuple(values.keys())
+        self._params = [values[key] for key in columns]
+        self._sql = _compile(InsertQuery.FORMAT,
+                             table=table,
+                             columns=", ".join(columns),
+                             values=_placeholders(len(columns)))
+
+    @property
+    def sql(self):
+        return self._sql
+
+    @property
+    def params(self):
+        return self._params
+
+
+class UpsertQuery(Query):
+    """
+    Multi-row insert which updates any row whose key already exists
+    """
+
+    FORMAT = "INSERT INTO {table} ({columns}) VALUES {rows} {upsert}"
+
+    def __init__(self, table, rows, key="id"):
+
+        columns = tuple(sorted(rows[0].keys()))
+        self._params = [row[column] for row in rows for column in columns]
+        self._sql = _upsert_sql(table, columns, len(rows), key, _dialect)
 
     @property
     def sql(self):
@@ -146,31 +267,44 @@ class SelectQuery(Query):
     FORMAT = "{select} {columns} FROM {table} {where} {group} {order} {limit} {offset}"
 
     def __init__(self, table, columns="*", where=None, distinct=False,
-                 order=None, limit=None, group=None, offset=None):
-
-        limit = "LIMIT {}".format(limit) if limit else ""
-
-        order = "ORDER BY {}".format(order) if order else ""
-
-        group = "GROUP BY {}".format(group) if group else ""
+                 order=None, limit=None, group=None, offset=None,
+                 limit_branches=True):
+        """
+        :param limit_branches: when querying a tuple of tables with a limit,
+                               also limit every branch of the union; columns
+                               aggregating over all rows need this off
+        """
 
-        offset = "OFFSET {}".format(offset) if offset else ""
+        # a tuple of tables is queried as the UNION ALL of each table, with
+        # the condition applied inside every branch so each can use its own
+        # indexes; a page is also limited within every branch, so each stops
+        # after the rows the page could need
+        branches = len(table) if type(table) is tuple else 1
+        limit_branches = bool(branches > 1 and limit and limit_branches
+                              and not group)
+        self._params = []
+        for _ in range(branches):
+            self._params.extend(where.params if where else [])
+            if limit_branches:
+                self._params.append(int(limit) + int(offset or 0))
+
+        if limit:
+            self._params.append(int(limit))
+        if offset:
+            self._params.append(int(offset))
 
         if type(columns) is list:
             columns = ", ".join(columns)
-        self._params, where = ((where.params, "WHERE {}".format(where.sql))
-                               if where else ({}, ""))
-        select = "SELECT"
-        if distinct:
-            select += " DISTINCT"
-        self._sql = SelectQuery.FORMAT.format(select=select,
-                                              columns=columns,
-                                              table=table,
-                                              where=where,
-                                              group=group,
-                                              order=order,
-                                              limit=limit,
-                                              offset=offset)
+
+        self._sql = _select_sql(table=table,
+                                columns=columns,
+                                where=where.sql if where else "",
+                                distinct=distinct,
+                                order=order,
+                                group=group,
+                                limit=bool(limit),
+                                offset=bool(offset),
+                                limit_branches=limit_branches)
 
     @property
     def sql(self):
@@ -181,22 +315,15 @@ class SelectQuery(Query):
         return self._params
 
 
-class UpdateQuery(Query):
+class RawQuery(Query):
     """
+    Hand-written SQL with positional parameters, for statements the other
+    builders do not cover
     """
 
-    FORMAT = "UPDATE {table} SET {columns} WHERE {where}"
-
-    def __init__(self, table, values, where):
-
-        params = {key: "_u{}".format(i) for i, key in enumerate(values.keys())}
-        columns = ", ".join(["{}=%({})s".format(key, param)
-                             for key, param in params.items()])
-        self._params = {param: values[key] for key, param in params.items()}
-        self._params.update(where.params)
-        self._sql = UpdateQuery.FORMAT.format(table=table,
-                                              columns=columns,
-                                              where=where.sql)
+    def __init__(self, sql, params=()):
+        self._sql = sql
+        self._params = list(params)
 
     @property
     def sql(self):
@@ -207,17 +334,18 @@ class UpdateQuery(Query):
         return self._params
 
 
-class DeleteQuery(Query):
+class UpdateQuery(Query):
     """
     """
 
-    FORMAT = "DELETE FROM {table} WHERE {where}"
+    FORMAT = "UPDATE {table} SET {columns} WHERE {where}"
+
+    def __init__(self, table, values, where):
 
-    def __init__(self, table, where):
-        self._sql = DeleteQuery.FORMAT.format(table=table,
-                                              where=where.sql)
-        self._params = {}
-        self._params.update(where.params)
+        keys = tuple(values.keys())
+        self._params = [values[key] for key in keys]
+        self._params.extend(where.params)
+        self._sql = _update_sql(table, keys, where.sql)
 
     @property
     def sql(self):
@@ -226,3 +354,101 @@ class DeleteQuery(Query):
     @property
     def params(self):
         return self._params
+
+
+def in_condition(column, values):
+    """
+    Condition matching a column against any of a list of values; with no
+    values it matches nothing
+    """
+
+    condition = Condition()
+    values = list(values)
+    if values:
+        condition.sql = "{} IN ({})".format(
+            column, ", ".join([PLACEHOLDER] * len(values)))
+        condition.params = values
+    else:
+        condition.sql = "1 = 0"
+    return condition
+
+
+def time_range(column, after=None, before=None, inclusive=False):
+    """
+    Condition bounding an integer timestamp column, which is compared bare
+    against integer parameters so MySQL can prune the partitions of a table
+    partitioned on it.
+    :param inclusive: whether `before` itself is in range
+    """
+
+    condition = Condition()
+    if after is not None:
+        condition &= Condition(column, ">=", int(after))
+    if before is not None:
+        condition &= Condition(column, "<=" if inclusive else "<", int(before))
+    return condition
+
+
+def cache_info():
+    """
+    Hit/miss statistics of the compiled SQL caches
+    """
+
+    return {name: function.cache_info()._asdict()
+            for name, function in (("compile", _compile),
+                                   ("select", _select_sql),
+                                   ("update", _update_sql),
+                                   ("upsert", _upsert_sql))}
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def _compile(template, **parts):
+    return template.format(**parts)
+
+
+def _placeholders(count):
+    return ", ".join([PLACEHOLDER] * count)
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def _select_sql(table, columns, where, distinct, order, group, limit, offset,
+                limit_branches=False):
+
+    select = "SELECT DISTINCT" if distinct else "SELECT"
+    where = "WHERE {}".format(where) if where else ""
+    if type(table) is tuple:
+        branches = ["SELECT * FROM {} {}".format(t, where) for t in table]
+        if limit_branches:
+            order_by = " ORDER BY {}".format(order) if order else ""
+            branches = ["SELECT * FROM ({}{} LIMIT {}) AS {}".format(
+                branch, order_by, PLACEHOLDER, t)
+                for branch, t in zip(branches, table)]
+        table = "({}) AS {}".format(" UNION ALL ".join(branches), table[0])
+        where = ""
+    return SelectQuery.FORMAT.format(
+        select=select,
+        columns=columns,
+        table=table,
+        where=where,
+        group="GROUP BY {}".format(group) if group else "",
+        order="ORDER BY {}".format(order) if order else "",
+        limit="LIMIT {}".format(PLACEHOLDER) if limit else "",
+        offset="OFFSET {}".format(PLACEHOLDER) if offset else "")
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def _update_sql(table, keys, where):
+
+    columns = ", ".join(["{}={}".format(key, PLACEHOLDER) for key in keys])
+    return UpdateQuery.FORMAT.format(table=table, columns=columns, where=where)
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def _upsert_sql(table, columns, num_rows, key, dialect):
+
+    row = "({})".format(_placeholders(len(columns)))
+    upsert = dialect.upsert_clause([c for c in columns if c != key])
+    return UpsertQuery.FORMAT.format(table=table,
+                                     columns=", ".join(columns),
+                                     rows=", ".join([row] * num_rows),
+                                     upsert=upsert)
@@ -9,11 +9,16 @@ Tool to traverse a set of subreddits extracting post/comment information includi
 import datetime
 import praw
 
-from .constants import ENTRY_TABLE, SUBREDDIT_TABLE
-from .database import add_update_object, execute_query, get_latest_post
+from .constants import ENTRY_TABLE, SUBREDDIT_TABLE, UPSERT_CHUNK_SIZE
+from .database import (
+    add_update_objects,
+    execute_query,
+    get_latest_post
+)
 from .frequency import digest_entry
-from .models import CommentFactory, Post, PostFactory
-from .query import Condition, SelectQuery, UpdateQuery
+from .models import CommentFactory, PostFactory
+from .percolator import percolate
+from .query import Condition, SelectQuery, UpdateQuery, time_range
 from .utils import date_to_timestamp
 
 
@@ -112,17 +117,20 @@ def update_posts(days_ago):
     range_start = datetime.date.today() - datetime.timedelta(days=days_ago+1)
     range_end = datetime.date.today() - datetime.timedelta(days=days_ago)
     
-    cond = Condition("time_submitted", ">=", date_to_timestamp(range_start))
-    cond &= Condition("time_submitted", "<", date_to_timestamp(range_end))
+    cond = time_range("time_submitted", date_to_timestamp(range_start),
+                      date_to_timestamp(range_end))
+    cond &= Condition("permalink", "IS NOT", None)
 
     query = SelectQuery(table=ENTRY_TABLE,
+                        columns="permalink",
                         where=cond)
 
-    posts = filter(lambda entry: isinstance(entry, Post), execute_query(query))
-
-    for post in posts:
-        for entry in fetch_post(post.permalink):
-            add_update_object(entry, ENTRY_TABLE)
+    # a day's permalinks are few, and are read in full so that no cursor is
+    # held open while each post is fetched from reddit
+    for post in execute_query(query, transpose=False):
+        entries = list(fetch_post(post["permalink"]))
+        add_update_objects(entries, ENTRY_TABLE)
+        percolate(entries)
 
 
 def get_subreddits():
@@ -139,6 +147,19 @@ def scrape(subreddits):
     if type(subreddits) is str:
         subreddits = [subreddits]
 
-    for entry in fetch_data(subreddits):
-        digest_entry(entry)
-        add_update_object(entry, ENTRY_TABLE)
+    # entries awaiting their batched write, by id; digest_entry only sees
+    # written entries, so one fetched twice in a batch is digested once
+    batch = {}
+
+    try:
+        for entry in fetch_data(subreddits):
+            if entry.id not in batch:
+                digest_entry(entry)
+            batch[entry.id] = entry
+            if len(batch) >= UPSERT_CHUNK_SIZE:
+                add_update_objects(list(batch.values()), ENTRY_TABLE)
+                percolate(batch.values())
+                batch = {}
+    finally:
+        add_update_objects(list(batch.values()), ENTRY_TABLE)
+        percolate(batch.values())
@@ -3,14 +3,86 @@ Submodule providing database search functionality
 """
 
 import abc
+import base64
+import hashlib
+import heapq
+import itertools
+import json
 import re
 
-from .constants import ENTRY_TABLE, KEYWORD_COLUMNS
-from .database import execute_query
-from .query import Condition, SelectQuery
+from collections import Counter, OrderedDict
+from datetime import datetime
+from functools import lru_cache, partial
+
+from .archive import entry_tables
+from .cache import cached
+from .constants import (
+    COUNT_CAP,
+    ENTRY_FIELDS,
+    ENTRY_TABLE,
+    FULLTEXT_MIN_TOKEN,
+    FULLTEXT_STOPWORDS,
+    INDEX_MAX_CANDIDATES,
+    KEYWORD_COLUMNS,
+    SEARCH_SLICE_DAYS,
+    SEARCH_SLICE_WORKERS,
+    SQL_CACHE_SIZE
+)
+from .database import (
+    DatabaseError,
+    UnknownColumnError,
+    estimate_rows,
+    execute_parallel,
+    execute_query,
+    get_backend,
+    iter_query
+)
+from .models import row_decoder
+from .query import (
+    Condition,
+    RawQuery,
+    SelectQuery,
+    dialect,
+    in_condition,
+    time_range
+)
+from .snippets import match_pattern, snippet
+from .textindex import IndexFormatError, fold, get_index
 from .utils import date_to_timestamp
 
-QUOTE_PATTERN = re.compile(r"^([\"'])(?P<text>.*)\1$")
+# Terms made only of these characters tokenize the same way for FULLTEXT as
+# they read; anything else (punctuation, LIKE wildcards) is matched with LIKE
+FULLTEXT_TERM_PATTERN = re.compile(r"^[A-Za-z0-9 ]+$")
+
+# Folded search terms the text index can look up: words of letters and
+# digits separated by single spaces
+INDEX_TERM_PATTERN = re.compile(r"^[a-z0-9]+(?: [a-z0-9]+)*$")
+
+# Ways of counting search results: every match, matches up to COUNT_CAP, or
+# the optimizer's estimate
+COUNT_EXACT, COUNT_CAPPED, COUNT_ESTIMATED = "exact", "capped", "estimated"
+
+COUNT_MODES = (COUNT_EXACT, COUNT_CAPPED, COUNT_ESTIMATED)
+
+# Sort columns whose results can be paged through by keyset, ties being
+# broken by id
+KEYSET_COLUMNS = {"time_submitted", "up_votes"}
+
+# Intervals a histogram can be bucketed by
+HISTOGRAM_INTERVALS = ("day", "week", "month")
+
+DAY_SECONDS = 24 * 60 * 60
+
+WEEK_SECONDS = 7 * DAY_SECONDS
+
+# Start of the first week from Monday after the epoch, 1970-01-05
+_WEEK_START = 4 * DAY_SECONDS
+
+ORDER_PATTERN = re.compile(r"^\s*(\w+)(?:\s+(ASC|DESC))?\s*$", re.IGNORECASE)
+
+# Kinds of text index results: a set of documents, every document but a set,
+# or every document when the index cannot tell
+_SET, _ALL_BUT, _UNKNOWN = range(3)
 
 
 class ASTNode(object, metaclass=abc.ABCMeta):
@@ -22,54 +94,27 @@ class ASTNode(object, metaclass=abc.ABCMeta):
 
 
 class OperatorNode(ASTNode, metaclass=abc.ABCMeta):
+    """
+    An AND or OR of any number of operands; the first two are also its left
+    and right children
+    """
+
     NAME = None
 
-    def __gt__(self, other):
-        if not isinstance(other, OperatorNode):
-            message = "unorderable types {} > {}".format(self.__class__,
-                                                         other.__class__)
-            raise TypeError(message)
-        return OPERATOR_PRECEDENCE[self.__class__] > OPERATOR_PRECEDENCE[
-            other.__class__]
-
-    def __lt__(self, other):
-        if not isinstance(other, OperatorNode):
-            message = "unorderable types {} < {}".format(self.__class__,
-                                                         other.__class__)
-            raise TypeError(message)
-        return OPERATOR_PRECEDENCE[self.__class__] < OPERATOR_PRECEDENCE[
-            other.__class__]
-
-    def __ge__(self, other):
-        if not isinstance(other, OperatorNode):
-            message = "unorderable types {} >= {}".format(self.__class__,
-                                                          other.__class__)
-            raise TypeError(message)
-        return OPERATOR_PRECEDENCE[self.__class__] >= OPERATOR_PRECEDENCE[
-            other.__class__]
-
-    def __le__(self, other):
-        if not isinstance(other, OperatorNode):
-            message = "unorderable types {} <= {}".format(self.__class__,
-                                                          other.__class__)
-            raise TypeError(message)
-        return OPERATOR_PRECEDENCE[self.__class__] <= OPERATOR_PRECEDENCE[
-            other.__class__]
+    def __init__(self, *children: ASTNode):
+        children = [child for child in children if child is not None]
+        padded = children + [None, None]
+        super().__init__(self.NAME, padded[0], padded[1])
+        self.children = children
 
 
 class AndNode(OperatorNode):
     NAME = "AND"
 
-    def __init__(self, left_child: ASTNode = None, right_child: ASTNode = None):
-        super().__init__(AndNode.NAME, left_child, right_child)
-
 
 class OrNode(OperatorNode):
     NAME = "OR"
 
-    def __init__(self, left_child: ASTNode = None, right_child: ASTNode = None):
-        super().__init__(OrNode.NAME, left_child, right_child)
-
 
 class TextNode(ASTNode):
     def __init__(self, data: str):
@@ -82,11 +127,15 @@ class NotNode(ASTNode):
     def __init__(self, child: ASTNode = None):
         super().__init__(NotNode.NAME, child)
 
-OPERATOR_PRECEDENCE = {
-    AndNode: 2,
-    OrNode: 1
-    # NOT Tokens are parsed separately, no need to assign precedence
-}
+
+class ConstantNode(ASTNode):
+    """
+    An expression normalized to always or never match
+    """
+
+    def __init__(self, value: bool):
+        super().__init__(value)
+
 
 OPERATOR_TOKENS = {
     AndNode.NAME: AndNode,
@@ -94,139 +143,228 @@ OPERATOR_TOKENS = {
     NotNode.NAME: NotNode
 }
 
-OPERATOR_ACTIONS = {
-    AndNode: lambda a, b: a & b,
-    OrNode: lambda a, b: a | b,
-    NotNode: lambda a, b=None: ~a
-}
-
 QUOTES = "'\""
 
+# Parentheses, quoted terms, and bare words (operators, or invalid tokens)
+TOKEN_PATTERN = re.compile(r"""\s*(?:([()])|"([^"]*)"|'([^']*)'|([^\s()'"]+)|(.))""")
+
 
 def expression_to_tree(expression):
     """
-    A recursive decent parser using the shunting-yard algorithm to convert
-    a well-formed expression string into an abstract syntax tree. The root
-    node of this tree is returned.
+    Parse a well-formed expression string into an abstract syntax tree by
+    recursive descent over its tokens, returning the root node. NOT binds
+    tighter than AND, which binds tighter than OR; AND and OR chains become
+    single nodes with every operand as a child.
     """
 
-    # break string into tokens, parsing parenthesized sub-expressions
+    tokens = _tokenize(expression)
+    if not tokens:
+        raise ExpressionError("Empty expression")
+    node, position = _parse_or(tokens, 0)
+    if position < len(tokens):
+        raise ExpressionError(_unexpected(tokens[position]))
+    return node
 
-    tokens = []
-    current_token = ""
-    in_quotes = False
-    paren_count = 0
-    paren_start = None
-
-    for i, c in enumerate(expression):
-
-        if c in QUOTES and paren_count == 0:
-            if in_quotes:
-                tokens.append(current_token + c)
-                current_token = ""
-                in_quotes = False
-            else:
-                in_quotes = True
-                if current_token:
-                    tokens.append(current_token)
-                current_token = c
-        elif c == " " and not in_quotes and paren_count == 0:
-            if current_token:
-                tokens.append(current_token)
-            current_token = ""
-        elif c == "(":
-            paren_count += 1
-            if paren_count == 1:
-                paren_start = i
-        elif c == ")":
-            paren_count -= 1
-            if paren_count == -1:
-                raise RuntimeError("Unbalanced right parenthesis in expression")
-            if paren_count == 0:
-                tokens.append(expression_to_tree(expression[paren_start + 1:i]))
-                current_token = ""
-        elif paren_count == 0:
-            current_token += c
-
-    if current_token:
-        tokens.append(current_token)
-
-    if paren_count > 0:
-        raise RuntimeError("Unbalanced left parenthesis in expression")
-
-    # convert string tokens to ASTNodes
-
-    nodes = []
-
-    for token in tokens:
-
-        if isinstance(token, ASTNode):
-            nodes.append(token)
-            continue
 
-        # noinspection PyTypeChecker
-        match = QUOTE_PATTERN.match(token)
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def compile_expression(expression):
+    """
+    Parse and normalize an expression, caching the resulting tree per
+    expression string. The tree is shared between calls, so it must not be
+    modified.
+    """
+
+    return normalize_tree(expression_to_tree(expression))
+
 
-        if token.upper() in OPERATOR_TOKENS:
-            nodes.append(OPERATOR_TOKENS[token.upper()]())
-        elif match:
-            nodes.append(TextNode(match.group("text")))
+def normalize_tree(node):
+    """
+    Rewrite a tree into an equivalent normal form: nested ANDs and ORs are
+    flattened, double negations removed, duplicate operands dropped, an
+    operand next to its own negation or a constant collapses its parent, an
+    operand absorbs the groups of the other operator containing it, and the
+    remaining operands are sorted cheapest first.
+    """
+
+    if isinstance(node, (TextNode, ConstantNode)):
+        return node
+    elif isinstance(node, NotNode):
+        child = normalize_tree(node.left_child)
+        if isinstance(child, NotNode):
+            return child.left_child
+        if isinstance(child, ConstantNode):
+            return ConstantNode(not child.data)
+        return NotNode(child)
+    elif isinstance(node, OperatorNode):
+        return _normalize_operator(node)
+    else:
+        raise RuntimeError("Unrecognized node type `{}`".format(node.__class__))
+
+
+def _normalize_operator(node):
+
+    operator = node.__class__
+    # TRUE decides an OR and FALSE an AND; the other constant is a no-op
+    deciding = operator is OrNode
+
+    operands = []
+    for child in (normalize_tree(c) for c in node.children):
+        if isinstance(child, operator):
+            operands.extend(child.children)
         else:
-            raise RuntimeError(
-                "Invalid token `{}` in expression string".format(token))
+            operands.append(child)
+
+    unique = OrderedDict()
+    for operand in operands:
+        if isinstance(operand, ConstantNode):
+            if operand.data == deciding:
+                return ConstantNode(deciding)
+            continue
+        unique.setdefault(_node_key(operand), operand)
 
-    # parse NOT tokens
+    for operand in unique.values():
+        if (isinstance(operand, NotNode)
+                and _node_key(operand.left_child) in unique):
+            return ConstantNode(deciding)
 
-    infix_nodes = []
+    dual = OrNode if operator is AndNode else AndNode
+    operands = [operand for operand in unique.values()
+                if not (isinstance(operand, dual)
+                        and any(_node_key(child) in unique
+                                for child in operand.children))]
 
-    nodes.reverse()
+    if not operands:
+        return ConstantNode(not deciding)
+    if len(operands) == 1:
+        return operands[0]
+    operands.sort(key=lambda operand: (_node_cost(operand), _node_key(operand)))
+    return operator(*operands)
 
-    while nodes:
-        node = nodes.pop()
-        if isinstance(node, NotNode):
-            node.left_child = nodes.pop()
-        infix_nodes.append(node)
 
-    # set up nodes as a stack
+def _node_cost(node):
+    """
+    Relative cost of evaluating a subtree, its number of terms
+    """
 
-    infix_nodes.reverse()
+    if isinstance(node, TextNode):
+        return 1
+    elif isinstance(node, NotNode):
+        return _node_cost(node.left_child)
+    elif isinstance(node, OperatorNode):
+        return sum(_node_cost(child) for child in node.children)
+    return 0
 
-    # shunting-yard
 
-    operator_stack = []
-    operand_stack = []
+def _node_key(node):
+    """
+    Hashable key under which equivalent subtrees are equal; LIKE ignores
+    the case of ASCII letters
+    """
 
-    while infix_nodes:
-        node = infix_nodes.pop()
-        if isinstance(node, OperatorNode):
-            if operator_stack and operator_stack[-1] >= node:
-                operand_stack.append(operator_stack.pop())
-            operator_stack.append(node)
-        else:
-            operand_stack.append(node)
+    if isinstance(node, TextNode):
+        text = node.data
+        plain = all(ord(character) < 128 for character in text)
+        return "T", text.lower() if plain else text
+    elif isinstance(node, NotNode):
+        return "N", _node_key(node.left_child)
+    elif isinstance(node, ConstantNode):
+        return "C", node.data
+    elif isinstance(node, OperatorNode):
+        return node.NAME, tuple(sorted(_node_key(c) for c in node.children))
+    else:
+        raise RuntimeError("Unrecognized node type `{}`".format(node.__class__))
+
+
+def _parse_or(tokens, position):
 
-    operand_stack.extend(operator_stack[::-1])
+    operands = []
+    while True:
+        node, position = _parse_and(tokens, position)
+        operands.append(node)
+        if position < len(tokens) and tokens[position] == OrNode.NAME:
+            position += 1
+        else:
+            break
+    return (operands[0] if len(operands) == 1 else OrNode(*operands)), position
 
-    operand_stack.reverse()
 
-    output_stack = []
+def _parse_and(tokens, position):
 
-    while operand_stack:
-        node = operand_stack.pop()
-        if isinstance(node, OperatorNode):
-            node.left_child = output_stack.pop()
-            node.right_child = output_stack.pop()
-        output_stack.append(node)
+    operands = []
+    while True:
+        node, position = _parse_not(tokens, position)
+        operands.append(node)
+        if position < len(tokens) and tokens[position] == AndNode.NAME:
+            position += 1
+        else:
+            break
+    return (operands[0] if len(operands) == 1 else AndNode(*operands)), position
+
+
+def _parse_not(tokens, position):
+
+    if position >= len(tokens):
+        raise ExpressionError("Expression ends where a term was expected")
+    token = tokens[position]
+    if token == NotNode.NAME:
+        node, position = _parse_not(tokens, position + 1)
+        return NotNode(node), position
+    if isinstance(token, TextNode):
+        position += 1
+        if (position < len(tokens) and tokens[position] not in
+                (AndNode.NAME, OrNode.NAME, ")")):
+            raise ExpressionError("Expected AND or OR before {}".format(
+                _unexpected(tokens[position], describe=False)))
+        return token, position
+    if token == "(":
+        node, position = _parse_or(tokens, position + 1)
+        if position >= len(tokens) or tokens[position] != ")":
+            raise ExpressionError("Unbalanced left parenthesis in expression")
+        return node, position + 1
+    if token == ")":
+        raise ExpressionError("Unbalanced right parenthesis in expression")
+    raise ExpressionError(_unexpected(token))
+
+
+def _tokenize(expression):
+    """
+    Split an expression into "(", ")", operator names and TextNodes
+    """
 
-    return output_stack.pop()
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(expression):
+        paren, double, single, word, other = match.groups()
+        if paren:
+            tokens.append(paren)
+        elif double is not None or single is not None:
+            tokens.append(TextNode(double if double is not None else single))
+        elif word:
+            if word.upper() not in OPERATOR_TOKENS:
+                raise ExpressionError(
+                    "Invalid token `{}` in expression string".format(word))
+            tokens.append(word.upper())
+        elif other:
+            if other in QUOTES:
+                raise ExpressionError("Unterminated quote in expression")
+            raise ExpressionError(
+                "Invalid token `{}` in expression string".format(other))
+    return tokens
+
+
+def _unexpected(token, describe=True):
+
+    text = ("'{}'".format(token.data) if isinstance(token, TextNode)
+            else "`{}`".format(token))
+    return "Unexpected {} in expression".format(text) if describe else text
 
 
 def multi_column_condition(columns, operand, value):
     """
-    Generate an or-joined condition with a single value on multiple columns
+    Generate an or-joined condition with a single value on multiple columns,
+    in a stable column order
     """
     condition = Condition()
-    for column in columns:
+    for column in sorted(columns):
         condition |= Condition(column, operand, value)
     return condition
 
@@ -237,36 +375,643 @@ def tree_to_condition(node):
     """
 
     if isinstance(node, TextNode):
-        value = "%{}%".format(node.data)
-        return multi_column_condition(KEYWORD_COLUMNS, "LIKE", value)
-    elif node.__class__ in OPERATOR_ACTIONS:
-        action = OPERATOR_ACTIONS[node.__class__]
-        a = tree_to_condition(node.left_child)
-        b = tree_to_condition(node.right_child) if node.right_child else None
-        return action(a, b)
+        return _text_condition(node.data)
+    elif isinstance(node, ConstantNode):
+        return _constant_condition(node.data)
+    elif isinstance(node, NotNode):
+        return ~tree_to_condition(node.left_child)
+    elif isinstance(node, OperatorNode):
+        return _join([tree_to_condition(c) for c in node.children], node.NAME)
     else:
         raise RuntimeError("Unrecognized node type `{}`".format(node.__class__))
 
 
+def _text_condition(text):
+    """
+    Condition matching entries containing `text` in any keyword column. It
+    is never NULL, so negating it also matches comments, which have no title.
+    """
+
+    return multi_column_condition(
+        {"COALESCE({}, '')".format(column) for column in KEYWORD_COLUMNS},
+        "LIKE", "%{}%".format(text))
+
+
+def _constant_condition(value):
+    """
+    Condition always (the empty condition) or never matching
+    """
+
+    condition = Condition()
+    if not value:
+        condition.sql = "1 = 0"
+    return condition
+
+
+def _join(conditions, operator):
+    """
+    Join several conditions with AND or OR into one flat condition
+    """
+
+    conditions = [condition for condition in conditions if condition]
+    if len(conditions) == 1:
+        return conditions[0]
+    joined = Condition()
+    if conditions:
+        joined.sql = "({})".format(" {} ".format(operator).join(
+            [condition.sql for condition in conditions]))
+        joined.params = [p for condition in conditions
+                         for p in condition.params]
+    return joined
+
+
+class FulltextNode(object):
+    """
+    A search subtree expressible as one boolean mode FULLTEXT expression,
+    possibly negated
+    """
+
+    def __init__(self, expression, negated=False):
+        self.expression = expression
+        self.negated = negated
+
+
+def fulltext_term(text):
+    """
+    Boolean mode FULLTEXT form of a search term, or None for a term with
+    words too short to be indexed, stopwords, or characters FULLTEXT treats
+    as separators. Single words match as prefixes of words, several words
+    as a phrase, so unlike LIKE neither matches inside a word.
+    """
+
+    if not FULLTEXT_TERM_PATTERN.match(text):
+        return None
+    words = text.lower().split()
+    if not words or any(len(word) < FULLTEXT_MIN_TOKEN
+                        or word in FULLTEXT_STOPWORDS for word in words):
+        return None
+    if len(words) == 1:
+        return words[0] + "*"
+    return '"{}"'.format(" ".join(words))
+
+
+def tree_to_fulltext(node):
+    """
+    Recursively convert an ASTNode to a Condition which uses FULLTEXT. The
+    largest subtrees expressible in boolean mode become single MATCH
+    conditions, so the index is searched once for them; terms FULLTEXT
+    cannot match fall back to LIKE individually.
+    """
+
+    return _fulltext_condition(_compile_fulltext(node))
+
+
+def _compile_fulltext(node):
+    """
+    Convert an ASTNode to a FulltextNode where possible, otherwise to a
+    Condition
+    """
+
+    if isinstance(node, TextNode):
+        term = fulltext_term(node.data) if dialect().fulltext else None
+        if term is None:
+            return _text_condition(node.data)
+        return FulltextNode(term)
+    elif isinstance(node, NotNode):
+        child = _compile_fulltext(node.left_child)
+        if isinstance(child, FulltextNode) and not child.negated:
+            return FulltextNode(child.expression, negated=True)
+        return ~_fulltext_condition(child)
+    elif isinstance(node, ConstantNode):
+        return _constant_condition(node.data)
+    elif isinstance(node, OperatorNode):
+        parts = [_compile_fulltext(child) for child in node.children]
+        fulltext = [part for part in parts if isinstance(part, FulltextNode)]
+        others = [part for part in parts if not isinstance(part, FulltextNode)]
+        combined, leftover = _combine_fulltext(node, fulltext)
+        if combined and not others and not leftover:
+            return combined
+        # the single MATCH is evaluated before any LIKE
+        conditions = [_fulltext_condition(combined)] if combined else []
+        conditions.extend(_fulltext_condition(part) for part in leftover)
+        conditions.extend(others)
+        return _join(conditions, node.NAME)
+    else:
+        raise RuntimeError("Unrecognized node type `{}`".format(node.__class__))
+
+
+def _combine_fulltext(node, parts):
+    """
+    Combine the FulltextNodes among the operands of an AND or OR node into
+    one where boolean mode can express it.
+    :return: (combined FulltextNode or None, list of the parts left over)
+    """
+
+    positive = [part for part in parts if not part.negated]
+    negative = [part for part in parts if part.negated]
+    if len(parts) < 2:
+        return (parts[0] if parts else None), []
+    if isinstance(node, AndNode):
+        if positive:
+            return FulltextNode(" ".join(
+                ["+({})".format(part.expression) for part in positive]
+                + ["-({})".format(part.expression) for part in negative])), []
+        # NOT x AND NOT y is NOT (x OR y)
+        return FulltextNode(" ".join(["({})".format(part.expression)
+                                      for part in negative]),
+                            negated=True), []
+    if len(positive) < 2:
+        return None, parts
+    return FulltextNode(" ".join(["({})".format(part.expression)
+                                  for part in positive])), negative
+
+
+def _fulltext_condition(part):
+    """
+    Condition for a compiled part of a search tree
+    """
+
+    if not isinstance(part, FulltextNode):
+        return part
+    condition = Condition()
+    condition.sql = dialect().fulltext
+    condition.params = [part.expression]
+    return ~condition if part.negated else condition
+
+
+def tree_to_candidates(node, index=None):
+    """
+    Ids of the entries which may match a search tree according to the text
+    index, or None if the index is incomplete or cannot narrow the search
+    down to INDEX_MAX_CANDIDATES entries. Every matching entry is among the
+    candidates, but candidates still have to be checked against the tree.
+    """
+
+    index = index or get_index()
+    if not index.complete:
+        return None
+    try:
+        segments = index.segments()
+    except (OSError, IndexFormatError):
+        return None
+    candidates = set()
+    for segment in segments:
+        kind, documents, _ = _evaluate(node, segment)
+        if kind != _SET:
+            return None
+        candidates.update(segment.entry_ids(sorted(documents)))
+        if len(candidates) > INDEX_MAX_CANDIDATES:
+            return None
+    return candidates
+
+
+def _evaluate(node, segment):
+    """
+    Evaluate an ASTNode against one index segment.
+    :return: (kind, documents, exact) triple; inexact results may include
+             documents which do not match
+    """
+
+    if isinstance(node, TextNode):
+        text = fold(node.data)
+        if not INDEX_TERM_PATTERN.match(text):
+            return _UNKNOWN, None, False
+        # several words are looked up separately, which finds a superset of
+        # the entries containing the phrase
+        words = text.split(" ")
+        documents = None
+        for word in words:
+            found = segment.term_documents(word)
+            if found is None:
+                return _UNKNOWN, None, False
+            documents = found if documents is None else documents & found
+        return _SET, documents, len(words) == 1
+    elif isinstance(node, NotNode):
+        kind, documents, exact = _evaluate(node.left_child, segment)
+        if not exact:
+            return _UNKNOWN, None, False
+        return (_ALL_BUT if kind == _SET else _SET), documents, True
+    elif isinstance(node, ConstantNode):
+        return (_ALL_BUT if node.data else _SET), set(), True
+    elif isinstance(node, OperatorNode):
+        result = None
+        for child in node.children:
+            evaluated = _evaluate(child, segment)
+            result = (evaluated if result is None
+                      else _combine_candidates(node, result, evaluated))
+        return result
+    else:
+        raise RuntimeError("Unrecognized node type `{}`".format(node.__class__))
+
+
+def _combine_candidates(node, a, b):
+    """
+    Combine the index results of the children of an AND or OR node through
+    intersection, union and difference of their documents
+    """
+
+    (kind_a, documents_a, exact_a), (kind_b, documents_b, exact_b) = a, b
+    exact = exact_a and exact_b
+    if isinstance(node, AndNode):
+        if kind_a == _UNKNOWN:
+            return kind_b, documents_b, False
+        if kind_b == _UNKNOWN:
+            return kind_a, documents_a, False
+        if kind_a == kind_b == _SET:
+            return _SET, documents_a & documents_b, exact
+        if kind_a == kind_b:
+            return _ALL_BUT, documents_a | documents_b, exact
+        included, excluded = ((documents_a, documents_b) if kind_a == _SET
+                              else (documents_b, documents_a))
+        return _SET, included - excluded, exact
+    if _UNKNOWN in (kind_a, kind_b):
+        return _UNKNOWN, None, False
+    if kind_a == kind_b == _SET:
+        return _SET, documents_a | documents_b, exact
+    if kind_a == kind_b:
+        return _ALL_BUT, documents_a & documents_b, exact
+    included, excluded = ((documents_a, documents_b) if kind_a == _SET
+                          else (documents_b, documents_a))
+    return _ALL_BUT, excluded - included, exact
+
+
+def build_index():
+    """
+    Rebuild the text index from the entries of both tiers.
+    :return: number of entries indexed
+    """
+
+    query = SelectQuery(columns="id, title, text_content",
+                        table=entry_tables(None))
+    return get_index().rebuild((row["id"], row["title"], row["text_content"])
+                               for row in iter_query(query, transpose=False))
+
+
+def keyset_order(order):
+    """
+    (column, descending) of an order whose results can be paged through by
+    keyset, or None
+    """
+
+    match = ORDER_PATTERN.match(order) if order else None
+    if not match or match.group(1) not in KEYSET_COLUMNS:
+        return None
+    return match.group(1), (match.group(2) or "").upper() == "DESC"
+
+
+def page_cursor(entry, order):
+    """
+    Opaque cursor of the page following `entry`, the last result of a page
+    sorted by `order`, or None if that page can only be reached by offset
+    """
+
+    key = keyset_order(order)
+    if not key or entry[key[0]] is None:
+        return None
+    column, descending = key
+    data = json.dumps([column, descending, entry[column], entry["id"]])
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def seek_condition(cursor, order):
+    """
+    Condition selecting the entries sorted after those up to a page_cursor,
+    as a range on the sort column which its index can seek to
+    """
+
+    try:
+        column, descending, value, entry_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+    except (TypeError, ValueError):
+        raise InvalidCursorError("Malformed page cursor")
+    if keyset_order(order) != (column, descending):
+        raise InvalidCursorError("The page cursor belongs to another order")
+    operator = "<" if descending else ">"
+    return (Condition(column, operator + "=", value)
+            & (Condition(column, operator, value)
+               | Condition("id", operator, entry_id)))
+
+
+@cached(ENTRY_TABLE)
+def histogram(keywords=None, expression=None, subreddit=None, after=None,
+              before=None, subreddit_exclude_mode=False, interval="day",
+              by_subreddit=False, by_type=False, fulltext=False, index=True):
+    """
+    Number of entries matching a search, given as search() takes it, per
+    UTC day, week (from Monday) or month of submission, counted by the
+    database. by_subreddit and by_type split each bucket by subreddit and
+    into posts and comments. Entries without a submission time are left
+    out. Wide ranges are counted in SEARCH_SLICE_WORKERS time slices at
+    once, each tier separately.
+    :return: list of dictionaries of each bucket's "start" date, number of
+             "entries" and, when split, "subreddit" and "type", by start
+    """
+
+    if interval not in HISTOGRAM_INTERVALS:
+        raise ValueError("Unknown histogram interval `{}`".format(interval))
+
+    after = date_to_timestamp(after) if after else None
+    before = date_to_timestamp(before) if before else None
+    condition = _search_condition(keywords, expression, subreddit,
+                                  subreddit_exclude_mode, after, before,
+                                  fulltext, index)[0]
+    condition &= Condition("time_submitted", ">", 0)
+
+    columns = ["{} AS bucket".format(_bucket(interval)), "COUNT(*) AS entries"]
+    group = ["bucket"]
+    if by_subreddit:
+        columns.append("subreddit")
+        group.append("subreddit")
+    if by_type:
+        columns.append("permalink IS NULL AS comment")
+        group.append("comment")
+
+    tables = entry_tables(after)
+    bounds = _time_bounds(tables, after, before)
+    if bounds is None:
+        return []
+    edges = [None, None]
+    if bounds[1] - bounds[0] > SEARCH_SLICE_DAYS * DAY_SECONDS:
+        edges = _slice_edges(*bounds, slices=SEARCH_SLICE_WORKERS)
+    tables = tables if isinstance(tables, tuple) else (tables,)
+    queries = [SelectQuery(table=table, columns=columns, group=", ".join(group),
+                           where=condition & time_range("time_submitted",
+                                                        lower, upper))
+               for table in tables for lower, upper in zip(edges, edges[1:])]
+
+    # buckets crossing slice edges are counted in both slices
+    counts = Counter()
+    for rows in execute_parallel(queries, SEARCH_SLICE_WORKERS):
+        for row in rows:
+            counts[row["bucket"], row.get("subreddit"),
+                   row.get("comment")] += row["entries"]
+    buckets = []
+    for (bucket, sub, comment), entries in sorted(
+            counts.items(), key=lambda item: (item[0][0], item[0][1] or "",
+                                              item[0][2] or 0)):
+        result = {"start": _bucket_start(bucket), "entries": entries}
+        if by_subreddit:
+            result["subreddit"] = sub
+        if by_type:
+            result["type"] = "comment" if comment else "post"
+        buckets.append(result)
+    return buckets
+
+
+def _bucket(interval):
+    """
+    SQL expression of the histogram bucket of an entry's submission time:
+    the timestamp of the start of its day or week, or its month as YYYY-MM
+    """
+
+    if interval == "month":
+        return dialect().month.format("time_submitted")
+    width, start = ((WEEK_SECONDS, _WEEK_START) if interval == "week"
+                    else (DAY_SECONDS, 0))
+    return "time_submitted - (time_submitted - {}) % {}".format(start, width)
+
+
+def _bucket_start(bucket):
+    """
+    ISO date of the start of a histogram bucket
+    """
+
+    if isinstance(bucket, str):
+        return bucket + "-01"
+    return datetime.utcfromtimestamp(bucket).date().isoformat()
+
+
+@cached(ENTRY_TABLE)
 def search(keywords=None, expression=None,
            subreddit=None, after=None, before=None,
            limit=None, offset=None, order=None,
-           include_count=False, subreddit_exclude_mode=False):
+           include_count=False, subreddit_exclude_mode=False, stream=False,
+           fulltext=False, index=True, cursor=None, count=COUNT_EXACT,
+           sliced=False, fields=None, snippets=False, sample=None,
+           seed=None):
     """
+    Search entries. With stream=True results are yielded lazily from a
+    server-side cursor instead of being returned as a list, and no count is
+    computed. Results sorted on a keyset column are ordered by id within
+    ties, and `cursor`, a page_cursor of the previous page, starts them
+    after that page without scanning it the way an offset does.
+
+    Keywords and expressions are looked up in the text index when it is
+    complete and narrows them down to few enough entries, which are then
+    fetched by id, unless index=False. Otherwise they are matched with LIKE,
+    or with fulltext=True through the FULLTEXT index where the backend has
+    one; FULLTEXT only finds single words at the start of a word, where LIKE
+    finds them anywhere, so it is never used unless asked for.
+
+    With include_count, (results, ResultCount) is returned, counted the
+    way `count` names: exactly, alongside the page where possible; up to
+    COUNT_CAP matches; or estimated from the text index or the plan.
+
+    With sliced=True, a page of results sorted on a keyset column is read
+    slice by slice of its time range rather than by sorting every match at
+    once, see _sliced_search.
+
+    `fields` projects the results onto dictionaries of those entry columns,
+    always including the id and the column the results are sorted on. With
+    snippets=True each result also comes with a "snippet", an HTML excerpt
+    of its text around the terms searched for (see snippets.snippet).
+
+    With `sample`, a uniform random sample of that many matches is returned
+    instead of a page, in random order unless `order` is given, and counted
+    exactly. The same `seed` always draws the same sample from the same
+    matches, see _sample.
+
+    Results are cached until entries are next written, see cache.cached.
+    """
+
+    if count not in COUNT_MODES:
+        raise ValueError("Unknown count mode `{}`".format(count))
+
+    after = date_to_timestamp(after) if after else None
+    before = date_to_timestamp(before) if before else None
+    condition, tree, candidates = _search_condition(
+        keywords, expression, subreddit, subreddit_exclude_mode, after,
+        before, fulltext, index)
+
+    count_condition = condition
+    if cursor:
+        condition &= seek_condition(cursor, order)
+
+    key = keyset_order(order)
+    if key:
+        direction = "DESC" if key[1] else "ASC"
+        order = "{0} {1}, id {1}".format(key[0], direction)
+
+    options = {
+        "table": entry_tables(after),
+        "where": condition
+    }
+
+    # the total covers every page, not only those after the cursor
+    count_options = dict(options, where=count_condition)
+
+    present = None
+    if fields is not None or snippets:
+        columns = _projection(fields, key)
+        pattern = match_pattern(_positive_terms(tree)) if snippets else None
+        present = partial(_present, columns=columns, snippets=snippets,
+                          pattern=pattern)
+        if columns is not None:
+            selected = set(columns) | ({"text_content"} if snippets else set())
+            options["columns"] = sorted(selected)
+
+    if limit:
+        options["limit"] = limit
+    if offset:
+        options["offset"] = offset
+    if order:
+        options["order"] = order
+
+    query = SelectQuery(**options)
+
+    if stream and not sample:
+        results = iter_query(query)
+        return map(present, results) if present else results
+
+    results = total = None
+    if sample:
+        results, total = _sampled_search(options, count_options, int(sample),
+                                         seed)
+    elif sliced and key and limit:
+        results = _sliced_search(options, key, after, before)
+    if (include_count and count == COUNT_EXACT and results is None and limit
+            and not cursor):
+        results, total = _page_and_total(options)
+        total = ResultCount(total) if results else None
+    if results is None:
+        results = execute_query(query)
+    if present:
+        results = [present(entry) for entry in results]
+
+    if not include_count:
+        return results
+    if total is None:
+        total = _count(count, count_options, candidates)
+    return results, total
+
+
+def _count(mode, options, candidates):
+    """
+    ResultCount of the matches of a search, counted the way `mode` names
+    """
+
+    if mode == COUNT_EXACT:
+        return _exact_count(options)
+    if mode == COUNT_ESTIMATED:
+        if candidates is not None:
+            # every match is a candidate, and few candidates do not match
+            return ResultCount(len(candidates), COUNT_ESTIMATED)
+        estimate = estimate_rows(SelectQuery(**options))
+        if estimate is not None:
+            return ResultCount(estimate, COUNT_ESTIMATED)
+    return _capped_count(options)
+
+
+def _positive_terms(node):
+    """
+    Text of the terms of an ASTNode which matching entries contain, those
+    not under a NOT
+    """
+
+    if isinstance(node, TextNode):
+        return [node.data]
+    if isinstance(node, OperatorNode) and not isinstance(node, NotNode):
+        return [term for child in node.children
+                for term in _positive_terms(child)]
+    return []
+
+
+def _present(entry, columns, snippets, pattern):
+    """
+    Dictionary of an entry's `columns`, or all of them if None, with its
+    snippet if asked for
+    """
+
+    presented = (entry.dict if columns is None
+                 else {column: entry[column] for column in columns})
+    if snippets:
+        presented["snippet"] = snippet(entry["text_content"], pattern)
+    return presented
+
+
+def _projection(fields, key):
+    """
+    Entry columns returned for `fields`, sorted, or None for every column
+    """
+
+    if fields is None:
+        return None
+    fields = set(fields)
+    for field in fields - ENTRY_FIELDS:
+        raise UnknownColumnError(field, ENTRY_TABLE)
+    return sorted(fields | {"id"} | ({key[0]} if key else set()))
+
+
+def _sample(options, size, seed):
+    """
+    Ids of a uniform random sample of `size` matches of a search, in random
+    order, and the number of matches. The ids of every match are streamed,
+    one tier at a time, and ranked by a hash of the seed and the id; those
+    ranked lowest are kept in a heap of `size`, so no match is sorted and
+    the sample does not depend on the order ids are read in.
+    :return: (list of ids, number of matches)
+    """
+
+    tables = options["table"]
+    tables = tables if isinstance(tables, tuple) else (tables,)
+    prefix = "{}:".format("" if seed is None else seed).encode("utf-8")
+    heap = []
+    matches = 0
+    for table in tables:
+        query = SelectQuery(table=table, columns="id", where=options["where"])
+        for row in iter_query(query, transpose=False):
+            matches += 1
+            digest = hashlib.sha1(
+                prefix + row["id"].encode("utf-8")).digest()[:8]
+            # a max-heap of the lowest ranks seen
+            item = (-int.from_bytes(digest, "big"), row["id"])
+            if len(heap) < size:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+    return [entry_id for _, entry_id in sorted(heap, reverse=True)], matches
+
+
+def _sampled_search(options, count_options, size, seed):
+    """
+    Results of a search sampled by _sample, fetched by id, and their
+    ResultCount
+    """
+
+    ids, matches = _sample(count_options, size, seed)
+    query = SelectQuery(**dict(options, where=in_condition("id", ids),
+                               limit=None, offset=None))
+    results = execute_query(query)
+    if "order" not in options:
+        position = {entry_id: number for number, entry_id in enumerate(ids)}
+        results.sort(key=lambda entry: position[entry["id"]])
+    return results, ResultCount(matches)
+
+
+def _search_condition(keywords, expression, subreddit,
+                      subreddit_exclude_mode, after, before, fulltext, index):
+    """
+    Condition matching the entries a search asks for, between the `after`
+    and `before` timestamps.
+    :return: (condition, normalized tree of the search terms or None,
+              candidate ids from the text index or None)
     """
 
     condition = Condition()  # Empty initial condition
 
-    if keywords:
-        keywords = [keywords] if type(keywords) is str else keywords
-        for word in keywords:
-            condition |= multi_column_condition(KEYWORD_COLUMNS,
-                                                "LIKE",
-                                                "%{}%".format(word))
-    elif expression:
-        tree = expression_to_tree(expression)
-        condition = tree_to_condition(tree)
+    to_condition = tree_to_fulltext if fulltext else tree_to_condition
 
+    # the cheap, indexed predicates come first, the text match last
     if subreddit:
         subreddit = [subreddit] if type(subreddit) is str else subreddit
         subreddit_condition = Condition()
@@ -277,34 +1022,215 @@ def search(keywords=None, expression=None,
                 subreddit_condition |= Condition("subreddit", sub)
         condition &= subreddit_condition
 
-    if after:
-        after = date_to_timestamp(after)
-        condition &= Condition("time_submitted", ">=", after)
+    condition &= time_range("time_submitted", after, before, inclusive=True)
+
+    tree = None
+    if keywords:
+        keywords = [keywords] if type(keywords) is str else keywords
+        tree = normalize_tree(OrNode(*[TextNode(word) for word in keywords]))
+    elif expression:
+        tree = compile_expression(expression)
+    candidates = None
+    if tree:
+        candidates = tree_to_candidates(tree) if index else None
+        if candidates is None:
+            condition &= to_condition(tree)
+        else:
+            condition &= (in_condition("id", sorted(candidates))
+                          & tree_to_condition(tree))
+    return condition, tree, candidates
 
-    if before:
-        before = date_to_timestamp(before)
-        condition &= Condition("time_submitted", "<=", before)
 
-    options = {
-        "table": ENTRY_TABLE,
-        "distinct": True,
-        "where": condition
-    }
+def _sliced_search(options, key, after, before):
+    """
+    A page of results sorted on a keyset column, read from time slices of
+    the search's range so that no slice sorts more than one page of
+    matches, or None if the range is too narrow to be worth slicing.
+
+    Results sorted by time are read one slice at a time from the end they
+    start at, each slice twice as wide as the one before, until the page is
+    full. Results sorted by score are read from SEARCH_SLICE_WORKERS slices
+    at once, each on its own pooled connection, and merged.
+    """
 
-    if include_count:
-        query = SelectQuery(columns="COUNT(*)", **options)
-        total_results = execute_query(query, transpose=False)[0]["COUNT(*)"]
+    column, descending = key
+    limit = int(options["limit"])
+    offset = int(options.get("offset") or 0)
+    needed = limit + offset
+    bounds = _time_bounds(options["table"], after, before)
+    width = SEARCH_SLICE_DAYS * DAY_SECONDS
+    if bounds is None or bounds[1] - bounds[0] <= width:
+        return None
+    first, last = bounds
+
+    def slice_query(lower, upper, limit):
+        # the outermost slices are left open, as the search's own time
+        # range already bounds them
+        condition = (options["where"]
+                     & time_range("time_submitted", lower, upper))
+        return SelectQuery(**dict(options, where=condition, limit=limit,
+                                  offset=None))
+
+    if column != "time_submitted":
+        edges = _slice_edges(first, last, SEARCH_SLICE_WORKERS)
+        pages = execute_parallel([slice_query(lower, upper, needed)
+                                  for lower, upper in zip(edges, edges[1:])],
+                                 SEARCH_SLICE_WORKERS)
+        merged = heapq.merge(*pages, reverse=descending,
+                             key=lambda entry: _sort_key(entry, column))
+        return list(itertools.islice(merged, offset, needed))
+
+    results = []
+    edge = None
+    while len(results) < needed:
+        if descending:
+            bound = (last + 1 if edge is None else edge) - width
+            lower, upper = (bound if bound > first else None), edge
+        else:
+            bound = (first if edge is None else edge) + width
+            lower, upper = edge, (bound if bound <= last else None)
+        results.extend(execute_query(slice_query(lower, upper,
+                                                 needed - len(results))))
+        if (lower if descending else upper) is None:
+            break
+        edge = bound
+        width *= 2
+    return results[offset:needed]
+
+
+def _slice_edges(first, last, slices):
+    """
+    Edges of `slices` equal time slices from `first` to `last`, the
+    outermost left open
+    """
 
-    if limit:
-        options["limit"] = limit
-    if offset:
-        options["offset"] = offset
-    if order:
-        options["order"] = order
+    step = -(-(last + 1 - first) // slices)
+    return [None] + [first + step * i for i in range(1, slices)] + [None]
 
-    query = SelectQuery(**options)
 
-    if include_count:
-        return execute_query(query), total_results
+def _sort_key(entry, column):
+    """
+    Key sorting entries on a column the way the database does, NULL first
+    """
+
+    return entry[column] is not None, entry[column] or 0, entry["id"]
+
+
+def _time_bounds(tables, after, before):
+    """
+    (first, last) submission time of the entries a search over `tables` may
+    match between `after` and `before`, or None if there are none. Entries
+    without a submission time are stored as 0 and not taken into account.
+    """
+
+    first, last = after, before
+    if first is None or last is None:
+        tables = tables if isinstance(tables, tuple) else (tables,)
+        for table in tables:
+            query = SelectQuery(table=table,
+                                columns="MIN(time_submitted) AS first, "
+                                        "MAX(time_submitted) AS last",
+                                where=Condition("time_submitted", ">", 0))
+            row = execute_query(query, transpose=False)[0]
+            if row["first"] is None:
+                continue
+            if after is None:
+                first = row["first"] if first is None else min(first,
+                                                               row["first"])
+            if before is None:
+                last = row["last"] if last is None else max(last, row["last"])
+    if first is None or last is None or first > last:
+        return None
+    return first, last
+
+
+def _capped_count(options):
+    """
+    ResultCount of the matches of a search, counting no further than
+    COUNT_CAP
+    """
+
+    matches = SelectQuery(columns="1", limit=COUNT_CAP + 1, **options)
+    query = RawQuery("SELECT COUNT(*) AS total FROM ({}) AS capped".format(
+        matches.sql), matches.params)
+    total = execute_query(query, transpose=False)[0]["total"]
+    if total > COUNT_CAP:
+        return ResultCount(COUNT_CAP, COUNT_CAPPED, capped=True)
+    return ResultCount(total, COUNT_CAPPED)
+
+
+def _exact_count(options):
+
+    query = SelectQuery(columns="COUNT(*)", **options)
+    return ResultCount(execute_query(query, transpose=False)[0]["COUNT(*)"])
+
+
+def _page_and_total(options):
+    """
+    A page of results and the total number of matches, counted by a window
+    over every match in the same statement; the total is only known when
+    the page is not empty. Both are None when the backend cannot count with
+    a window, and the total has to be counted separately.
+    """
+
+    backend = get_backend()
+    if not backend.WINDOW_FUNCTIONS:
+        return None, None
+    columns = list(options.get("columns", ["*"]))
+    columns.append("COUNT(*) OVER () AS total_results")
+    query = SelectQuery(limit_branches=False, **dict(options, columns=columns))
+    try:
+        rows = execute_query(query, transpose=False)
+    except DatabaseError:
+        raise
+    except Exception as error:
+        # servers too old for window functions reject the statement
+        print("Counting search results separately:", error)
+        backend.WINDOW_FUNCTIONS = False
+        return None, None
+    if not rows:
+        return [], None
+    columns = list(rows[0])
+    decode = row_decoder(columns)
+    return ([decode(tuple(row[c] for c in columns)) for row in rows],
+            rows[0]["total_results"])
+
+
+class ResultCount(int):
+    """
+    Total number of search results, with the way it was counted; a capped
+    count only bounds the total from below, and an estimate approximates it
+    """
+
+    def __new__(cls, value, mode=COUNT_EXACT, capped=False):
+        count = super().__new__(cls, value)
+        count.mode = mode
+        count.capped = capped
+        return count
+
+    def __str__(self):
+        if self.capped:
+            return "{}+".format(int(self))
+        if self.mode == COUNT_ESTIMATED:
+            return "~{}".format(int(self))
+        return str(int(self))
+
+
+class InvalidCursorError(Exception):
+    """
+    Exceptions raised when a page cursor cannot be used
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class ExpressionError(RuntimeError):
+    """
+    Exceptions raised for malformed search expressions
+    """
 
-    return execute_query(query)
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
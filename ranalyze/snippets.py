@@ -0,0 +1,68 @@
+"""
+Short, highlighted excerpts of entry text around the terms a search matched
+"""
+
+import html
+import re
+
+from .constants import SNIPPET_CONTEXT, SNIPPET_FRAGMENTS
+
+ELLIPSIS = "…"
+
+HIGHLIGHT = "<mark>{}</mark>"
+
+
+def match_pattern(terms):
+    """
+    Case insensitive pattern matching any of the search terms, longest
+    first, or None without terms
+    """
+
+    terms = sorted({term for term in terms if term}, key=len, reverse=True)
+    if not terms:
+        return None
+    return re.compile("|".join(re.escape(term) for term in terms),
+                      re.IGNORECASE)
+
+
+def snippet(text, pattern, context=SNIPPET_CONTEXT,
+            fragments=SNIPPET_FRAGMENTS):
+    """
+    HTML excerpt of `text` made of up to `fragments` fragments, each the
+    matches of `pattern` within `context` characters of one another and
+    `context` characters either side of them, with the matches wrapped in
+    <mark> and everything else escaped. The text is scanned once, up to the
+    end of the last fragment. Text without matches is excerpted from its
+    start.
+    """
+
+    if not text:
+        return ""
+    windows = []
+    matches = pattern.finditer(text) if pattern else ()
+    for match in matches:
+        start, end = match.span()
+        if windows and start - windows[-1][1] <= context * 2:
+            windows[-1][1] = end
+            windows[-1][2].append((start, end))
+            continue
+        if len(windows) == fragments:
+            break
+        windows.append([start, end, [(start, end)]])
+    if not windows:
+        excerpt = html.escape(text[:context * 2])
+        return excerpt + ELLIPSIS if len(text) > context * 2 else excerpt
+    parts = []
+    for first, last, spans in windows:
+        start = max(first - context, 0)
+        end = min(last + context, len(text))
+        parts.append(ELLIPSIS if start > 0 else "")
+        for match_start, match_end in spans:
+            parts.append(html.escape(text[start:match_start]))
+            parts.append(HIGHLIGHT.format(
+                html.escape(text[match_start:match_end])))
+            start = match_end
+        parts.append(html.escape(text[start:end]))
+    if end < len(text):
+        parts.append(ELLIPSIS)
+    return "".join(parts)
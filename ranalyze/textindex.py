@@ -0,0 +1,618 @@
+"""
+Embedded inverted index over the title and text of entries.
+
+The index is a list of immutable segment files in OPENSHIFT_DATA_DIR/index,
+named by a manifest. A segment holds the ids of its documents and, for every
+term, the sorted numbers of the documents containing it, stored as zlib
+compressed deltas, and the sorted suffixes of its terms, so that the terms
+containing a search term are found by bisection. Segments are memory-mapped
+for reading. Entries being written are appended as new segments, published
+once their write is committed, and runs of small segments are merged in the
+background.
+
+Terms are the lowercased, accent-folded ASCII alphanumeric runs of the text,
+so a search term made of such characters is contained in an entry's text
+exactly when it is contained in one of the entry's terms, as LIKE '%term%'
+would find it. Because an entry may be indexed again when it is rewritten,
+the index only proposes candidates: searches still check their text
+condition on the entries it finds.
+
+A segment is listed as pending while the write of its entries is under
+way. Searches read pending segments too, so that entries committed by a
+writer which died before publishing them are still found; merges only read
+published segments, so no entry's newest copy is one that was never
+committed.
+"""
+
+import fcntl
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import unicodedata
+import uuid
+import zlib
+
+from array import array
+from bisect import bisect_right
+from contextlib import contextmanager
+from itertools import accumulate
+
+from .constants import (
+    INDEX_DIR,
+    INDEX_MAX_TERMS,
+    INDEX_MERGE_FACTOR,
+    INDEX_SEGMENT_SIZE
+)
+
+# Bumped whenever the segment layout changes
+FORMAT_VERSION = 2
+
+MAGIC = b"RZIX"
+
+MANIFEST = "manifest.json"
+
+LOCK_FILE = "lock"
+
+# Seconds after which the writer of a segment still pending is presumed to
+# have died, and a rebuild drops the segment
+PENDING_TIMEOUT = 3600
+
+# magic, format version, document count, term count, then the offsets of the
+# document starts, document ids, term starts, terms, term suffixes, posting
+# starts and postings sections
+_HEADER = struct.Struct("<4sHxxII7Q")
+
+TERM_PATTERN = re.compile(r"[a-z0-9]+")
+
+_index = None
+
+_index_lock = threading.Lock()
+
+
+def fold(text):
+    """
+    Lowercase text with accents removed, as terms are indexed
+    """
+
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join([c for c in decomposed
+                    if not unicodedata.combining(c)]).lower()
+
+
+def get_index():
+    """
+    The process's TextIndex on OPENSHIFT_DATA_DIR
+    """
+
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = TextIndex(os.path.join(
+                os.environ.get("OPENSHIFT_DATA_DIR", "."), INDEX_DIR))
+        return _index
+
+
+def terms(*texts):
+    """
+    Set of the terms of some texts, None texts being skipped
+    """
+
+    found = set()
+    for text in texts:
+        if text:
+            found.update(TERM_PATTERN.findall(fold(text)))
+    return found
+
+
+def _array(typecode, data):
+
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _bytes(values):
+
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_segment(path, documents):
+    """
+    Write a segment file.
+    :param documents: list of (entry id, set of terms) pairs, numbered in
+                      order
+    """
+
+    postings = {}
+    for number, (_, document_terms) in enumerate(documents):
+        for term in document_terms:
+            postings.setdefault(term, []).append(number)
+    sorted_terms = sorted(postings)
+
+    ids = [document_id.encode("utf-8") for document_id, _ in documents]
+    id_starts = array("Q", [0])
+    id_starts.extend(accumulate(len(document_id) for document_id in ids))
+
+    term_blob = "".join([term + "\n" for term in sorted_terms]).encode("ascii")
+    term_starts = array("Q", [0])
+    term_starts.extend(accumulate(len(term) + 1 for term in sorted_terms))
+
+    # offsets in the term blob of every suffix of every term, in suffix order
+    suffixes = [term[i:] for term in sorted_terms for i in range(len(term))]
+    offsets = array("I", [start + i for start, term in zip(term_starts,
+                                                           sorted_terms)
+                          for i in range(len(term))])
+    suffix_offsets = array("I", [offsets[i] for i in
+                                 sorted(range(len(suffixes)),
+                                        key=suffixes.__getitem__)])
+    del suffixes, offsets
+
+    posting_blobs = []
+    for term in sorted_terms:
+        numbers = postings[term]
+        deltas = array("I", [numbers[0]])
+        deltas.extend(b - a for a, b in zip(numbers, numbers[1:]))
+        posting_blobs.append(zlib.compress(_bytes(deltas)))
+    posting_starts = array("Q", [0])
+    posting_starts.extend(accumulate(len(blob) for blob in posting_blobs))
+
+    sections = [_bytes(id_starts), b"".join(ids), _bytes(term_starts),
+                term_blob, _bytes(suffix_offsets), _bytes(posting_starts),
+                b"".join(posting_blobs)]
+    offsets = list(accumulate([_HEADER.size] + [len(s) for s in sections]))
+
+    temporary = "{}.tmp".format(path)
+    with open(temporary, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(documents),
+                                len(sorted_terms), *offsets[:-1]))
+        for section in sections:
+            file.write(section)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+class Segment(object):
+    """
+    A memory-mapped, read-only segment file. Document numbers are local to
+    the segment.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.documents, self.term_count,
+         *offsets) = _HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise IndexFormatError(path)
+        offsets.append(len(self._map))
+        sections = [(offsets[i], offsets[i + 1]) for i in range(7)]
+        self._id_starts = _array("Q", self._map[slice(*sections[0])])
+        self._ids_offset = sections[1][0]
+        # the term dictionary is searched on every query, so it is read
+        # once; postings are read from the map as they are needed
+        self._term_starts = _array("Q", self._map[slice(*sections[2])])
+        self._terms = self._map[slice(*sections[3])]
+        self._suffixes = _array("I", self._map[slice(*sections[4])])
+        self._posting_starts = _array("Q", self._map[slice(*sections[5])])
+        self._postings_offset = sections[6][0]
+
+    def containing(self, text):
+        """
+        Numbers of the terms containing `text`, or None if there are more
+        than INDEX_MAX_TERMS of them. The suffixes starting with `text` are
+        one run of the sorted suffixes, and each lies within such a term.
+        """
+
+        key = text.encode("ascii")
+        numbers = set()
+        for offset in self._suffixes[self._first_suffix(key):
+                                     self._first_suffix(key + b"\xff")]:
+            numbers.add(bisect_right(self._term_starts, offset) - 1)
+            if len(numbers) > INDEX_MAX_TERMS:
+                return None
+        return numbers
+
+    def entry_ids(self, numbers):
+        """
+        Entry ids of some documents
+        """
+
+        starts = self._id_starts
+        offset = self._ids_offset
+        return [self._map[offset + starts[n]:offset + starts[n + 1]]
+                .decode("utf-8") for n in numbers]
+
+    def postings(self, term):
+        """
+        Numbers of the documents containing the term numbered `term`, in
+        order
+        """
+
+        offset = self._postings_offset
+        start = offset + self._posting_starts[term]
+        end = offset + self._posting_starts[term + 1]
+        return accumulate(_array("I", zlib.decompress(self._map[start:end])))
+
+    def _first_suffix(self, key):
+        """
+        Position in the sorted suffixes of the first one not before `key`.
+        Suffixes are compared on as many bytes as the key has; the newline
+        ending each term sorts before every term character, as the end of a
+        shorter suffix would.
+        """
+
+        low, high = 0, len(self._suffixes)
+        while low < high:
+            middle = (low + high) // 2
+            offset = self._suffixes[middle]
+            if self._terms[offset:offset + len(key)] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def term(self, number):
+
+        return self._terms[self._term_starts[number]:
+                           self._term_starts[number + 1] - 1].decode("ascii")
+
+    def term_documents(self, text):
+        """
+        Set of the documents with a term containing `text`, or None if too
+        many terms contain it to look them all up
+        """
+
+        numbers = self.containing(text)
+        if numbers is None:
+            return None
+        documents = set()
+        for number in numbers:
+            documents.update(self.postings(number))
+        return documents
+
+
+class TextIndex(object):
+    """
+    The segments of an index directory, reloaded whenever its manifest
+    changes. Writers serialise changes to the manifest with a file lock, so
+    that the web and cron processes can share the directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self._manifest_stamp = None
+        self._manifest = None
+        self._segments = {}
+
+    @property
+    def complete(self):
+        """
+        Whether every entry is indexed, so that searches may rely on it
+        """
+
+        manifest = self._read()
+        return bool(manifest and manifest["complete"])
+
+    @property
+    def exists(self):
+
+        return os.path.exists(os.path.join(self.path, MANIFEST))
+
+    @contextmanager
+    def adding(self, documents):
+        """
+        Index entries written within the block as a new segment, pending
+        while the block runs, published if it completes and dropped if it
+        raises. Small segments are merged in a background thread once there
+        are too many. Nothing is done until the index has been built. An
+        index which fails to take the entries is marked incomplete, since
+        searches would miss them.
+        :param documents: iterable of (entry id, title, text) triples
+        """
+
+        entry = None
+        if self.exists:
+            documents = [(document_id, terms(title, text))
+                         for document_id, title, text in documents]
+            if documents:
+                entry = self._pend(documents)
+        try:
+            yield
+        except BaseException:
+            if entry is not None:
+                self._unpend(entry, publish=False)
+            raise
+        if entry is not None:
+            self._unpend(entry, publish=True)
+
+    def _pend(self, documents):
+        """
+        Write a segment and list it as pending.
+        :return: its manifest entry, None if it could not be written
+        """
+
+        try:
+            entry = {"name": self._write(documents),
+                     "documents": len(documents),
+                     "started": time.time()}
+            with self._locked() as manifest:
+                manifest.setdefault("pending", []).append(entry)
+        except Exception as error:
+            print("Could not index entries, the text index must be rebuilt:",
+                  error)
+            self.invalidate()
+            return None
+        return entry
+
+    def _unpend(self, entry, publish):
+        """
+        Publish a pending segment, or drop it and its file
+        """
+
+        try:
+            with self._locked() as manifest:
+                manifest["pending"] = [other for other in
+                                       manifest.get("pending", [])
+                                       if other["name"] != entry["name"]]
+                if publish:
+                    manifest["segments"].append({
+                        "name": entry["name"],
+                        "documents": entry["documents"]})
+                count = len(manifest["segments"])
+            if not publish:
+                self._remove([entry["name"]])
+        except Exception as error:
+            print("Could not index entries, the text index must be rebuilt:",
+                  error)
+            self.invalidate()
+            return
+        if publish and count > INDEX_MERGE_FACTOR:
+            threading.Thread(target=self.merge, name="ranalyze-index-merge"
+                             ).start()
+
+    def invalidate(self):
+        """
+        Stop searches from using the index until it is rebuilt
+        """
+
+        if not self.exists:
+            return
+        with self._locked() as manifest:
+            manifest["complete"] = False
+
+    def merge(self):
+        """
+        Merge the run of INDEX_MERGE_FACTOR consecutive segments holding the
+        fewest documents into one. Of the documents indexed more than once
+        within the run, only the newest is kept.
+        :return: whether segments were merged
+        """
+
+        if not self._merge_lock.acquire(blocking=False):
+            return False
+        try:
+            with self._locked() as manifest:
+                entries = list(manifest["segments"])
+            if len(entries) <= INDEX_MERGE_FACTOR:
+                return False
+            start = min(range(len(entries) - INDEX_MERGE_FACTOR + 1),
+                        key=lambda i: sum(e["documents"] for e in
+                                          entries[i:i + INDEX_MERGE_FACTOR]))
+            run = entries[start:start + INDEX_MERGE_FACTOR]
+            documents = _merged_documents([Segment(self._file(entry["name"]))
+                                           for entry in run])
+            name = self._write(documents)
+            names = [entry["name"] for entry in run]
+            with self._locked() as manifest:
+                current = [entry["name"] for entry in manifest["segments"]]
+                position = _find_run(current, names)
+                if position is None:
+                    # another process merged or rebuilt in the meantime
+                    os.remove(self._file(name))
+                    return False
+                manifest["segments"][position:position + len(names)] = [
+                    {"name": name, "documents": len(documents)}]
+            self._remove(names)
+            return True
+        finally:
+            self._merge_lock.release()
+
+    def rebuild(self, documents):
+        """
+        Replace the index with one built from every entry, and mark it
+        complete. Entries indexed by writers while the rebuild runs are
+        kept, and segments pending for longer than PENDING_TIMEOUT dropped.
+        :param documents: iterable of (entry id, title, text) triples
+        :return: number of entries indexed
+        """
+
+        os.makedirs(self.path, exist_ok=True)
+        started = time.time()
+        with self._locked() as manifest:
+            previous = {entry["name"] for entry in manifest["segments"]}
+        built = []
+        batch = []
+        total = 0
+        for document_id, title, text in documents:
+            batch.append((document_id, terms(title, text)))
+            if len(batch) >= INDEX_SEGMENT_SIZE:
+                built.append({"name": self._write(batch),
+                              "documents": len(batch)})
+                total += len(batch)
+                batch = []
+        if batch:
+            built.append({"name": self._write(batch), "documents": len(batch)})
+            total += len(batch)
+        with self._locked() as manifest:
+            newer = [entry for entry in manifest["segments"]
+                     if entry["name"] not in previous]
+            stale = [entry["name"] for entry in manifest["segments"]
+                     if entry["name"] in previous]
+            manifest["segments"] = built + newer
+            manifest["complete"] = True
+            pending = manifest.get("pending", [])
+            cutoff = started - PENDING_TIMEOUT
+            abandoned = [entry["name"] for entry in pending
+                         if entry["started"] < cutoff]
+            manifest["pending"] = [entry for entry in pending
+                                   if entry["started"] >= cutoff]
+        self._remove(stale + abandoned)
+        return total
+
+    def segments(self):
+        """
+        The open segments listed by the current manifest, published and
+        pending, oldest first
+        """
+
+        manifest = self._read()
+        if not manifest:
+            return []
+        with self._lock:
+            names = [entry["name"] for entry in manifest["segments"]
+                     + manifest.get("pending", [])]
+            segments = {}
+            for name in names:
+                segment = self._segments.get(name)
+                if segment is None:
+                    segment = Segment(self._file(name))
+                segments[name] = segment
+            # segments no longer listed are closed once no search uses them
+            self._segments = segments
+            return [segments[name] for name in names]
+
+    def stats(self):
+
+        manifest = self._read() or {"segments": [], "complete": False}
+        return {
+            "complete": manifest["complete"],
+            "segments": len(manifest["segments"]),
+            "pending": len(manifest.get("pending", [])),
+            "documents": sum(e["documents"] for e in manifest["segments"])
+        }
+
+    def _file(self, name):
+
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _locked(self):
+        """
+        Yield the manifest while holding the index's file lock, writing it
+        back afterwards
+        """
+
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file(LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                manifest = self._load() or {"segments": [], "complete": False}
+                yield manifest
+                temporary = self._file(MANIFEST + ".tmp")
+                with open(temporary, "w") as file:
+                    json.dump(manifest, file)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temporary, self._file(MANIFEST))
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self):
+
+        try:
+            with open(self._file(MANIFEST)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def _read(self):
+        """
+        The manifest, reread only when its file has changed
+        """
+
+        try:
+            stat = os.stat(self._file(MANIFEST))
+        except FileNotFoundError:
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if stamp != self._manifest_stamp:
+                self._manifest = self._load()
+                self._manifest_stamp = stamp
+            return self._manifest
+
+    def _remove(self, names):
+        """
+        Delete segment files; searches still reading them keep their maps
+        """
+
+        for name in names:
+            try:
+                os.remove(self._file(name))
+            except FileNotFoundError:
+                pass
+
+    def _write(self, documents):
+
+        name = "{}.seg".format(uuid.uuid4().hex)
+        write_segment(self._file(name), documents)
+        return name
+
+
+def _find_run(names, run):
+
+    for i in range(len(names) - len(run) + 1):
+        if names[i:i + len(run)] == run:
+            return i
+    return None
+
+
+def _merged_documents(segments):
+    """
+    (entry id, set of terms) of the documents of some segments, oldest
+    first, keeping only the newest copy of each entry
+    """
+
+    newest = {}
+    for s, segment in enumerate(segments):
+        for n, document_id in enumerate(
+                segment.entry_ids(range(segment.documents))):
+            newest[document_id] = (s, n)
+    documents = []
+    for s, segment in enumerate(segments):
+        kept = {}
+        for n, document_id in enumerate(
+                segment.entry_ids(range(segment.documents))):
+            if newest[document_id] == (s, n):
+                kept[n] = len(documents)
+                documents.append((document_id, set()))
+        for term in range(segment.term_count):
+            text = segment.term(term)
+            for n in segment.postings(term):
+                if n in kept:
+                    documents[kept[n]][1].add(text)
+    return documents
+
+
+class IndexFormatError(Exception):
+    """
+    Exceptions raised when a segment file is not in the current format
+    """
+
+    def __init__(self, path):
+        super().__init__("{} is not a version {} index segment".format(
+            path, FORMAT_VERSION))
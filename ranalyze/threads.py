@@ -0,0 +1,64 @@
+"""
+Reconstruction of a post's comment tree.
+
+Every comment of a thread shares the post's id as its root_id, so a thread
+is read with one indexed query on root_id, whatever its depth. The replies
+are grouped by parent in a single pass over the rows, which the database
+returns best first, and the tree is then walked once from the entry asked
+for, down to a limited depth and breadth. Branches left out are counted, so
+that they can be loaded separately from the reply they hang from, reusing
+the cached thread.
+"""
+
+from .archive import entry_tables
+from .cache import cached
+from .constants import ENTRY_TABLE, THREAD_BREADTH, THREAD_DEPTH
+from .database import execute_query, get_entry
+from .query import Condition, SelectQuery
+
+
+def get_thread(entry_id, depth=THREAD_DEPTH, breadth=THREAD_BREADTH):
+    """
+    An entry, post or comment, with its nested replies. Each entry has the
+    list of its "replies", at most `breadth` of them by up votes, and the
+    number of replies left out as "more". Replies more than `depth` levels
+    below the entry are left out. Comments whose parent was never scraped
+    are replies to the post.
+    :return: dictionary of the entry and its replies, None if there is no
+             such entry
+    """
+
+    top = get_entry(entry_id)
+    if top is None:
+        return None
+    replies = _replies(getattr(top, "root_id", None) or top.id)
+
+    thread = top.dict
+    stack = [(thread, 0)]
+    while stack:
+        node, level = stack.pop()
+        children = replies.get(node["id"], ())
+        shown = children[:breadth] if level < depth else ()
+        node["replies"] = [child.dict for child in shown]
+        node["more"] = len(children) - len(shown)
+        stack.extend((child, level + 1) for child in node["replies"])
+    return thread
+
+
+@cached(ENTRY_TABLE)
+def _replies(root_id):
+    """
+    Comments of a thread grouped by the id of the entry they reply to, each
+    group best first
+    """
+
+    query = SelectQuery(table=entry_tables(None),
+                        where=Condition("root_id", root_id),
+                        order="up_votes DESC, time_submitted")
+    comments = execute_query(query)
+    ids = {comment.id for comment in comments}
+    replies = {}
+    for comment in comments:
+        parent = comment.parent_id if comment.parent_id in ids else root_id
+        replies.setdefault(parent, []).append(comment)
+    return replies
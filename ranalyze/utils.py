@@ -4,6 +4,8 @@ Common utilities
 
 import datetime
 import re
+import struct
+import zlib
 from math import floor
 
 EPOCH = datetime.datetime.utcfromtimestamp(0)
@@ -46,3 +48,41 @@ def sanitize_string(text):
     """
 
     return INVALID_RE.sub(u'', text)
+
+
+def compress(text):
+    """
+    Compress text the way MySQL's COMPRESS() does, so that it can be read
+    back with UNCOMPRESS() or uncompress().
+
+    :param text:
+    :type text: str
+    :return: compressed text
+    :rtype: bytes
+    """
+
+    if text is None:
+        return None
+    data = str(text).encode("utf-8")
+    if not data:
+        return b""
+    return struct.pack("<I", len(data)) + zlib.compress(data)
+
+
+def uncompress(data):
+    """
+    Decompress text stored with MySQL's COMPRESS(): a 4 byte length prefix
+    followed by a zlib stream (and possibly a padding byte, which zlib
+    ignores). MySQL compresses the empty string to an empty value.
+
+    :param data:
+    :type data: bytes
+    :return: decompressed text
+    :rtype: str
+    """
+
+    if data is None:
+        return None
+    if not data:
+        return ""
+    return zlib.decompress(data[4:]).decode("utf-8")